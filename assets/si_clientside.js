@@ -0,0 +1,38 @@
+// Clientside rendering for COVID_SI_CALLBACK_MODE=clientside. Each
+// geography's outputs are fetched once from the server as a static JSON
+// document and kept, so switching back to a geography makes no request.
+(function() {
+    var documents = {};
+
+    function geographyData(url) {
+        if (!(url in documents)) {
+            documents[url] = fetch(url).then(function(response) {
+                if (!response.ok) {
+                    delete documents[url];
+                    throw new Error('Could not load ' + url + ' (' + response.status + ')');
+                }
+                return response.json();
+            });
+        }
+        return documents[url];
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        si: {
+            render_geography: function(geography, geography_data) {
+                // A cleared dropdown keeps the page as it is
+                if (!geography) {
+                    return geography_data.outputs.map(function() {
+                        return window.dash_clientside.no_update;
+                    });
+                }
+                var url = geography_data.url + encodeURIComponent(geography) + '.json';
+                return geographyData(url).then(function(outputs) {
+                    return geography_data.outputs.map(function(output) {
+                        return outputs[output];
+                    });
+                });
+            }
+        }
+    });
+})();
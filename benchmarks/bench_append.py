@@ -0,0 +1,84 @@
+# Cost of taking in a daily update as delta files appended to the loaded
+# snapshot, against reloading everything, for deltas of a few days to a
+# month of new rows for every geography. Runs on a copy of --data-dir (e.g.
+# a scale_data.py output).
+#
+#   python benchmarks/bench_append.py [--data-dir data] [--days 1 7 30] [--repeat 5]
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from si_data import default_data_dir, appendable, appends_dir, DataSnapshot
+
+
+def write_deltas(snapshot, days):
+    # `days` new rows per geography of every appendable table, copies of its
+    # last row at the table's spacing of dates, so they validate
+    rows = 0
+    for df_name in appendable:
+        frames = []
+        for geography in snapshot.geo_index.geographies(df_name):
+            df = snapshot.geo_index.select(df_name, geography)
+            if len(df) < 2:
+                continue
+            step = df['date'].iloc[-1] - df['date'].iloc[-2]
+            new = df.iloc[np.repeat(len(df) - 1, days)].copy()
+            new['date'] = df['date'].iloc[-1] + step * np.arange(1, days + 1)
+            frames.append(new)
+        delta = pd.concat(frames)
+        delta.to_csv(os.path.join(snapshot.data_dir, appends_dir, '{}-bench.csv'.format(df_name)), index = False, date_format = '%Y-%m-%d')
+        rows += len(delta)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-dir', default = default_data_dir)
+    parser.add_argument('--days', type = int, nargs = '+', default = [1, 7, 30], help = 'new rows per geography and table')
+    parser.add_argument('--repeat', type = int, default = 5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        # The columnar store is trusted by size and modification time, which
+        # copy2 keeps
+        shutil.copytree(args.data_dir, data_dir, dirs_exist_ok = True, copy_function = shutil.copy2,
+                        ignore = shutil.ignore_patterns('si*.sqlite', appends_dir))
+        os.makedirs(os.path.join(data_dir, appends_dir))
+        snapshot = DataSnapshot(data_dir)
+        snapshot.load()
+        print('{} geographies, {} figure1 rows'.format(len(snapshot.geographies), len(snapshot.df_dict['figure1'])))
+        print('{:>6}{:>12}{:>16}{:>16}{:>10}'.format('days', 'delta rows', 'append (ms)', 'reload (ms)', 'speedup'))
+
+        for days in args.days:
+            rows = write_deltas(snapshot, days)
+            append_seconds, reload_seconds = [], []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                appended = snapshot.successor()
+                append_seconds.append(time.perf_counter() - start)
+                assert appended.base_index is snapshot.base_index
+
+                # What a reload did before: load everything, delta files
+                # included, and compare it with the current data
+                start = time.perf_counter()
+                reloaded = DataSnapshot(data_dir)
+                reloaded.load()
+                reloaded.validate()
+                snapshot.changed_geographies(reloaded)
+                reload_seconds.append(time.perf_counter() - start)
+            print('{:>6}{:>12}{:>16.1f}{:>16.1f}{:>9.1f}x'.format(
+                days, rows, min(append_seconds) * 1e3, min(reload_seconds) * 1e3, min(reload_seconds) / min(append_seconds)
+            ))
+            for df_name in appendable:
+                os.remove(os.path.join(data_dir, appends_dir, '{}-bench.csv'.format(df_name)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+# Micro-benchmark of the Figure 2 CI-change lines: the pandas assembly with
+# one trace per breakpoint that si_sections used to do, against the NumPy
+# builder that emits every line as one trace. Both must draw the same
+# segments for every geography.
+#
+#   python benchmarks/bench_figure2_ci_change.py [--repeat 20]
+import os
+import sys
+import argparse
+import timeit
+import warnings
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objs as go
+
+# The legacy path warns about setting on copies on every call
+if not sys.warnoptions:
+    warnings.simplefilter("ignore")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from si_data import TableRegistry, GeographyIndex
+from si_sections import date_strings, ci_change_plot_data
+
+
+def legacy_ci_change_plot_data(figure2_filtered):
+    figure2_breakpoints_sip = figure2_filtered.loc[figure2_filtered.breakpoint_and_SIP_chg == 1,:]
+    figure2_breakpoints_sip.reset_index(inplace = True)
+    if figure2_breakpoints_sip.shape[0] > 0:
+        figure2_breakpoints_sip.loc[:,'breakpoint_ind'] = np.arange(0,figure2_breakpoints_sip.shape[0])
+        figure2_breakpoints_sip.loc[:,'ymin'] = np.min(figure2_filtered['percent_red'].values)
+        figure2_breakpoints_sip.loc[:,'ymax'] = np.max(figure2_filtered['percent_red'].values)
+        figure2_breakpoints_sip_both = pd.concat([figure2_breakpoints_sip, figure2_breakpoints_sip], axis = 0, ignore_index = True)
+        figure2_breakpoints_sip_both.reset_index(inplace = True)
+        figure2_breakpoints_sip_both.loc[:,'y'] = figure2_breakpoints_sip_both['ymax']
+        figure2_breakpoints_sip_both.loc[1:figure2_breakpoints_sip.shape[0],'y'] = figure2_breakpoints_sip_both['ymin']
+        figure2_breakpoints_sip_both.sort_values(by = ['breakpoint_ind','y'], inplace = True)
+
+    return [
+        go.Scatter(
+            x = date_strings(figure2_breakpoints_sip_both.loc[figure2_breakpoints_sip_both.breakpoint_ind == i,'date']),
+            y = figure2_breakpoints_sip_both.loc[figure2_breakpoints_sip_both.breakpoint_ind == i,'y'],
+            mode = 'lines',
+            line_color = 'mediumseagreen',
+            name = 'CI Change',
+            showlegend = bool(i == 0)
+        ) for i in figure2_breakpoints_sip['breakpoint_ind'].values
+    ] if figure2_breakpoints_sip.shape[0] > 0 else []
+
+
+def segments(traces):
+    # (date, y bottom, y top) of every vertical line, whatever the traces
+    lines = []
+    for trace in traces:
+        points = [(x, y) for x, y in zip(trace.x, trace.y) if x is not None]
+        for (x0, y0), (x1, y1) in zip(points[::2], points[1::2]):
+            assert x0 == x1
+            lines.append((x0, y0, y1))
+    return sorted(lines)
+
+
+def same_segments(legacy, vectorized):
+    if len(legacy) != len(vectorized):
+        return False
+    return all(
+        a[0] == b[0] and np.allclose(a[1:], b[1:], equal_nan = True) for a, b in zip(legacy, vectorized)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type = int, default = 20)
+    args = parser.parse_args()
+
+    geo_index = GeographyIndex(TableRegistry())
+    geographies = geo_index.geographies('figure2')
+    frames = {geography: geo_index.select('figure2', geography) for geography in geographies}
+
+    def legacy():
+        return [legacy_ci_change_plot_data(frames[geography]) for geography in geographies]
+
+    def vectorized():
+        return [
+            ci_change_plot_data(
+                date_strings(df['date']), df['percent_red'].values, df['breakpoint_and_SIP_chg'].values
+            ) for df in frames.values()
+        ]
+
+    legacy_traces, vectorized_traces = legacy(), vectorized()
+    for geography, a, b in zip(geographies, legacy_traces, vectorized_traces):
+        assert same_segments(segments(a), segments(b)), geography
+
+    legacy_seconds = min(timeit.repeat(legacy, number = 1, repeat = args.repeat)) / len(geographies)
+    vectorized_seconds = min(timeit.repeat(vectorized, number = 1, repeat = args.repeat)) / len(geographies)
+    print('geographies: {}, CI-change lines: {}'.format(len(geographies), sum(len(segments(t)) for t in legacy_traces)))
+    print('{:<12}{:>10}{:>14}'.format('path', 'traces', 'per geo (ms)'))
+    print('{:<12}{:>10}{:>14.2f}'.format('legacy', sum(map(len, legacy_traces)), legacy_seconds * 1e3))
+    print('{:<12}{:>10}{:>14.2f}'.format('vectorized', sum(map(len, vectorized_traces)), vectorized_seconds * 1e3))
+    print('speedup: {:.1f}x'.format(legacy_seconds / vectorized_seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# Compare the boolean mask filtering used by the callback with GeographyIndex
+# lookups, for every frame and every geography in data/.
+#
+#   python benchmarks/bench_geography_index.py [--repeat 20]
+import os
+import sys
+import argparse
+import timeit
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from si_data import df_names, GeographyIndex
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type = int, default = 20)
+    args = parser.parse_args()
+
+    df_dict = {df_name: pd.read_csv(os.path.join(data_dir, df_name + '.csv')) for df_name in df_names}
+    geographies = df_dict['figure1'].geography.unique()
+    geographies = list(geographies) + ['Atlantis']
+
+    def build():
+        geo_index = GeographyIndex(df_dict)
+        for df_name in df_names:
+            geo_index.table_ranges(df_name)
+        return geo_index
+
+    build_seconds = timeit.timeit(build, number = args.repeat) / args.repeat
+    geo_index = build()
+
+    print('index build: {:.2f} ms'.format(build_seconds * 1e3))
+    print('{:<14}{:>8}{:>14}{:>14}{:>10}'.format('frame', 'rows', 'mask (us)', 'index (us)', 'speedup'))
+
+    mask_total = index_total = 0
+    for df_name in df_names:
+        df = df_dict[df_name]
+
+        def mask():
+            for geography in geographies:
+                df.loc[df.geography == geography,:]
+
+        def index():
+            for geography in geographies:
+                geo_index.select(df_name, geography)
+
+        for geography in geographies:
+            assert geo_index.select(df_name, geography).equals(df.loc[df.geography == geography,:])
+
+        mask_seconds = min(timeit.repeat(mask, number = 1, repeat = args.repeat)) / len(geographies)
+        index_seconds = min(timeit.repeat(index, number = 1, repeat = args.repeat)) / len(geographies)
+        mask_total += mask_seconds
+        index_total += index_seconds
+        print('{:<14}{:>8}{:>14.1f}{:>14.1f}{:>9.1f}x'.format(
+            df_name, len(df), mask_seconds * 1e6, index_seconds * 1e6, mask_seconds / index_seconds
+        ))
+
+    print('{:<14}{:>8}{:>14.1f}{:>14.1f}{:>9.1f}x'.format(
+        'per request', '', mask_total * 1e6, index_total * 1e6, mask_total / index_total
+    ))
+
+
+if __name__ == '__main__':
+    main()
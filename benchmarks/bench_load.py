@@ -0,0 +1,86 @@
+# Cost of computing Figure 3 and Table 5 from raw hourly load with si_load:
+# a cold run, scanning every file, serially and in parallel, a rerun with one
+# new file of the latest days, against reading every file whole and taking
+# exact quantiles with a pandas groupby. The raw load is synthetic, a file
+# per geography and year with a daily and weekly shape and noise.
+#
+#   python benchmarks/bench_load.py [--geographies 50] [--years 2016 2020] [--workers 4]
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import si_load
+
+
+def write_load(load_dir, geographies, first, last, seed = 0):
+    rng = np.random.default_rng(seed)
+    rows = 0
+    for g in range(geographies):
+        level = rng.uniform(1e3, 5e4)
+        for year in range(first, last + 1):
+            times = pd.date_range('{}-01-01'.format(year), '{}-12-31 23:00'.format(year), freq = 'h')
+            shape = 1 + 0.2 * np.sin((times.hour - 6) / 24 * 2 * np.pi) - 0.1 * (times.dayofweek >= 5)
+            load = level * shape * (1 + 0.05 * rng.standard_normal(len(times)))
+            pd.DataFrame({'geography': 'Geography {}'.format(g), 'time': times.strftime('%Y-%m-%d %H:%M'), 'load': load.round(1)}).to_csv(
+                os.path.join(load_dir, 'geography{}-{}.csv'.format(g, year)), index = False
+            )
+            rows += len(times)
+    return rows
+
+
+def exact(load_dir, periods):
+    # The tables' quantiles the direct way: every file in memory, one groupby
+    month, first, last, year = periods
+    df = pd.concat([pd.read_csv(path) for path in si_load.load_paths(load_dir)])
+    times = pd.to_datetime(df['time'])
+    keep = (times.dt.month == month) & (times.dt.year.between(first, last) | (times.dt.year == year))
+    df, times = df.loc[keep], times.loc[keep]
+    groups = df.groupby([df['geography'], times.dt.year == year, times.dt.dayofweek >= 5, times.dt.hour])['load']
+    return groups.quantile([0.1, 0.5, 0.9]).unstack(), groups.mean()
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--geographies', type = int, default = 50)
+    parser.add_argument('--years', type = int, nargs = 2, default = [2016, 2020], metavar = ('FIRST', 'LAST'))
+    parser.add_argument('--workers', type = int, default = os.cpu_count())
+    args = parser.parse_args()
+    periods = (4, args.years[0], args.years[1] - 1, args.years[1])
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        load_dir = si_load.default_load_dir(data_dir)
+        os.makedirs(load_dir)
+        rows = write_load(load_dir, args.geographies, *args.years)
+        out_dir = os.path.join(data_dir, 'out')
+        print('{} geographies, {} files, {} rows'.format(args.geographies, len(si_load.load_paths(load_dir)), rows))
+
+        seconds, _ = timed(exact, load_dir, periods)
+        print('{:<36}{:>10.2f} s'.format('exact, every file in memory', seconds))
+        for workers in sorted({1, args.workers}):
+            cache_dir = os.path.join(data_dir, 'cache-{}'.format(workers))
+            seconds, (_, scanned) = timed(si_load.regenerate, data_dir, out_dir, None, periods, workers, cache_dir)
+            print('{:<36}{:>10.2f} s  ({} files scanned)'.format('si_load cold, {} workers'.format(workers), seconds, scanned))
+
+        # A week of the actual period for one geography, as a new file
+        times = pd.date_range('{}-{:02d}-01'.format(args.years[1], periods[0]), periods = 7 * 24, freq = 'h')
+        pd.DataFrame({'geography': 'Geography 0', 'time': times.strftime('%Y-%m-%d %H:%M'), 'load': 1e4}).to_csv(
+            os.path.join(load_dir, 'geography0-latest.csv'), index = False
+        )
+        seconds, (_, scanned) = timed(si_load.regenerate, data_dir, out_dir, None, periods, 1, cache_dir)
+        print('{:<36}{:>10.2f} s  ({} files scanned)'.format('si_load with one new file', seconds, scanned))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# Cost of the MARS knot search of si_mars: the forward pass over the CI
+# periods of --data-dir's geographies (e.g. a scale_data.py output), scoring
+# every candidate knot of a block of models at once, against fitting one
+# least squares problem per candidate knot and model, as a direct
+# implementation does; then the whole fit with 1 and --workers processes.
+#
+#   python benchmarks/bench_mars.py [--data-dir data] [--models 200] [--workers 4]
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import si_mars
+from si_data import default_data_dir, DataSnapshot
+
+
+def direct_forward(y, valid, length):
+    # Knots of the forward pass of one model, a least squares fit per
+    # candidate knot
+    y, valid = y[:length], valid[:length]
+    day = np.arange(length, dtype = 'float64')
+    endspan, minspan = si_mars.spans(np.array([valid.sum()]))
+    tss = ((y[valid] - y[valid].mean()) ** 2).sum() if valid.any() else 0.0
+    columns, knots, rss = [np.ones(length)], [], tss
+    if valid.sum() < 3 or tss <= 0:
+        return knots
+    for _ in range(1, si_mars.max_terms - 1, 2):
+        best = None
+        for knot in range(endspan, length - endspan):
+            if not valid[knot] or any(abs(knot - other) < minspan[0] for other in knots):
+                continue
+            X = np.stack(columns + [np.maximum(day - knot, 0), np.maximum(knot - day, 0)], axis = 1)[valid]
+            residuals = y[valid] - X @ np.linalg.lstsq(X, y[valid], rcond = None)[0]
+            if best is None or residuals @ residuals < best[1]:
+                best = (knot, residuals @ residuals)
+        if best is None or (rss - best[1]) / tss < si_mars.threshold or best[1] / tss <= si_mars.threshold:
+            break
+        knots.append(best[0])
+        columns += [np.maximum(day - best[0], 0), np.maximum(best[0] - day, 0)]
+        rss = best[1]
+    return knots
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-dir', default = default_data_dir)
+    parser.add_argument('--models', type = int, default = 200, help = 'longest periods the direct search is timed on')
+    parser.add_argument('--workers', type = int, default = os.cpu_count())
+    args = parser.parse_args()
+
+    snapshot = DataSnapshot(args.data_dir)
+    snapshot.load()
+    models, _, _, _, _, y, lengths = si_mars.design(snapshot.geo_index, snapshot.geographies)
+    valid = ~np.isnan(y)
+    print('{} geographies, {} periods'.format(len(snapshot.geographies), len(models)))
+
+    # The longest periods, which have the most candidate knots
+    sample = np.sort(np.argsort(-lengths, kind = 'mergesort')[:args.models])
+    start = time.perf_counter()
+    direct = [direct_forward(y[model], valid[model], lengths[model]) for model in sample]
+    direct_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    width = lengths[sample].max()
+    _, present, knots, _ = si_mars.forward(y[sample,:width], valid[sample,:width], lengths[sample])
+    vectorized_seconds = time.perf_counter() - start
+    same = all(
+        knots[position, 1::2][present[position, 1::2] | present[position, 2::2]].tolist() == direct[position] for position in range(len(sample))
+    )
+    print('forward pass of {} periods: direct {:.2f} s, vectorized {:.3f} s ({:.0f}x), same knots: {}'.format(
+        len(sample), direct_seconds, vectorized_seconds, direct_seconds / vectorized_seconds, same
+    ))
+
+    for workers in sorted({1, args.workers}):
+        start = time.perf_counter()
+        si_mars.mars(y, valid, lengths, workers)
+        print('fit of all {} periods, {} workers: {:.2f} s'.format(len(models), workers, time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# End-to-end latency of the single ten-output callback against the per-section
+# callbacks, measured over HTTP the way the browser issues them: one request
+# in 'single' mode, one concurrent request per section otherwise. The cache
+# is disabled so every request renders.
+#
+#   python benchmarks/bench_section_callbacks.py [--geographies 10]
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def serve(mode, port):
+    os.environ['COVID_SI_CALLBACK_MODE'] = mode
+    os.environ['COVID_SI_CACHE_SIZE'] = '0'
+    sys.path.insert(0, root_dir)
+    from werkzeug.serving import run_simple
+    import si_app
+    run_simple('127.0.0.1', port, si_app.server, threaded = True)
+
+
+def update_body(dependency, value):
+    # Request body the Dash renderer sends to _dash-update-component
+    def component(output):
+        component_id, component_property = output.rsplit('.', 1)
+        return {'id': component_id, 'property': component_property}
+
+    output = dependency['output']
+    if output.startswith('..'):
+        outputs = [component(o) for o in output[2:-2].split('...')]
+    else:
+        outputs = component(output)
+    return {
+        'output': output,
+        'outputs': outputs,
+        'inputs': [dict(i, value = value) for i in dependency['inputs']],
+        'changedPropIds': [i['id'] + '.' + i['property'] for i in dependency['inputs']],
+        'state': [],
+    }
+
+
+def post(url, body):
+    request = urllib.request.Request(url, data = json.dumps(body).encode(), headers = {'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request) as response:
+        response.read()
+    return time.perf_counter()
+
+
+def measure(mode, port, geographies):
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', mode, '--port', str(port)], stderr = subprocess.DEVNULL)
+    base_url = 'http://127.0.0.1:{}'.format(port)
+    try:
+        for attempt in range(100):
+            try:
+                dependencies = json.load(urllib.request.urlopen(base_url + '/_dash-dependencies'))
+                break
+            except OSError:
+                time.sleep(0.2)
+        # Clientside callbacks run in the browser, not on the server, and
+        # only those taking the geography run on a switch
+        dependencies = [
+            d for d in dependencies
+            if not d.get('clientside_function') and any(i['id'] == 'geography-dropdown' for i in d['inputs'])
+        ]
+        pool = ThreadPoolExecutor(max_workers = len(dependencies))
+        first, last = [], []
+        for geography in geographies:
+            start = time.perf_counter()
+            finished = list(pool.map(lambda d: post(base_url + '/_dash-update-component', update_body(d, geography)), dependencies))
+            first.append(min(finished) - start)
+            last.append(max(finished) - start)
+        return len(dependencies), first, last
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--geographies', type = int, default = 10)
+    parser.add_argument('--serve')
+    parser.add_argument('--port', type = int, default = 8051)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.serve, args.port)
+
+    sys.path.insert(0, root_dir)
+    import pandas as pd
+    geographies = pd.read_csv(os.path.join(root_dir, 'data', 'figure1.csv')).geography.unique()[:args.geographies]
+
+    print('{:<10}{:>10}{:>18}{:>18}'.format('mode', 'requests', 'first paint (ms)', 'complete (ms)'))
+    for mode, port in [('single', args.port), ('sections', args.port + 1)]:
+        requests, first, last = measure(mode, port, geographies)
+        print('{:<10}{:>10}{:>18.1f}{:>18.1f}'.format(
+            mode, requests, 1e3 * sum(first) / len(first), 1e3 * sum(last) / len(last)
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+# Benchmark suite for the app: import and load time, filtered_si_results
+# latency per geography (cold, then warm from the response cache),
+# serialized bytes per output and peak memory. Each scale is measured in
+# fresh processes, keeping the best of --runs, and the results are written
+# as JSON. --compare reports regressions against a stored result (exit
+# status 1 when there are any), and --scale repeats the run on synthetic
+# copies of the data with every geography repeated (see scale_data.py).
+# --backend sqlite measures the app querying an ingested database instead.
+#
+#   python benchmarks/bench_suite.py [--output results.json] [--scale 1 10 100] [--geographies 50] [--runs 3]
+#       [--backend memory|sqlite]
+#   python benchmarks/bench_suite.py --compare baseline.json [--input results.json] [--tolerance 0.2]
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, root_dir)
+
+# Changes smaller than these are noise whatever the relative change
+noise_floors = {'_s': 0.02, '_ms': 0.5, '_bytes': 64, '_mb': 5}
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def summary(values):
+    return {
+        'p50_ms': percentile(values, 50), 'p95_ms': percentile(values, 95),
+        'max_ms': max(values), 'mean_ms': sum(values) / len(values),
+    }
+
+
+def peak_rss_mb():
+    # VmHWM starts over at exec. ru_maxrss doesn't on Linux, so it would
+    # report the parent that scaled the data when that used more.
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmHWM:')) / 1024
+    except (OSError, StopIteration):
+        import resource
+        # ru_maxrss is in kB on Linux and bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+
+def measure(data_dir, sample, repeat):
+    # Runs in the child process: everything the app does for a page, timed
+    import warnings
+    warnings.simplefilter('ignore')
+    os.environ.update({
+        'COVID_SI_DATA_DIR': data_dir,
+        'COVID_SI_CACHE_WARM': '0',
+        'COVID_SI_RELOAD_INTERVAL': '0',
+    })
+
+    start = time.perf_counter()
+    import si_app
+    import plotly
+    import_s = time.perf_counter() - start
+    start = time.perf_counter()
+    si_app.reloader.snapshot.load()
+    load_s = time.perf_counter() - start
+
+    # An even sample, so larger scales stay affordable and comparable
+    geographies = si_app.reloader.snapshot.geographies
+    step = max(1, len(geographies) // sample)
+    sampled = geographies[::step][:sample]
+
+    cold, warm, sizes = {}, {}, {}
+    for geography in sampled:
+        start = time.perf_counter()
+        outputs = si_app.filtered_si_results(geography)
+        cold[geography] = (time.perf_counter() - start) * 1000
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            si_app.filtered_si_results(geography)
+            times.append((time.perf_counter() - start) * 1000)
+        warm[geography] = percentile(times, 50)
+        for (component_id, component_property), output in zip(si_app.page_outputs, outputs):
+            size = len(json.dumps(output, cls = plotly.utils.PlotlyJSONEncoder).encode('utf-8'))
+            sizes.setdefault('{}.{}'.format(component_id, component_property), []).append(size)
+
+    return {
+        'geographies': len(geographies),
+        'sampled': len(sampled),
+        'startup': {'import_s': import_s, 'load_s': load_s},
+        'latency': {
+            'cold': summary(list(cold.values())), 'warm': summary(list(warm.values())),
+            'cold_by_geography': cold, 'warm_by_geography': warm,
+        },
+        'bytes': {
+            output: {'mean_bytes': sum(values) / len(values), 'max_bytes': max(values)} for output, values in sizes.items()
+        },
+        'memory': {'peak_rss_mb': peak_rss_mb()},
+    }
+
+
+def best_of(runs):
+    # The fastest of several runs for every timing, which is the least
+    # disturbed by whatever else the machine was doing
+    result = runs[0]
+    result['startup'] = {name: min(run['startup'][name] for run in runs) for name in result['startup']}
+    for kind in ['cold', 'warm']:
+        by_geography = {
+            geography: min(run['latency'][kind + '_by_geography'][geography] for run in runs)
+            for geography in result['latency'][kind + '_by_geography']
+        }
+        result['latency'][kind] = summary(list(by_geography.values()))
+        result['latency'][kind + '_by_geography'] = by_geography
+    result['memory'] = {'peak_rss_mb': min(run['memory']['peak_rss_mb'] for run in runs)}
+    return result
+
+
+def run_scale(data_dir, scale, sample, repeat, runs, backend = 'memory'):
+    from scale_data import scale_data
+    from si_sqlite import ingest
+
+    scaled_dir = tempfile.mkdtemp(prefix = 'si-scale-{}-'.format(scale))
+    if scale != 1:
+        scale_data(data_dir, scaled_dir, scale)
+    db_path = os.path.join(scaled_dir, 'si.sqlite')
+    if backend == 'sqlite':
+        ingest(scaled_dir if scale != 1 else data_dir, db_path)
+    env = dict(os.environ, COVID_SI_BACKEND = backend, COVID_SI_DB = db_path)
+    try:
+        outputs = [
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--measure', scaled_dir if scale != 1 else data_dir,
+                 '--geographies', str(sample), '--repeat', str(repeat)],
+                check = True, stdout = subprocess.PIPE, cwd = root_dir, env = env,
+            ).stdout
+            for _ in range(runs)
+        ]
+    finally:
+        shutil.rmtree(scaled_dir)
+    return best_of([json.loads(output) for output in outputs])
+
+
+def metrics(results):
+    # Flat {name: value} of everything compared, lower is better for all
+    flat = {}
+    for scale, result in results['scales'].items():
+        prefix = '{}x.'.format(scale)
+        for name, value in result['startup'].items():
+            flat[prefix + 'startup.' + name] = value
+        for kind in ['cold', 'warm']:
+            for name in ['p50_ms', 'p95_ms']:
+                flat['{}latency.{}.{}'.format(prefix, kind, name)] = result['latency'][kind][name]
+        for output, sizes in result['bytes'].items():
+            flat['{}bytes.{}.mean_bytes'.format(prefix, output)] = sizes['mean_bytes']
+        flat[prefix + 'memory.peak_rss_mb'] = result['memory']['peak_rss_mb']
+    return flat
+
+
+def compare(baseline, results, tolerance):
+    # Prints every shared metric and returns the names of those that regressed
+    before, after = metrics(baseline), metrics(results)
+    regressions = []
+    print('{:<58}{:>14}{:>14}{:>10}'.format('metric', 'baseline', 'current', 'change'))
+    for name in sorted(set(before) & set(after)):
+        floor = next(value for suffix, value in noise_floors.items() if name.endswith(suffix))
+        change = (after[name] - before[name]) / before[name] if before[name] else 0.0
+        regressed = change > tolerance and after[name] - before[name] > floor
+        if regressed:
+            regressions.append(name)
+        print('{:<58}{:>14.3f}{:>14.3f}{:>+9.1%}{}'.format(name, before[name], after[name], change, '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd = root_dir, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, check = True,
+        ).stdout.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    from si_data import default_data_dir, backends
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-dir', default = default_data_dir)
+    parser.add_argument('--scale', type = int, nargs = '*', default = [1], help = 'geography multipliers to run at')
+    parser.add_argument('--geographies', type = int, default = 50, help = 'geographies sampled for latency and bytes')
+    parser.add_argument('--repeat', type = int, default = 5, help = 'warm calls per geography')
+    parser.add_argument('--runs', type = int, default = 3, help = 'fresh processes per scale, the best is kept')
+    parser.add_argument('--backend', choices = backends, default = 'memory', help = 'where the app queries the tables')
+    parser.add_argument('--output', help = 'write the results to this file')
+    parser.add_argument('--compare', help = 'baseline results to check for regressions')
+    parser.add_argument('--input', help = 'compare these stored results instead of running')
+    parser.add_argument('--tolerance', type = float, default = 0.2, help = 'relative slowdown that counts as a regression')
+    parser.add_argument('--measure', help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        json.dump(measure(args.measure, args.geographies, args.repeat), sys.stdout)
+        return
+
+    if args.input:
+        with open(args.input) as f:
+            results = json.load(f)
+    else:
+        results = {
+            'meta': {
+                'commit': git_commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'geographies_sampled': args.geographies, 'repeat': args.repeat, 'runs': args.runs,
+                'backend': args.backend,
+            },
+            'scales': {},
+        }
+        for scale in args.scale:
+            result = run_scale(args.data_dir, scale, args.geographies, args.repeat, args.runs, args.backend)
+            results['scales'][str(scale)] = result
+            print('{:>5}x {:>6} geographies: import {:.2f} s, load {:.2f} s, cold p50 {:.1f} ms, warm p50 {:.2f} ms, peak RSS {:.0f} MB'.format(
+                scale, result['geographies'], result['startup']['import_s'], result['startup']['load_s'],
+                result['latency']['cold']['p50_ms'], result['latency']['warm']['p50_ms'], result['memory']['peak_rss_mb'],
+            ))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent = 1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.tolerance)
+        print('{} regression(s)'.format(len(regressions)))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
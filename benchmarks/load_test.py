@@ -0,0 +1,218 @@
+# Load generator for a running instance: virtual users switch the geography
+# dropdown and make the requests the page makes for it, the
+# _dash-update-component callbacks that take the dropdown (concurrently, as
+# the browser does) or, in clientside mode, the geography-data file. Each
+# user waits a think time between switches, and geographies are picked
+# uniformly or by a Zipf popularity. Reports throughput and page and request
+# latency percentiles, so server modes, worker counts and caches can be
+# compared.
+#
+#   python benchmarks/load_test.py [--url http://127.0.0.1:8080] [--users 10] [--duration 30]
+#       [--think 1.0] [--distribution zipf|uniform] [--zipf-s 1.0] [--output results.json]
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_suite import percentile
+from bench_section_callbacks import update_body
+
+
+class Client:
+    # One keep-alive connection per thread, reopened after errors
+
+    def __init__(self, url, compress = True):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.netloc
+        self.prefix = parsed.path.rstrip('/')
+        self.connection_class = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+        self.headers = {'Accept-Encoding': 'gzip'} if compress else {}
+        self.local = threading.local()
+
+    def request(self, method, path, body = None, redirects = 5):
+        # Status and body bytes; follows up to `redirects` redirects of
+        # geography-data files that went stale under a reload
+        headers = dict(self.headers)
+        if body is not None:
+            body = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = self.connection_class(self.host, timeout = 60)
+        try:
+            connection.request(method, self.prefix + path, body = body, headers = headers)
+            response = connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self.local.connection = None
+            raise
+        if response.status in (301, 302) and response.getheader('Location') and redirects > 0:
+            return self.request('GET', urllib.parse.urlsplit(response.getheader('Location')).path[len(self.prefix):], redirects = redirects - 1)
+        return response.status, data
+
+    def get_json(self, path):
+        status, data = self.request('GET', path)
+        if status != 200:
+            raise RuntimeError('GET {} returned {}'.format(path, status))
+        return json.loads(data)
+
+
+def component_props(layout):
+    # {component id: props} of every component of the layout with an id
+    found = {}
+    stack = [layout]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict) and 'props' in node:
+            props = node['props']
+            if isinstance(props.get('id'), str):
+                found[props['id']] = props
+            stack.extend(value for value in props.values() if isinstance(value, (list, dict)))
+    return found
+
+
+def page_requests(client):
+    # The geographies on offer and a function that makes the requests of a
+    # page switching to one of them
+    props = component_props(client.get_json('/_dash-layout'))
+    geographies = [option['value'] for option in props['geography-dropdown']['options']]
+    dependencies = [
+        dependency for dependency in client.get_json('/_dash-dependencies')
+        if not dependency.get('clientside_function')
+        and any(i['id'] == 'geography-dropdown' for i in dependency['inputs'])
+    ]
+
+    if dependencies:
+        def body(dependency, geography):
+            # Other inputs (the data version) keep the values the page has
+            request = update_body(dependency, geography)
+            for i in request['inputs']:
+                if i['id'] != 'geography-dropdown':
+                    i['value'] = props[i['id']].get(i['property'])
+            return request
+        return geographies, [
+            ('POST', '/_dash-update-component', lambda geography, dependency = dependency: body(dependency, geography))
+            for dependency in dependencies
+        ]
+
+    # Clientside mode: one file per geography, from the URL in the page
+    store = props['geography-data']['data']
+    prefix = urllib.parse.urlsplit(store['url']).path[len(client.prefix):]
+    return geographies, [('GET', None, lambda geography: prefix + urllib.parse.quote(geography) + '.json')]
+
+
+def popularity(geographies, distribution, s, seed):
+    # Weights in a shuffled order, so popularity doesn't follow the alphabet
+    order = list(geographies)
+    random.Random(seed).shuffle(order)
+    if distribution == 'uniform':
+        return order, [1.0] * len(order)
+    return order, [1 / rank ** s for rank in range(1, len(order) + 1)]
+
+
+def run(client, requests, geographies, weights, users, duration, warmup, think, seed):
+    pool = ThreadPoolExecutor(max_workers = users * len(requests))
+    stop_at = time.perf_counter() + warmup + duration
+    measure_from = time.perf_counter() + warmup
+    lock = threading.Lock()
+    pages, calls, errors = [], [], []
+
+    def call(method, path, body, geography):
+        start = time.perf_counter()
+        try:
+            if path is None:
+                status, data = client.request(method, body(geography))
+            else:
+                status, data = client.request(method, path, body(geography))
+        except (OSError, http.client.HTTPException) as error:
+            return start, time.perf_counter(), type(error).__name__, 0
+        return start, time.perf_counter(), None if status == 200 else 'HTTP {}'.format(status), len(data)
+
+    def user(number):
+        rng = random.Random(seed + number)
+        while time.perf_counter() < stop_at:
+            geography = rng.choices(geographies, weights)[0]
+            start = time.perf_counter()
+            results = list(pool.map(lambda request: call(*request, geography), requests))
+            finished = time.perf_counter()
+            if start >= measure_from and finished <= stop_at:
+                with lock:
+                    pages.append(finished - start)
+                    for call_start, call_end, error, size in results:
+                        calls.append((call_end - call_start, size))
+                        if error:
+                            errors.append(error)
+            if think:
+                time.sleep(rng.expovariate(1 / think))
+
+    threads = [threading.Thread(target = user, args = (number,)) for number in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool.shutdown()
+    return pages, calls, errors
+
+
+def latency_summary(values):
+    return {name: percentile(values, q) * 1000 for name, q in [('p50_ms', 50), ('p95_ms', 95), ('p99_ms', 99), ('max_ms', 100)]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default = 'http://127.0.0.1:8080')
+    parser.add_argument('--users', type = int, default = 10, help = 'concurrent virtual users')
+    parser.add_argument('--duration', type = float, default = 30, help = 'seconds measured')
+    parser.add_argument('--warmup', type = float, default = 5, help = 'seconds run before measuring')
+    parser.add_argument('--think', type = float, default = 1.0, help = 'mean seconds between a page and the next switch, 0 for none')
+    parser.add_argument('--distribution', choices = ['zipf', 'uniform'], default = 'zipf')
+    parser.add_argument('--zipf-s', type = float, default = 1.0, help = 'Zipf exponent, larger is more skewed')
+    parser.add_argument('--no-compress', action = 'store_true', help = "don't send Accept-Encoding: gzip")
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--output', help = 'write the results as JSON to this file')
+    args = parser.parse_args()
+
+    client = Client(args.url, compress = not args.no_compress)
+    geographies, requests = page_requests(client)
+    geographies, weights = popularity(geographies, args.distribution, args.zipf_s, args.seed)
+    pages, calls, errors = run(client, requests, geographies, weights, args.users, args.duration, args.warmup, args.think, args.seed)
+    if not pages:
+        sys.exit('No page completed within the measured {} s'.format(args.duration))
+
+    results = {
+        'url': args.url, 'users': args.users, 'duration_s': args.duration, 'think_s': args.think,
+        'distribution': args.distribution if args.distribution == 'uniform' else 'zipf(s={})'.format(args.zipf_s),
+        'requests_per_page': len(requests),
+        'pages': len(pages), 'requests': len(calls), 'errors': len(errors),
+        'pages_per_s': len(pages) / args.duration, 'requests_per_s': len(calls) / args.duration,
+        'response_bytes_per_page': sum(size for _, size in calls) / len(pages),
+        'page_latency': latency_summary(pages),
+        'request_latency': latency_summary([seconds for seconds, _ in calls]),
+    }
+    print('{} users, think {} s, {}: {} pages of {} requests in {} s, {} errors'.format(
+        args.users, args.think, results['distribution'], results['pages'], results['requests_per_page'], args.duration, results['errors'],
+    ))
+    print('throughput: {:.1f} pages/s, {:.1f} requests/s, {:.0f} bytes per page'.format(
+        results['pages_per_s'], results['requests_per_s'], results['response_bytes_per_page'],
+    ))
+    for name in ['page_latency', 'request_latency']:
+        print('{:<16} p50 {p50_ms:8.1f} ms   p95 {p95_ms:8.1f} ms   p99 {p99_ms:8.1f} ms   max {max_ms:8.1f} ms'.format(
+            name.replace('_', ' '), **results[name]
+        ))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+# Per-table memory of the typed schema against the untyped frames read_csv
+# produces on its own.
+#
+#   python benchmarks/memory_report.py [--data-dir data]
+import os
+import sys
+import argparse
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from si_data import df_names, default_data_dir, read_csv_tables, memory_report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-dir', default = default_data_dir)
+    parser.add_argument('--columns', action = 'store_true', help = 'break every table down by column')
+    args = parser.parse_args()
+
+    untyped = memory_report({df_name: pd.read_csv(os.path.join(args.data_dir, df_name + '.csv')) for df_name in df_names})
+    typed = memory_report(read_csv_tables(args.data_dir))
+
+    print('{:<32}{:>14}{:>14}{:>9}'.format('table', 'untyped (kB)', 'typed (kB)', 'ratio'))
+    rows = []
+    for df_name in df_names:
+        rows.append((df_name, sum(untyped[df_name].values()), sum(typed[df_name].values())))
+        if args.columns:
+            rows += [('  ' + column, untyped[df_name][column], typed[df_name][column]) for column in typed[df_name]]
+    rows.append(('total', sum(sum(table.values()) for table in untyped.values()), sum(sum(table.values()) for table in typed.values())))
+
+    for name, before, after in rows:
+        print('{:<32}{:>14.1f}{:>14.1f}{:>8.1f}x'.format(name, before / 1024, after / 1024, before / after))
+
+
+if __name__ == '__main__':
+    main()
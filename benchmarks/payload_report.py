@@ -0,0 +1,64 @@
+# Serialized bytes of every callback output per geography in each payload
+# mode, raw and compressed (gzip, and brotli when it is installed).
+#
+#   python benchmarks/payload_report.py [--data-dir data] [--geographies Italy ...] [--outputs]
+import os
+import sys
+import gzip
+import json
+import argparse
+import warnings
+
+import plotly
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore')
+from si_data import default_data_dir, TableRegistry, GeographyIndex
+from si_sections import sections, display_decimals
+from si_encode import payload_modes, encode_figure, brotli
+
+
+def output_sizes(geo_index, geography, mode):
+    # (output id, raw, gzip, brotli) bytes for every section output
+    sizes = []
+    for _, builder, outputs in sections:
+        for output, (component_id, component_property) in zip(builder(geo_index, geography), outputs):
+            if component_property == 'figure':
+                output = encode_figure(output, mode, display_decimals.get(component_id))
+            body = json.dumps(output, cls = plotly.utils.PlotlyJSONEncoder).encode('utf-8')
+            sizes.append((
+                component_id, len(body), len(gzip.compress(body, compresslevel = 6)),
+                len(brotli.compress(body, quality = 5)) if brotli is not None else None,
+            ))
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data-dir', default = default_data_dir)
+    parser.add_argument('--geographies', nargs = '*', help = 'default: every geography')
+    parser.add_argument('--outputs', action = 'store_true', help = 'break every geography down by output')
+    args = parser.parse_args()
+
+    geo_index = GeographyIndex(TableRegistry(args.data_dir))
+    geographies = args.geographies or geo_index.geographies('figure1')
+
+    print('{:<36}{:>9}{:>14}{:>14}{:>14}'.format('geography / output', 'mode', 'raw (B)', 'gzip (B)', 'brotli (B)'))
+    totals = {mode: [0, 0, 0] for mode in payload_modes}
+    for geography in geographies:
+        for mode in payload_modes:
+            sizes = output_sizes(geo_index, geography, mode)
+            rows = [(geography, sum(s[1] for s in sizes), sum(s[2] for s in sizes), sum(s[3] or 0 for s in sizes))]
+            if args.outputs:
+                rows += [('  ' + component_id, raw, gz, br or 0) for component_id, raw, gz, br in sizes]
+            for name, raw, gz, br in rows:
+                print('{:<36}{:>9}{:>14}{:>14}{:>14}'.format(name, mode, raw, gz, br if brotli is not None else '-'))
+            totals[mode] = [total + size for total, size in zip(totals[mode], rows[0][1:])]
+
+    for mode in payload_modes:
+        raw, gz, br = totals[mode]
+        print('{:<36}{:>9}{:>14}{:>14}{:>14}'.format('total', mode, raw, gz, br if brotli is not None else '-'))
+
+
+if __name__ == '__main__':
+    main()
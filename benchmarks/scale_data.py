@@ -0,0 +1,60 @@
+# Synthetic scale-up of data/: every table with each geography repeated
+# `factor` times, the copies named "<geography> 2" up to "<geography>
+# <factor>", with the original rows. The columnar store is built too, so
+# the app loads the copy the way it loads data/.
+#
+#   python benchmarks/scale_data.py <output dir> [--factor 10] [--data-dir data] [--no-store]
+import os
+import csv
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from si_data import df_names, default_data_dir
+
+
+def scaled_name(geography, copy):
+    return geography if copy == 1 else '{} {}'.format(geography, copy)
+
+
+def scale_table(data_dir, out_dir, df_name, factor):
+    with open(os.path.join(data_dir, df_name + '.csv'), newline = '') as f:
+        rows = list(csv.reader(f))
+    header, rows = rows[0], rows[1:]
+    column = header.index('geography')
+
+    with open(os.path.join(out_dir, df_name + '.csv'), 'w', newline = '') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for copy in range(1, factor + 1):
+            # Rows are written in the source order within each copy
+            for row in rows:
+                row = list(row)
+                row[column] = scaled_name(row[column], copy)
+                writer.writerow(row)
+
+
+def scale_data(data_dir, out_dir, factor, store = True):
+    os.makedirs(out_dir, exist_ok = True)
+    for df_name in df_names:
+        scale_table(data_dir, out_dir, df_name, factor)
+    if store:
+        from si_store import build_store
+        build_store(out_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('out_dir')
+    parser.add_argument('--factor', type = int, default = 10)
+    parser.add_argument('--data-dir', default = default_data_dir)
+    parser.add_argument('--no-store', action = 'store_true', help = "don't build the columnar store")
+    args = parser.parse_args()
+
+    scale_data(args.data_dir, args.out_dir, args.factor, store = not args.no_store)
+    size = sum(os.path.getsize(os.path.join(args.out_dir, df_name + '.csv')) for df_name in df_names)
+    print('Wrote {}x data to {}: {:.1f} MB of CSV'.format(args.factor, args.out_dir, size / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# Cold start of the app, in fresh processes: import time broken down by
+# top-level package (from python -X importtime, own time of every module
+# summed per package), then the time to the first page: loading the data,
+# the page, its layout and dependencies, and rendering a geography.
+#
+#   python benchmarks/startup_report.py [--module si_app] [--data-dir data] [--top 15] [--runs 3]
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+first_page = """
+import time, json
+start = time.perf_counter()
+marks = []
+import {module} as entry
+import si_app
+marks.append(('import', time.perf_counter()))
+si_app.reloader.snapshot.load()
+marks.append(('load data', time.perf_counter()))
+client = si_app.server.test_client()
+client.get('/')
+marks.append(('page', time.perf_counter()))
+client.get('/_dash-layout')
+client.get('/_dash-dependencies')
+marks.append(('layout and dependencies', time.perf_counter()))
+si_app.filtered_si_results(si_app.reloader.snapshot.geographies[0])
+marks.append(('first render', time.perf_counter()))
+times, previous = {{}}, start
+for name, at in marks:
+    times[name] = at - previous
+    previous = at
+times['total'] = previous - start
+print(json.dumps(times))
+"""
+
+
+def import_breakdown(module, env):
+    # {package: seconds} of own import time, of the entry module and the app
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import {}; import si_app'.format(module)],
+        cwd = root_dir, env = env, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, check = True,
+    ).stderr.decode('utf-8')
+    packages = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(own) / 1e6
+    return packages
+
+
+def first_page_times(module, env):
+    output = subprocess.run(
+        [sys.executable, '-c', first_page.format(module = module)],
+        cwd = root_dir, env = env, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, check = True,
+    ).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default = 'si_app', help = 'entry module to import, e.g. si_wsgi')
+    parser.add_argument('--data-dir', default = os.environ.get('COVID_SI_DATA_DIR', os.path.join(root_dir, 'data')))
+    parser.add_argument('--top', type = int, default = 15, help = 'packages listed')
+    parser.add_argument('--runs', type = int, default = 3, help = 'fresh processes, the fastest is kept')
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH = root_dir, COVID_SI_DATA_DIR = args.data_dir, COVID_SI_CACHE_WARM = '0', COVID_SI_RELOAD_INTERVAL = '0')
+    breakdowns = [import_breakdown(args.module, env) for _ in range(args.runs)]
+    packages = {package: min(b.get(package, 0) for b in breakdowns) for package in breakdowns[0]}
+    print('Import of {}: {:.0f} ms from {} packages'.format(args.module, 1000 * sum(packages.values()), len(packages)))
+    for package, seconds in sorted(packages.items(), key = lambda item: -item[1])[:args.top]:
+        print('  {:<28}{:>8.1f} ms'.format(package, 1000 * seconds))
+
+    runs = [first_page_times(args.module, env) for _ in range(args.runs)]
+    print('First page:')
+    for name in runs[0]:
+        print('  {:<28}{:>8.1f} ms'.format(name, 1000 * min(run[name] for run in runs)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# Memory of forked workers: the data loaded once in the parent and shared
+# copy-on-write (as si_wsgi does under a pre-forking server), with and
+# without gc.freeze(), against every worker loading its own copy. Every
+# worker renders every geography once, then reports its memory from
+# /proc/<pid>/smaps_rollup (Linux): RSS, PSS (shared pages split between the
+# processes sharing them) and USS (pages only it holds).
+#
+#   python benchmarks/worker_memory.py [--workers 4] [--mode preload-freeze preload per-worker]
+import os
+import gc
+import sys
+import json
+import argparse
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+warnings.simplefilter('ignore')
+
+modes = ['preload-freeze', 'preload', 'per-worker']
+
+
+def memory(pid = 'self'):
+    # kB of RSS, PSS and USS
+    fields = {}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {'rss': fields['Rss'], 'pss': fields['Pss'], 'uss': fields['Private_Clean'] + fields['Private_Dirty']}
+
+
+def load_app():
+    import si_app
+    si_app.reloader.snapshot.load()
+    return si_app
+
+
+def run(mode, workers):
+    # In a fresh process, so one mode's imports don't leak into the next
+    read_fd, write_fd = os.pipe()
+    release_read, release_write = os.pipe()
+    pid = os.fork()
+    if pid:
+        os.close(write_fd)
+        os.close(release_read)
+        _, status = os.waitpid(pid, 0)
+        with os.fdopen(read_fd) as f:
+            return json.loads(f.read())
+
+    os.close(read_fd)
+    si_app = None
+    if mode != 'per-worker':
+        si_app = load_app()
+        gc.collect()
+        if mode == 'preload-freeze':
+            gc.freeze()
+    parent = memory()
+
+    results, children = os.pipe()
+    pids = []
+    for _ in range(workers):
+        child = os.fork()
+        if child == 0:
+            os.close(results)
+            if mode == 'per-worker':
+                si_app = load_app()
+            for geography in si_app.reloader.snapshot.geographies:
+                si_app.filtered_si_results(geography)
+            gc.collect()
+            os.write(children, b'ready\n')
+            os.read(release_read, 1)
+            os._exit(0)
+        pids.append(child)
+    os.close(children)
+
+    # Measured once every worker is warm, so PSS splits shared pages across all
+    with os.fdopen(results) as f:
+        for _ in range(workers):
+            f.readline()
+    measured = [memory(child) for child in pids]
+    os.write(release_write, b'x' * workers)
+    for child in pids:
+        os.waitpid(child, 0)
+
+    os.write(write_fd, json.dumps({'parent': parent, 'workers': measured}).encode('ascii'))
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type = int, default = 4)
+    parser.add_argument('--mode', nargs = '*', choices = modes, default = modes)
+    args = parser.parse_args()
+
+    print('{:<16}{:>14}{:>16}{:>16}{:>16}{:>16}'.format('mode', 'parent RSS', 'worker RSS', 'worker PSS', 'worker USS', 'total PSS'))
+    for mode in args.mode:
+        result = run(mode, args.workers)
+        workers = result['workers']
+        mean = {key: sum(w[key] for w in workers) / len(workers) / 1024 for key in ['rss', 'pss', 'uss']}
+        total = (result['parent']['pss'] + sum(w['pss'] for w in workers)) / 1024
+        print('{:<16}{:>11.1f} MB{:>13.1f} MB{:>13.1f} MB{:>13.1f} MB{:>13.1f} MB'.format(
+            mode, result['parent']['rss'] / 1024, mean['rss'], mean['pss'], mean['uss'], total
+        ))
+
+
+if __name__ == '__main__':
+    main()
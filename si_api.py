@@ -0,0 +1,63 @@
+# Read-only JSON API over the app's tables: each geography's rows of a
+# table, as columns (the figure series) or records (the table rows),
+# optionally projected to a subset of fields. Values are JSON-ready: dates
+# as days, float32 at their own precision and NA as null.
+import hashlib
+
+import numpy as np
+
+from si_data import df_names, schema
+
+orients = ['columns', 'records']
+
+# Fields every table can be projected to; the geography is part of the URL
+api_fields = {df_name: [column for column in schema[df_name] if column != 'geography'] for df_name in df_names}
+
+
+def default_orient(df_name):
+    return 'columns' if df_name.startswith('figure') else 'records'
+
+
+def parse_fields(df_name, fields):
+    # Requested fields as a tuple in request order, None for every field.
+    # Raises ValueError naming any unknown field.
+    if not fields:
+        return None
+    fields = tuple(field.strip() for field in fields.split(',') if field.strip())
+    unknown = [field for field in fields if field not in api_fields[df_name]]
+    if unknown:
+        raise ValueError('Unknown fields for {}: {}'.format(df_name, ', '.join(unknown)))
+    return fields
+
+
+def column_values(column):
+    if column.dtype.kind == 'M':
+        values = np.datetime_as_string(column.values.astype('datetime64[D]'), unit = 'D').astype(object)
+        values[column.isna().values] = None
+    elif column.dtype.name == 'category':
+        values = column.astype(object).values.copy()
+        values[column.isna().values] = None
+    elif column.dtype.kind == 'f' or column.dtype.name.startswith('Float'):
+        # Through the shortest string of the stored float32, so 0.1 stays 0.1
+        floats = column.to_numpy(dtype = 'float32', na_value = np.nan)
+        values = floats.astype(str).astype('float64').astype(object)
+        values[np.isnan(floats)] = None
+    else:
+        values = column.astype(object).values.copy()
+        values[column.isna().values] = None
+    return values.tolist()
+
+
+def table_json(geo_index, df_name, geography, fields = None, orient = None):
+    rows = geo_index.select(df_name, geography)
+    fields = list(fields or api_fields[df_name])
+    columns = {field: column_values(rows[field]) for field in fields}
+    if (orient or default_orient(df_name)) == 'columns':
+        return columns
+    return [dict(zip(fields, values)) for values in zip(*(columns[field] for field in fields))]
+
+
+def etag(key):
+    # Responses are keyed by the data version, which is itself a content hash
+    # of the source files, so the key identifies the content without building it
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
@@ -1,13 +1,13 @@
 
 # Utilities
 import os 
-from datetime import datetime as dt
-from datetime import timedelta
-import pandas as pd
-import numpy as np
 import json
 import sys
 import warnings
+import argparse
+import hmac
+import time
+from concurrent.futures import ThreadPoolExecutor
     
 # Suppress Warnings
 if not sys.warnoptions:
@@ -17,16 +17,25 @@ if not sys.warnoptions:
 import dash
 import dash_html_components as html
 import dash_core_components as dcc
-import dash_table
     
-import plotly.graph_objs as go
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State, ClientsideFunction
+from dash.exceptions import PreventUpdate
+from dash import Patch
+import plotly
 import flask
-from flask import Flask, send_file, jsonify
-import urllib
-from zipfile import ZipFile
-import io
-import requests
+from flask import Flask, jsonify
+import urllib.parse
+
+from si_data import df_names, default_data_dir, backends, DataSnapshot
+from si_cache import ResponseCache
+from si_sections import sections, figure2_ci_layout, display_decimals, comparison_fragments, comparison_section, comparison_outputs
+from si_sections import zoom_series, series_pyramids, zoomed_lines
+from si_downsample import range_bounds
+from si_encode import payload_modes, encode_figure, compress_response
+import si_api
+from si_download import csv_rows, zip_stream
+from si_metrics import Metrics
+from si_reload import Reloader
 
 # Initialize dash app
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
@@ -36,648 +45,902 @@ app.config['suppress_callback_exceptions'] = True
 app.css.config.serve_locally = True
 app.scripts.config.serve_locally = True
 
-# Read in data
-local_dir = "/Users/josebolorinos/Google Drive File Stream/My Drive/Research Stuff/Covid and the Grid/si_app/data"
-server_dir = "~/covid_si/data"
-
-
-df_dict = {}
-df_names = ['figure1','figure12_sip','table1','figure2','table2','figure3','table3','table4','table5']
-df_dict = {df_name: pd.read_csv(os.path.join(server_dir, df_name + '.csv')) for df_name in df_names}
-
-# Format date variables
-df_dict['figure1'].loc[:,'date'] = pd.to_datetime(df_dict['figure1']['date'])
-
-# Get geographies for dropdown object
-geographies = df_dict['figure1'].geography.unique()
-
-# Layout objects
-layoutChildren = [
-    html.H1(
-        children='Supplemental Data',
-        style={
-            'textAlign': 'center'   ,
-            'font-size':'36px','whiteSpace':'pre'
-        }
-    ),
-    html.Div(children = html.Hr(), style = {'padding-left': '100px', 'padding-right': '100px'}),
-    html.Div(
-        style = {'width': '20%', 'textAlign':'center', 'padding-left':'15%'},
-        children = [
-            dcc.Dropdown(
-                id = 'geography-dropdown',
-                options = [{'label': value, 'value': value} for value in geographies],
-                value = 'Italy'
-            )
-            # html.Div([
-            #     html.A(
-            #         'Download all data',
-            #         id = 'download-zip',
-            #         download = 'covid-data.zip',
-            #         href = "/download_csv/",
-            #         target = "_blank",
-            #         n_clicks = 0, className='button button-primary',
-            #         style = {'height': '45px', 'width': '282px','font-size': '15px'}
-            #     )],
-            #     style = {'padding': '1px','backgroundColor':'white','textAlign':'right'}
-            # )
-        ]
-    ),
-    html.Div(
-        id = 'figure1-div',
-        style = {'height': '95%','padding-top':'5%', 'padding-left' : '5%','padding-right' : '10%'},
-        children = [
-            dcc.Graph(id = 'figure1-ci-graph'),
-            dcc.Graph(id = 'figure1-time-series-graph'),
-            html.Div(
-                style  = {'padding-left' : '2%', 'padding-right' : '10%'},
-                children = html.Div(
-                    className = 'plot-title-container',
-                    children = [
-                        html.P(
-                            "Fig. 1: ",
-                            className ='plot-title-left'
-                        ),
-                        html.P(
-                            "Government restrictions (CI levels) and percent change in mobility, electricity demand, Feb-May 2020",
-                            className ='plot-title-right'
-                        )
-                    ]
-                )
-    
-            )
-        ]
+# Read in data from COVID_SI_DATA_DIR (or --data-dir when run as a script).
+# Tables load on first use; COVID_SI_GEOGRAPHIES (or --geographies), a comma
+# separated list, restricts them to the geographies this instance serves.
+# COVID_SI_BACKEND=sqlite (or --backend) queries the database ingested by
+# si_sqlite.py, at COVID_SI_DB (or --db), instead of holding every table.
+parser = argparse.ArgumentParser()
+parser.add_argument('--data-dir', default = os.environ.get('COVID_SI_DATA_DIR', default_data_dir))
+parser.add_argument('--geographies', default = os.environ.get('COVID_SI_GEOGRAPHIES', ''))
+parser.add_argument('--backend', default = os.environ.get('COVID_SI_BACKEND', 'memory'), choices = backends)
+parser.add_argument('--db', default = os.environ.get('COVID_SI_DB'))
+args, unknown_args = parser.parse_known_args(sys.argv[1:] if __name__ == '__main__' else [])
+server_dir = args.data_dir
+served_geographies = [value.strip() for value in args.geographies.split(',') if value.strip()]
+
+# The data is held in a snapshot (tables, geography index, geographies and
+# versions) that reloads replace whole. Requests take the current snapshot
+# once and use it throughout, so they finish on the data they started with.
+#
+# Hot reload: COVID_SI_RELOAD_INTERVAL > 0 polls the source files every that
+# many seconds, COVID_SI_ADMIN_TOKEN enables POST /admin/reload with that
+# bearer token. With either on, open pages check for new data every minute.
+# New delta files (data/appends/figure1-<label>.csv, figure12_sip-...) are
+# appended to the data in place of a full reload. An admin reload touches
+# COVID_SI_RELOAD_TRIGGER (data-dir/store/reload by default), which every
+# worker process polls, so all of them serve the same version.
+reload_interval = float(os.environ.get('COVID_SI_RELOAD_INTERVAL', 0))
+admin_token = os.environ.get('COVID_SI_ADMIN_TOKEN', '')
+reload_enabled = reload_interval > 0 or bool(admin_token)
+reload_trigger = os.environ.get('COVID_SI_RELOAD_TRIGGER', os.path.join(os.path.expanduser(server_dir), 'store', 'reload'))
+reloader = Reloader(
+    DataSnapshot(server_dir, served_geographies, backend = args.backend, db_path = args.db),
+    trigger_path = reload_trigger if admin_token else None
+)
 
-    ),
-    html.Div(
-        id = 'table1-div',
-        style = {
-            'width': '50%', 'textAlign':'center', 'padding-left':'25%','padding-right':'25%',
-            'height': '95%','padding-top':'5%',
-        }
-    ),
-    html.Div(
-        className = 'table-title-container',
-        children = [
-            html.P(
-                "Table 1: ",
-                className ='table-title-left'
-            ),
-            html.P(
-                " Ordinary least squares regression model of daily electricity change and government restrictions (CI level), Feb-May 2020",
-                className ='table-title-right'
-            ),
-        ]
-    ),
-    html.Div(children = html.Hr(), style = {'padding-left': '100px', 'padding-right': '100px', 'padding-top': '100px'}),
-    html.Div(
-        className = 'row',
-        children = [
-            html.Div(
-                id = 'figure2-div',
-                style = {'height': '100%', 'padding-left':'8%'},
-                className = 'column',
-                children = [
-                    html.Div(
-                        style = {'height': '20%'},
-                        children = [
-                            dcc.Graph(id = 'figure2-ci-graph'),
-                            dcc.Graph(id = 'figure2-time-series-graph')
-                        ]
-                    ),  
-                    html.Div([
-                        html.P(
-                            "Fig. 2: ",
-                            className ='figure-title-left-2col'
-                        ),
-                        html.P(
-                            "Multivariate Adaptive Regression Spline (MARS) model results of daily electricity change and government restrictions (CI level) vs. actual daily electricity change, Feb-May 2020",
-                            className ='figure-title-right-2col'
-                        )
-                    ])
-                ]
-            ),
-            html.Div(
-                id = 'table2-container',
-                style = {'height' : '100%', 'padding-right':'20%', 'padding-top':'15%'},
-                className = 'column',
-                children = [
-                    html.Div(id = 'table2-div'),
-                    html.Div(
-                        id = 'table2-title-container',
-                        className = 'table-title-container-2col',
-                        style = {'padding-top' : '50%'},
+# How geography switches are rendered (see the callbacks below): 'sections',
+# 'single' or 'clientside'
+callback_mode = os.environ.get('COVID_SI_CALLBACK_MODE', 'sections')
+if callback_mode not in ['sections', 'single', 'clientside']:
+    raise ValueError('COVID_SI_CALLBACK_MODE must be one of sections, single, clientside')
+
+# Comparison of several geographies below the page, unless
+# COVID_SI_COMPARE=0; the figures draw at most COVID_SI_COMPARE_MAX_TRACES
+# of them
+compare_enabled = os.environ.get('COVID_SI_COMPARE', '1') == '1'
+compare_max_traces = int(os.environ.get('COVID_SI_COMPARE_MAX_TRACES', 10))
+
+# Zoomed and panned time series graphs fetch their lines again at the
+# resolution of the range shown, unless COVID_SI_ZOOM=0
+zoom_enabled = os.environ.get('COVID_SI_ZOOM', '1') == '1'
+
+# Every (component id, property) the geography fills, in page order
+page_outputs = [output for section, builder, outputs in sections for output in outputs]
+
+
+def geography_options(geographies):
+    return [{'label': value, 'value': value} for value in geographies]
+
+
+def geography_data_store(snapshot):
+    # Where the browser fetches each geography's outputs, and their order
+    return {
+        'url': app.get_relative_path('/geography-data/{}/'.format(snapshot.data_version)),
+        'outputs': ['{}.{}'.format(component_id, component_property) for component_id, component_property in page_outputs],
+    }
+
+
+def comparison_layout(geographies):
+    return [
+        html.Div(
+            style = {'width': '40%', 'textAlign':'center', 'padding-left':'15%', 'padding-top':'5%'},
+            children = dcc.Dropdown(
+                id = 'compare-dropdown',
+                options = geography_options(geographies),
+                value = [],
+                multi = True,
+                placeholder = 'Compare geographies...'
+            )
+        ),
+        html.Div(
+            id = 'compare-figure-div',
+            style = {'height': '95%','padding-top':'2%', 'padding-left' : '5%','padding-right' : '10%'},
+            children = [
+                dcc.Graph(id = 'compare-figure1-graph'),
+                dcc.Graph(id = 'compare-figure3-graph'),
+                html.Div(
+                    style  = {'padding-left' : '2%', 'padding-right' : '10%'},
+                    children = html.Div(
+                        className = 'plot-title-container',
                         children = [
                             html.P(
-                                "Table 2: ",
-                                className ='table-title-left-2col'
+                                "Comparison: ",
+                                className ='plot-title-left'
                             ),
                             html.P(
-                                "Coefficients for the MARS model",
-                                className ='table-title-right-2col'
-                            ) 
+                                "Percent change in electricity demand, Feb-May 2020, and load shape of April 2020 workdays, by geography",
+                                className ='plot-title-right'
+                            )
                         ]
-                    )                   
-                ]
-            )
-        ]
-    ),
-    html.Div(children = html.Hr(), style = {'padding-left': '100px', 'padding-right': '100px', 'padding-top': '50px'}),  
-    html.Div(
-        id = 'table3-div',
-        style = {
-            'width': '50%', 'textAlign':'center', 'padding-left':'25%','padding-right':'25%',
-            'height': '95%','padding-top':'5%'
-        }
-    ), 
-    html.Div(
-        id = 'table3-title-container',
-        className = 'table-title-container',
-        children = [
-            html.P(
-                "Table 3:",
-                className ='table-title-left'
-            ),
-            html.P(
-                "Elasticity coefficients measuring the relationship between changes in workplace, transit, residential, retail/recreation, grocery/pharmacy and parks mobility and changes electricity use, Feb-May 2020.",
-                className ='table-title-right'
-            ),
-        ]
-    ),
-    html.Div(
-        id = 'table4-div',
-        style = {
-            'width': '50%', 'textAlign':'center', 'padding-left':'25%','padding-right':'25%',
-            'height': '95%','padding-top':'5%'
-        }
-    ), 
-    html.Div(
-        id = 'table4-title-container',
-        className = 'table-title-container',
-        children = [
-            html.P(
-                "Table 4:",
-                className ='table-title-left'
-            ),
-            html.P(
-                "Regression of changes in electricity use on changes in workplace, transit, residential,retail/recreation, grocery/pharmacy and parks mobility all together in one model, Feb-May 2020.",
-                className ='table-title-right'
-            ),
-        ]
-    ),
-    html.Div(children = html.Hr(), style = {'padding-left': '100px', 'padding-right': '100px', 'padding-top': '100px'}),
-    html.Div(
-        children = [
-            html.Div(
-                id = 'figure3-div',
-                style = {'height': '100%', 'padding-left':'8%'},
-                className = 'column',
-                children = [
-                    html.Div(
-                        style = {'height': '10%'},
-                        children = dcc.Graph(id = 'figure3-graph')
-                    ),
-                    html.P(
-                        "Fig. 3:",
-                        className ='figure-title-left-2col'
-                    ),
-                    html.P(
-                        "Observed daily load shapes for workdays and weekends April 2016-2019 vs. April 2020.",
-                        className ='figure-title-right-2col'
                     )
-                ]
-            ),
-            html.Div(
-                id = 'table5-container',
-                style = {'height': '100%','padding-right':'20%','padding-top':'15%'},
-                className = 'column',
-                children = [
-                    html.Div(id = 'table5-div'),
-                    html.Div(
-                        id = 'table5-title-container',
-                        className = 'table-title-container-2col',
-                        style = {'padding-top': '25%'},
+                )
+            ]
+        ),
+        html.Div(
+            id = 'compare-table1-div',
+            style = {
+                'width': '50%', 'textAlign':'center', 'padding-left':'25%','padding-right':'25%',
+                'height': '95%','padding-top':'5%',
+            }
+        ),
+        html.Div(
+            id = 'compare-table3-div',
+            style = {
+                'width': '50%', 'textAlign':'center', 'padding-left':'25%','padding-right':'25%',
+                'height': '95%','padding-top':'5%',
+            }
+        ),
+        html.Div(
+            className = 'table-title-container',
+            children = [
+                html.P(
+                    "Comparison: ",
+                    className ='table-title-left'
+                ),
+                html.P(
+                    "Table 1 and Table 3 coefficients of the selected geographies",
+                    className ='table-title-right'
+                ),
+            ]
+        ),
+        html.Div(children = html.Hr(), style = {'padding-left': '100px', 'padding-right': '100px', 'padding-top': '50px'})
+    ]
+
+
+def serve_layout():
+
+    # Built for every page load, so new pages get the current geographies
+    snapshot = reloader.snapshot
+    geographies = snapshot.geographies
+
+    # Layout objects
+    layoutChildren = [
+        html.H1(
+            children='Supplemental Data',
+            style={
+                'textAlign': 'center'   ,
+                'font-size':'36px','whiteSpace':'pre'
+            }
+        ),
+        html.Div(children = html.Hr(), style = {'padding-left': '100px', 'padding-right': '100px'}),
+        html.Div(
+            style = {'width': '20%', 'textAlign':'center', 'padding-left':'15%'},
+            children = [
+                dcc.Dropdown(
+                    id = 'geography-dropdown',
+                    options = geography_options(geographies),
+                    value = 'Italy' if 'Italy' in geographies else geographies[0]
+                ),
+                html.Div([
+                    html.A(
+                        'Download all data',
+                        id = 'download-zip',
+                        download = 'covid-data.zip',
+                        href = app.get_relative_path('/download_csv'),
+                        target = "_blank",
+                        n_clicks = 0, className='button button-primary',
+                        style = {'height': '45px', 'width': '282px','font-size': '15px'}
+                    )],
+                    style = {'padding': '1px','backgroundColor':'white','textAlign':'right'}
+                )
+            ]
+        ),
+        html.Div(
+            id = 'figure1-div',
+            style = {'height': '95%','padding-top':'5%', 'padding-left' : '5%','padding-right' : '10%'},
+            children = [
+                dcc.Graph(id = 'figure1-ci-graph'),
+                dcc.Graph(id = 'figure1-time-series-graph'),
+                html.Div(
+                    style  = {'padding-left' : '2%', 'padding-right' : '10%'},
+                    children = html.Div(
+                        className = 'plot-title-container',
                         children = [
                             html.P(
-                                "Table 5:",
-                                className ='table-title-left-2col'
+                                "Fig. 1: ",
+                                className ='plot-title-left'
                             ),
                             html.P(
-                                "Changes in peak and baseload (MW, timing) for workdays April 2016-2019 vs, April 2020.",
-                                className ='table-title-right-2col'
+                                "Government restrictions (CI levels) and percent change in mobility, electricity demand, Feb-May 2020",
+                                className ='plot-title-right'
                             )
                         ]
                     )
-                ]
-            )
-        ],
-        className = 'row'
-    ),
-    html.Div(children = html.Hr(), style = {'padding-left': '100px', 'padding-right': '100px', 'padding-top': '50px'})  
-]
-
-app.layout = html.Div(
-    id = 'page-content', 
-    children = layoutChildren, 
-    style = {'fontFamily':'sans-serif','backgroundColor':'white'}
-)   
-
-
-@app.callback(
-    [
-        Output('figure1-ci-graph','figure'), 
-        Output('figure1-time-series-graph','figure'),
-        Output('table1-div','children'),
-        Output('figure2-ci-graph','figure'),
-        Output('figure2-time-series-graph','figure'),
-        Output('table2-div','children'),
-        Output('table3-div','children'),
-        Output('table4-div','children'),
-        Output('figure3-graph','figure'),
-        Output('table5-div','children')
-    ],
-    [Input('geography-dropdown','value')]
-)
-
-def filtered_si_results(geography):
-
-    #================================== Figure 1 ==================================#
-    figure1_filtered = df_dict['figure1'].loc[df_dict['figure1'].geography == geography,:]
-    figure12_sip_filtered = df_dict['figure12_sip'].loc[df_dict['figure12_sip'].geography == geography,:]
-
-    figure12_ci_plot_data = [
-        go.Scatter(
-            x = figure12_sip_filtered['date'],
-            y = figure12_sip_filtered['SIP'],
-            mode = 'lines',
-            opacity = 0.8,  
-            line_color = 'black',
-            name = "CI Level"
-        ),
-    ]
-    figure1_ci_layout = go.Layout({
-        'xaxis': {'title': False,'showgrid': False,'visible': False},
-        'yaxis': {
-            'title': 'CI Level',
-            'tickvals': [0,1,2,3],
-            'showgrid': False
-
-        },
-        'margin': {'l': 250,'r': 150,'t': 20,'b': 20},
-        'height': 130,
-        'width': 1250,
-    })
+    
+                )
+            ]
 
-    figure1_ts_plot_data = [
-        go.Scatter(
-            x = figure1_filtered['date'],
-            y = figure1_filtered['percent_red'],
-            mode = 'lines',
-            line_color = 'orange',
-            name = 'Elect. use chg',
-            opacity = 1,
-            line = {'dash':'dash'}
         ),
-        go.Scatter(
-            x = figure1_filtered['date'],
-            y = figure1_filtered['percent_red_lower'],
-            mode = 'lines',
-            line_color = 'yellow',
-            opacity = 1,
-            showlegend = False
+        html.Div(
+            id = 'table1-div',
+            style = {
+                'width': '50%', 'textAlign':'center', 'padding-left':'25%','padding-right':'25%',
+                'height': '95%','padding-top':'5%',
+            }
         ),
-        go.Scatter(
-            x = figure1_filtered['date'],
-            y = figure1_filtered['percent_red_upper'],
-            mode = 'lines',
-            fill = 'tonexty',
-            line_color = 'yellow',
-            opacity = 1,
-            showlegend = False
+        html.Div(
+            className = 'table-title-container',
+            children = [
+                html.P(
+                    "Table 1: ",
+                    className ='table-title-left'
+                ),
+                html.P(
+                    " Ordinary least squares regression model of daily electricity change and government restrictions (CI level), Feb-May 2020",
+                    className ='table-title-right'
+                ),
+            ]
         ),
-        go.Scatter(
-            x = figure1_filtered['date'],
-            y = figure1_filtered['grocery_pharmacy'],
-            mode = 'lines',
-            name = 'Grocery/Pharmacy',
-            line_color = 'lightgreen'
+        html.Div(children = html.Hr(), style = {'padding-left': '100px', 'padding-right': '100px', 'padding-top': '100px'}),
+        html.Div(
+            className = 'row',
+            children = [
+                html.Div(
+                    id = 'figure2-div',
+                    style = {'height': '100%', 'padding-left':'8%'},
+                    className = 'column',
+                    children = [
+                        html.Div(
+                            style = {'height': '20%'},
+                            children = [
+                                dcc.Graph(id = 'figure2-ci-graph', figure = {'data': [], 'layout': figure2_ci_layout}),
+                                dcc.Graph(id = 'figure2-time-series-graph')
+                            ]
+                        ),  
+                        html.Div([
+                            html.P(
+                                "Fig. 2: ",
+                                className ='figure-title-left-2col'
+                            ),
+                            html.P(
+                                "Multivariate Adaptive Regression Spline (MARS) model results of daily electricity change and government restrictions (CI level) vs. actual daily electricity change, Feb-May 2020",
+                                className ='figure-title-right-2col'
+                            )
+                        ])
+                    ]
+                ),
+                html.Div(
+                    id = 'table2-container',
+                    style = {'height' : '100%', 'padding-right':'20%', 'padding-top':'15%'},
+                    className = 'column',
+                    children = [
+                        html.Div(id = 'table2-div'),
+                        html.Div(
+                            id = 'table2-title-container',
+                            className = 'table-title-container-2col',
+                            style = {'padding-top' : '50%'},
+                            children = [
+                                html.P(
+                                    "Table 2: ",
+                                    className ='table-title-left-2col'
+                                ),
+                                html.P(
+                                    "Coefficients for the MARS model",
+                                    className ='table-title-right-2col'
+                                ) 
+                            ]
+                        )                   
+                    ]
+                )
+            ]
         ),
-        go.Scatter(
-            x = figure1_filtered['date'],
-            y = figure1_filtered['workplace'],
-            mode = 'lines',
-            name = 'Workplace',
-            line_color = 'darkblue'
+        html.Div(children = html.Hr(), style = {'padding-left': '100px', 'padding-right': '100px', 'padding-top': '50px'}),  
+        html.Div(
+            id = 'table3-div',
+            style = {
+                'width': '50%', 'textAlign':'center', 'padding-left':'25%','padding-right':'25%',
+                'height': '95%','padding-top':'5%'
+            }
+        ), 
+        html.Div(
+            id = 'table3-title-container',
+            className = 'table-title-container',
+            children = [
+                html.P(
+                    "Table 3:",
+                    className ='table-title-left'
+                ),
+                html.P(
+                    "Elasticity coefficients measuring the relationship between changes in workplace, transit, residential, retail/recreation, grocery/pharmacy and parks mobility and changes electricity use, Feb-May 2020.",
+                    className ='table-title-right'
+                ),
+            ]
         ),
-        go.Scatter(
-            x = figure1_filtered['date'],
-            y = figure1_filtered['residential'],
-            mode = 'lines',
-            name = 'Residential',
-            line_color = 'mediumturquoise'
-        )
-    ]
-    figure1_ts_layout = go.Layout({
-        'xaxis': {'title': '', 'showgrid': False},
-        'yaxis': {
-            'title': '% change',
-            'tickformat': ',.0%',
-            'showgrid': False
-        },
-        'margin': {'l': 250,'r': 150,'t': 20,'b': 20},
-        'height': 500,
-        'width': 1250,
-    })
-    figure12_ci = {'data': figure12_ci_plot_data,'layout': figure1_ci_layout}
-    figure1_ts= {'data': figure1_ts_plot_data,'layout': figure1_ts_layout}
-    #================================== Figure 1 ==================================#
-
-    #================================== Table 1 ===================================#
-    table1_filtered = df_dict['table1'].loc[df_dict['table1']['geography'] == geography,['variable','coefficient','p_value','standard_error']]
-    colnames = ['Variable','Coefficient','P-value','Standard Error']
-    table1_filtered.columns = colnames
-    table1 = dash_table.DataTable(
-        id = 'table1',
-        columns = [{"name": i, "id": i} for i in table1_filtered.columns],
-        data = table1_filtered.to_dict('records'),
-        style_cell = {'textAlign': 'left', 'font_size': '16 px'},
-        style_as_list_view = True,
-    )   
-    #================================== Table 1 ===================================#
-
-    #================================= Figure 2 ===================================#
-    figure2_filtered        = df_dict['figure2'].loc[df_dict['figure2'].geography == geography,:]
-    figure2_breakpoints     = figure2_filtered.loc[figure2_filtered.breakpoint == 1,:]
-    figure2_breakpoints_sip = figure2_filtered.loc[figure2_filtered.breakpoint_and_SIP_chg == 1,:]
-    figure2_breakpoints_sip.reset_index(inplace = True)
-    if figure2_breakpoints_sip.shape[0] > 0:
-        figure2_breakpoints_sip.loc[:,'breakpoint_ind'] = np.arange(0,figure2_breakpoints_sip.shape[0])
-        figure2_breakpoints_sip.loc[:,'ymin'] = np.min(figure2_filtered['percent_red'].values)
-        figure2_breakpoints_sip.loc[:,'ymax'] = np.max(figure2_filtered['percent_red'].values)
-        figure2_breakpoints_sip_both = pd.concat([figure2_breakpoints_sip, figure2_breakpoints_sip], axis = 0, ignore_index = True)
-        figure2_breakpoints_sip_both.reset_index(inplace = True)
-        figure2_breakpoints_sip_both.loc[:,'y'] = figure2_breakpoints_sip_both['ymax']
-        figure2_breakpoints_sip_both.loc[1:figure2_breakpoints_sip.shape[0],'y'] = figure2_breakpoints_sip_both['ymin']
-        figure2_breakpoints_sip_both.sort_values(by = ['breakpoint_ind','y'], inplace = True)
-
-    figure2_ts_plot_data = [
-        go.Scatter(
-            x = figure2_filtered['date'],
-            y = figure2_filtered['percent_red'],
-            mode = 'lines',
-            line_color = 'cornflowerblue',
-            name = 'Elect. use chg',
-            opacity = 1
+        html.Div(
+            id = 'table4-div',
+            style = {
+                'width': '50%', 'textAlign':'center', 'padding-left':'25%','padding-right':'25%',
+                'height': '95%','padding-top':'5%'
+            }
+        ), 
+        html.Div(
+            id = 'table4-title-container',
+            className = 'table-title-container',
+            children = [
+                html.P(
+                    "Table 4:",
+                    className ='table-title-left'
+                ),
+                html.P(
+                    "Regression of changes in electricity use on changes in workplace, transit, residential,retail/recreation, grocery/pharmacy and parks mobility all together in one model, Feb-May 2020.",
+                    className ='table-title-right'
+                ),
+            ]
         ),
-        go.Scatter(
-            x = figure2_filtered['date'],
-            y = figure2_filtered['mars_elec'],
-            mode = 'lines',
-            line_color = 'orange',
-            name = 'MARS fit',
-            opacity = 1
+        html.Div(children = html.Hr(), style = {'padding-left': '100px', 'padding-right': '100px', 'padding-top': '100px'}),
+        html.Div(
+            children = [
+                html.Div(
+                    id = 'figure3-div',
+                    style = {'height': '100%', 'padding-left':'8%'},
+                    className = 'column',
+                    children = [
+                        html.Div(
+                            style = {'height': '10%'},
+                            children = dcc.Graph(id = 'figure3-graph')
+                        ),
+                        html.P(
+                            "Fig. 3:",
+                            className ='figure-title-left-2col'
+                        ),
+                        html.P(
+                            "Observed daily load shapes for workdays and weekends April 2016-2019 vs. April 2020.",
+                            className ='figure-title-right-2col'
+                        )
+                    ]
+                ),
+                html.Div(
+                    id = 'table5-container',
+                    style = {'height': '100%','padding-right':'20%','padding-top':'15%'},
+                    className = 'column',
+                    children = [
+                        html.Div(id = 'table5-div'),
+                        html.Div(
+                            id = 'table5-title-container',
+                            className = 'table-title-container-2col',
+                            style = {'padding-top': '25%'},
+                            children = [
+                                html.P(
+                                    "Table 5:",
+                                    className ='table-title-left-2col'
+                                ),
+                                html.P(
+                                    "Changes in peak and baseload (MW, timing) for workdays April 2016-2019 vs, April 2020.",
+                                    className ='table-title-right-2col'
+                                )
+                            ]
+                        )
+                    ]
+                )
+            ],
+            className = 'row'
         ),
-        go.Scatter(
-            x = figure2_breakpoints['date'],
-            y = figure2_breakpoints['mars_elec'],
-            mode = 'markers',
-            line_color = 'red',
-            name = 'Break Point',
-            opacity = 1
-        )  
+        html.Div(children = html.Hr(), style = {'padding-left': '100px', 'padding-right': '100px', 'padding-top': '50px'})  
     ]
-    # figure2_breakpoints_sip_both.to_csv(os.path.join(local_dir,'figure2_breakpoints_sip_both.csv'))
-    if figure2_breakpoints_sip.shape[0] > 0:
-        figure2_ts_plot_data += [
-            go.Scatter(
-                x = figure2_breakpoints_sip_both.loc[figure2_breakpoints_sip_both.breakpoint_ind == 0,'date'],
-                y = figure2_breakpoints_sip_both.loc[figure2_breakpoints_sip_both.breakpoint_ind == 0,'y'],
-                mode = 'lines',
-                line_color = 'mediumseagreen',
-                name = 'CI Change',
-                showlegend = True
-            )
-        ]
-    if figure2_breakpoints_sip.shape[0] > 1:
-        figure2_ts_plot_data += [
-            go.Scatter(
-                x = figure2_breakpoints_sip_both.loc[figure2_breakpoints_sip_both.breakpoint_ind == i,'date'],
-                y = figure2_breakpoints_sip_both.loc[figure2_breakpoints_sip_both.breakpoint_ind == i,'y'],
-                mode = 'lines',
-                line_color = 'mediumseagreen',
-                name = 'CI Change',
-                showlegend = False
-            ) for i in figure2_breakpoints_sip['breakpoint_ind'].values[1:]
+
+    if compare_enabled:
+        layoutChildren += comparison_layout(geographies)
+    if callback_mode == 'clientside':
+        layoutChildren.append(dcc.Store(id = 'geography-data', data = geography_data_store(snapshot)))
+    if reload_enabled:
+        layoutChildren += [
+            dcc.Store(id = 'data-version', data = snapshot.data_version),
+            dcc.Interval(id = 'data-version-interval', interval = 60 * 1000),
         ]
 
-    figure2_ts_layout = go.Layout({
-        'xaxis': {'title': '','showgrid': False},
-        'yaxis': {
-            'title': '% change elect. demand',
-            'tickformat': ',.0%',
-            'showgrid': False
-        },
-        'margin': {'l': 200},
-        'height': 400,
-        'width': 700
-        # 'shapes': fig2_shapes
-    })
-    figure2_ci_layout = go.Layout({
-        'xaxis': {'title': False,'showgrid': False,'visible': False},
-        'yaxis': {
-            'title': 'CI Level',
-            'tickvals': [0,1,2,3],
-            'showgrid': False
-
-        },
-        'margin': {'l': 200},
-        'height': 210,
-        'width': 630
-    })
+    return html.Div(
+        id = 'page-content', 
+        children = layoutChildren, 
+        style = {'fontFamily':'sans-serif','backgroundColor':'white'}
+    )
+
+
+app.layout = serve_layout
+
+
+# Cached results are keyed (kind, geography, version, ...): the geography's
+# version token for per-geography results, and None with the data version
+# for results over all of the data. A reload then only invalidates the
+# geographies whose rows changed.
+
 
-    figure2_ci = {'data': figure12_ci_plot_data,'layout': figure2_ci_layout}
-    figure2_ts = {'data': figure2_ts_plot_data,'layout': figure2_ts_layout}
-    #================================= Figure 2 ===================================#
-
-    #================================= Table 2 ====================================#    
-    table2_filtered = df_dict['table2'].loc[df_dict['table2']['geography'] == geography,['Term','Break Point','Date','Slope After']]
-    table2 = dash_table.DataTable(
-        id = 'table2',
-        columns = [{"name": i, "id": i} for i in table2_filtered.columns],
-        data = table2_filtered.to_dict('records'),
-        style_cell = {'textAlign' : 'center ', 'font_size' : '16 px'},
-        style_as_list_view = True,
+def render_section(section, geography, snapshot):
+
+    # Outputs only depend on the section, the geography and its rows.
+    # Geographies the data doesn't have render empty and aren't cached, so
+    # requests for them can't evict the pages of real ones.
+    if not snapshot.serves(geography):
+        return encoded_section(section, None, snapshot)
+    return response_cache.get((section, geography, snapshot.version(geography)), encoded_section, section, geography, snapshot)
+
+
+def encoded_section(section, geography, snapshot):
+
+    # Figures in the configured payload encoding, tables as built
+    with metrics.section(section) as timer:
+        outputs = section_builders[section](timer.index(snapshot.geo_index), geography)
+        timer.split('build')
+        encoded = tuple(
+            encode_figure(output, payload_mode, display_decimals.get(component_id)) if component_property == 'figure' else output
+            for output, (component_id, component_property) in zip(outputs, section_outputs[section])
+        )
+        timer.split('encode')
+    return encoded
+
+
+def filtered_si_results(geography, snapshot = None):
+
+    # Every section output in page order, with the sections rendered concurrently
+    snapshot = snapshot or reloader.snapshot
+    render = metrics.bind(render_section)
+    results = section_executor().map(lambda section: render(section, geography, snapshot), section_builders)
+    return tuple(output for result in results for output in result)
+
+
+def geography_data(geography, snapshot):
+
+    # Every section output for a geography as one JSON document, keyed by
+    # "component id.property"
+    return response_cache.get(('geography-data', geography, snapshot.version(geography)), render_geography_data, geography, snapshot)
+
+
+def render_geography_data(geography, snapshot):
+    with metrics.section('geography-data') as timer:
+        outputs = filtered_si_results(geography, snapshot)
+        timer.split('sections')
+        data = json.dumps(
+            {'{}.{}'.format(*output): value for output, value in zip(page_outputs, outputs)},
+            cls = plotly.utils.PlotlyJSONEncoder
+        ).encode('utf-8')
+        timer.split('serialize')
+    return data
+
+
+def render_comparison(geographies, snapshot):
+
+    # Each geography's part of the comparison is cached on its own, so
+    # changing the selection only builds the geographies it adds, and those
+    # together in one pass over the tables
+    geographies = [geography for geography in dict.fromkeys(geographies or []) if snapshot.serves(geography)]
+    fragments = {}
+    for geography in geographies:
+        fragment = response_cache.lookup(('compare', geography, snapshot.version(geography)))
+        if fragment is not None:
+            fragments[geography] = fragment
+    missing = [geography for geography in geographies if geography not in fragments]
+    if missing:
+        with metrics.section('compare') as timer:
+            built = comparison_fragments(timer.index(snapshot.geo_index), missing)
+            timer.split('build')
+        for geography, fragment in built.items():
+            response_cache.put(('compare', geography, snapshot.version(geography)), fragment)
+        fragments.update(built)
+
+    outputs = comparison_section(fragments, geographies, compare_max_traces)
+    return tuple(
+        encode_figure(output, payload_mode, display_decimals.get(component_id)) if component_property == 'figure' else output
+        for output, (component_id, component_property) in zip(outputs, comparison_outputs)
     )
-    #================================= Table 2 ====================================#    
-
-    #================================= Table 3 ====================================#    
-    table3_filtered = df_dict['table3'].loc[df_dict['table3']['geography'] == geography,['mobility_type_desc','coefficient','standard_error','p_value','R2','N']]
-    colnames = ['Variable','Coefficient','Standard Error','P-value','R-squared','N']
-    table3_filtered.columns = colnames
-    table3 = dash_table.DataTable(
-        id = 'table3',
-        columns = [{"name": i, "id": i} for i in table3_filtered.columns],
-        data = table3_filtered.to_dict('records'),
-        style_cell = {'textAlign': 'left', 'font_size': '16 px'},
-        style_as_list_view = True,
+
+
+def line_pyramids(graph_id, geography, snapshot):
+
+    # Resolutions of a graph's lines, built once per geography and version
+    return response_cache.get(
+        ('pyramid', geography, snapshot.version(geography), graph_id), series_pyramids, snapshot.geo_index, graph_id, geography
     )
-    #================================= Table 3 ====================================#    
-
-    #================================= Table 4 ====================================#   
-    table4_filtered = df_dict['table4'].loc[df_dict['table4']['geography'] == geography,['mobility_type_desc','coefficient','standard_error','p_value']]
-    colnames = ['Variable','Coefficient','Standard Error','P-value']
-    table4_filtered.columns = colnames
-    table4 = dash_table.DataTable(
-        id = 'table4',
-        columns = [{"name": i, "id": i} for i in table4_filtered.columns],
-        data = table4_filtered.to_dict('records'),
-        style_cell = {'textAlign': 'left', 'font_size': '16 px'},
-        style_as_list_view = True,
+
+
+def render_zoom(graph_id, geography, bounds, snapshot):
+
+    # A patch of the graph's lines over the range shown, from the
+    # geography's pyramids, or None when its lines are all sent whole
+    if not snapshot.serves(geography):
+        return None
+    with metrics.section('zoom') as timer:
+        pyramids = line_pyramids(graph_id, geography, snapshot)
+        timer.split('pyramids')
+        lines = zoomed_lines(pyramids, *bounds)
+        timer.split('window')
+        if lines is None:
+            return None
+        encoded = encode_figure({'data': [{'x': x, 'y': y} for x, y in lines], 'layout': {}}, payload_mode, display_decimals.get(graph_id))
+        figure = Patch()
+        for trace, line in enumerate(encoded['data']):
+            for key in ['x', 'x0', 'dx', 'y']:
+                if key in line:
+                    figure['data'][trace][key] = line[key]
+                else:
+                    del figure['data'][trace][key]
+        if 'xaxis' in encoded['layout']:
+            figure['layout']['xaxis']['type'] = 'date'
+        timer.split('encode')
+    return figure
+
+
+def register_zoom_callback(graph_id):
+
+    @app.callback(
+        Output(graph_id, 'figure', allow_duplicate = True),
+        [Input(graph_id, 'relayoutData')],
+        [State('geography-dropdown','value')],
+        prevent_initial_call = True
     )
+    def zoom_lines(relayout_data, geography):
+        bounds = range_bounds(relayout_data)
+        figure = None if bounds is None else render_zoom(graph_id, geography, bounds, reloader.snapshot)
+        if figure is None:
+            raise PreventUpdate
+        return figure
 
-    #================================= Table 4 ====================================#    
-
-    #================================= Figure 3 ===================================#
-    figure3_filtered = df_dict['figure3'].loc[df_dict['figure3']['geography'] == geography,:]
-    figure3_weekend_historical = figure3_filtered.loc[figure3_filtered['Day.type'] == 'weekend - Historic (April 2016-2019)',:]
-    figure3_weekday_historical = figure3_filtered.loc[figure3_filtered['Day.type'] == 'workday - Historic (April 2016-2019)',:]
-    figure3_weekday_actual     = figure3_filtered.loc[figure3_filtered['Day.type'] == 'workday - April 2020',:]
-    hovertemplate = 'Hour: %{x}, Demand: %{y:,.0f}<extra></extra>'
-    figure3_plot_data = [
-        go.Scatter(
-            x = figure3_weekend_historical['hour'],
-            y = figure3_weekend_historical['load_median'],
-            mode = 'lines',
-            line_color = 'cornflowerblue',
-            name = 'weekend − Historic (April 2016−2019)',
-            line = {'dash':'dash'},
-            hovertemplate = hovertemplate
-        ),
-        go.Scatter(
-            x = figure3_weekend_historical['hour'],
-            y = figure3_weekend_historical['load_Q10'],
-            line_color='cornflowerblue',
-            line = {'dash':'dash'},
-            name = 'weekend − Historic (April 2016−2019)',
-            showlegend = False,
-            hovertemplate = hovertemplate
-        ),
-        go.Scatter(
-            x = figure3_weekend_historical['hour'],
-            y = figure3_weekend_historical['load_Q90'],
-            fill = 'tonexty',
-            line_color='cornflowerblue',
-            line = {'dash':'dash'},
-            name = 'weekend − Historic (April 2016−2019)',
-            showlegend = False,
-            hovertemplate = hovertemplate
-        ),
-        go.Scatter(
-            x = figure3_weekday_historical['hour'],
-            y = figure3_weekday_historical['load_median'],
-            mode = 'lines',
-            line_color = 'cornflowerblue',
-            name = 'working day − Historic (April 2016−2019)',
-            hovertemplate = hovertemplate
-        ),
-        go.Scatter(
-            x = figure3_weekday_historical['hour'],
-            y = figure3_weekday_historical['load_Q10'],
-            line_color = 'cornflowerblue',
-            name = 'working day − Historic (April 2016−2019)',            
-            opacity = 0.2,
-            showlegend = False,
-            hovertemplate = hovertemplate
-        ),
-        go.Scatter(
-            x = figure3_weekday_historical['hour'],
-            y = figure3_weekday_historical['load_Q90'],
-            fill = 'tonexty',
-            line_color = 'cornflowerblue',
-            name = 'working day − Historic (April 2016−2019)',            
-            showlegend = False,
-            hovertemplate = hovertemplate
-        ),
-        go.Scatter(
-            x = figure3_weekday_actual['hour'],
-            y = figure3_weekday_actual['load_median'],
-            mode = 'lines',
-            line_color = 'red',
-            name = 'working day − April 2020',
-            hovertemplate = hovertemplate
-        ),
-        go.Scatter(
-            x = figure3_weekday_actual['hour'],
-            y = figure3_weekday_actual['load_Q10'],
-            line_color = 'red',
-            name = 'working day − April 2020',
-            showlegend = False,
-            hovertemplate = hovertemplate
-        ),
-        go.Scatter(
-            x = figure3_weekday_actual['hour'],
-            y = figure3_weekday_actual['load_Q90'],
-            fill = 'tonexty',
-            line_color = 'red',
-            name = 'working day − April 2020',
-            showlegend = False,
-            hovertemplate = hovertemplate
-        )
-    ]
-    figure3_layout = go.Layout({
-        'xaxis': {'title': 'Hour of day','showgrid': False},
-        'yaxis': {
-            'title': 'Load (MW)',
-            'tickformat': ',d',
-            'showgrid': False
-        },
-        'legend': {'yanchor' : 'top', 'y' : 0.99, 'xanchor' : 'left', 'x' : 0.01, 'bgcolor': 'rgba(255,255,255,0.4)'},
+
+def register_section_callback(section, outputs):
+
+    @app.callback(
+        [Output(component_id, component_property) for component_id, component_property in outputs],
+        geography_inputs
+    )
+    def section_results(geography, *data_version):
+        return render_section(section, geography, reloader.snapshot)
+
+
+def discard_changed(previous, snapshot, changed):
+
+    # Cached results of the geographies a reload changed and over all of the
+    # previous data; everything else is still current
+    changed = set(changed)
+    response_cache.discard(lambda key: (
+        key[1] in changed and key[2] == previous.version(key[1]) or key[1] is None and key[2] == previous.data_version
+    ))
+    if cache_warm:
+        for geography in changed & snapshot.geography_set:
+            warm_geography(geography, snapshot)
+
+
+def warm_geography(geography, snapshot):
+
+    # Renders a geography's page and builds its zoom pyramids ahead of the
+    # first request for them
+    filtered_si_results(geography, snapshot)
+    if zoom_enabled:
+        for graph_id in zoom_series:
+            line_pyramids(graph_id, geography, snapshot)
+
+
+section_builders = {section: builder for section, builder, outputs in sections}
+section_outputs = {section: outputs for section, builder, outputs in sections}
+section_threads = int(os.environ.get('COVID_SI_SECTION_THREADS', len(sections)))
+section_pool = None
+section_pool_pid = None
+
+
+def section_executor():
+
+    # Threads don't survive a fork, so a worker process forked from a parent
+    # that already rendered gets a pool of its own
+    global section_pool, section_pool_pid
+    if section_pool_pid != os.getpid():
+        section_pool = ThreadPoolExecutor(max_workers = section_threads)
+        section_pool_pid = os.getpid()
+    return section_pool
+
+
+# Figure payload encoding, one of si_encode.payload_modes
+payload_mode = os.environ.get('COVID_SI_PAYLOAD', 'full')
+if payload_mode not in payload_modes:
+    raise ValueError('COVID_SI_PAYLOAD must be one of {}'.format(', '.join(payload_modes)))
+
+# Per-section phase timers, request latency and response sizes on /metrics
+# with COVID_SI_METRICS=1; COVID_SI_SLOW_REQUEST_MS then also logs slower
+# requests with their section breakdown to stderr
+slow_request_ms = os.environ.get('COVID_SI_SLOW_REQUEST_MS')
+metrics = Metrics(
+    enabled = os.environ.get('COVID_SI_METRICS', '0') == '1',
+    slow_seconds = float(slow_request_ms) / 1000 if slow_request_ms else None,
+)
+
+# Rendered outputs per (section, geography, data version), least recently
+# used evicted past COVID_SI_CACHE_SIZE entries. COVID_SI_CACHE_WARM=1
+# pre-renders every geography, and builds its zoom pyramids, at startup.
+response_cache = ResponseCache(maxsize = int(os.environ.get('COVID_SI_CACHE_SIZE', 512)))
+reloader.on_swap = discard_changed
+cache_warm = os.environ.get('COVID_SI_CACHE_WARM', '0') == '1'
+if cache_warm:
+    for geography in reloader.snapshot.geographies:
+        warm_geography(geography, reloader.snapshot)
+
+# Pages re-render when they notice new data, as well as on a new geography
+geography_inputs = [Input('geography-dropdown','value')]
+if reload_enabled:
+    geography_inputs.append(Input('data-version','data'))
+
+# By default every section is its own callback, so the browser requests them
+# in parallel and paints each one as soon as it arrives. 'single' keeps the
+# original one-callback-for-every-output behaviour. 'clientside' fetches each
+# geography's outputs once as a static JSON document (/geography-data/...)
+# and switches geography in the browser (assets/si_clientside.js).
+if callback_mode == 'single':
+    app.callback(
+        [Output(component_id, component_property) for component_id, component_property in page_outputs],
+        geography_inputs
+    )(lambda geography, *data_version: filtered_si_results(geography))
+elif callback_mode == 'clientside':
+    app.clientside_callback(
+        ClientsideFunction(namespace = 'si', function_name = 'render_geography'),
+        [Output(component_id, component_property) for component_id, component_property in page_outputs],
+        [Input('geography-dropdown','value'), Input('geography-data','data')]
+    )
+else:
+    for section, builder, outputs in sections:
+        register_section_callback(section, outputs)
+
+if compare_enabled:
+
+    @app.callback(
+        [Output(component_id, component_property) for component_id, component_property in comparison_outputs],
+        [Input('compare-dropdown','value')] + geography_inputs[1:]
+    )
+    def compare_results(geographies, *data_version):
+        return render_comparison(geographies, reloader.snapshot)
+
+if zoom_enabled:
+    for graph_id in zoom_series:
+        register_zoom_callback(graph_id)
+
+# Figure 2's CI graph reuses the series already sent for Figure 1
+app.clientside_callback(
+    """
+    function(figure1_ci, figure2_ci) {
+        return {'data': figure1_ci ? figure1_ci.data : [], 'layout': figure2_ci.layout};
+    }
+    """,
+    Output('figure2-ci-graph','figure'),
+    [Input('figure1-ci-graph','figure')],
+    [State('figure2-ci-graph','figure')]
+)
+
+if reload_enabled:
+
+    @app.callback(
+        [Output('geography-dropdown','options'), Output('data-version','data')]
+        + ([Output('geography-data','data')] if callback_mode == 'clientside' else [])
+        + ([Output('compare-dropdown','options')] if compare_enabled else []),
+        [Input('data-version-interval','n_intervals')],
+        [State('data-version','data')]
+    )
+    def refresh_data_version(n_intervals, data_version):
+        snapshot = reloader.snapshot
+        if data_version == snapshot.data_version:
+            raise PreventUpdate
+        results = [geography_options(snapshot.geographies), snapshot.data_version]
+        if callback_mode == 'clientside':
+            results.append(geography_data_store(snapshot))
+        if compare_enabled:
+            results.append(geography_options(snapshot.geographies))
+        return results
+
+    @server.before_request
+    def poll_for_reloads():
+        reloader.ensure_polling(reload_interval)
+
+# Request latency and bytes sent, labelled by route and geography. Hooks run
+# after_request in reverse order, so this one, registered first, sees the
+# compressed size. Geographies come from the client, so any that the data
+# doesn't have are all labelled 'other', which bounds the label values.
+if metrics.enabled:
+
+    @server.before_request
+    def start_request_trace():
+        metrics.start_request(flask.request.path)
+
+    @server.after_request
+    def record_request(response):
+        request = flask.request
+        geography = (request.view_args or {}).get('geography')
+        if geography is None and request.path.endswith('_dash-update-component'):
+            body = request.get_json(silent = True) or {}
+            geography = next((i.get('value') for i in body.get('inputs', []) if i.get('id') == 'geography-dropdown'), None)
+        if geography is not None and not reloader.snapshot.serves(geography):
+            geography = 'other'
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        size = None if response.is_streamed else response.content_length
+        metrics.finish_request(route, geography, response.status_code, size)
+        return response
+
+    @server.route('/metrics')
+    def prometheus_metrics():
+        stats = response_cache.stats()
+        gauges = [
+            ('si_cache_hits_total', 'Response cache hits.', 'counter', (), stats['hits']),
+            ('si_cache_misses_total', 'Response cache misses.', 'counter', (), stats['misses']),
+            ('si_cache_entries', 'Entries in the response cache.', 'gauge', (), stats['size']),
+            ('si_data_reloads_total', 'Data reloads swapped in.', 'counter', (), reloader.reloads),
+        ]
+        return flask.Response(metrics.render(gauges), mimetype = 'text/plain; version=0.0.4')
+
+# gzip (or brotli, when installed) callback responses for clients that accept
+# it, unless COVID_SI_COMPRESS=0
+compress_responses = os.environ.get('COVID_SI_COMPRESS', '1') == '1'
+
+
+@server.after_request
+
+def compress_callback_responses(response):
+    path = flask.request.path
+    if compress_responses and (path.endswith('_dash-update-component') or path.startswith(('/geography-data/', '/api/'))):
+        return compress_response(response, flask.request.headers.get('Accept-Encoding', ''))
+    return response
+
+
+@server.route('/geography-data/<version>/<geography>.json')
+
+def geography_data_file(version, geography):
+    # Versioned URLs, so browsers and proxies may keep them indefinitely.
+    # Pages still on an older version are sent to the current one.
+    snapshot = reloader.snapshot
+    if not snapshot.serves(geography):
+        flask.abort(404)
+    if version != snapshot.data_version:
+        response = flask.redirect(app.get_relative_path('/geography-data/{}/{}.json'.format(snapshot.data_version, urllib.parse.quote(geography))))
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    response = flask.Response(geography_data(geography, snapshot), mimetype = 'application/json')
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+#=============================== Data API ===============================#
+# Read-only JSON over the same tables. Responses carry an ETag derived from
+# the data version, so a matching If-None-Match gets a 304 before anything
+# is built, and may be cached for COVID_SI_API_MAX_AGE seconds.
+api_max_age = int(os.environ.get('COVID_SI_API_MAX_AGE', 300))
+
+
+def api_error(status, message):
+    response = jsonify({'error': message})
+    response.status_code = status
+    return response
+
+
+def api_response(key, render, *args):
+    etag = si_api.etag(key)
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status = 304)
+    else:
+        body = response_cache.get(key, lambda: json.dumps(render(*args), separators = (',', ':')).encode('utf-8'))
+        response = flask.Response(body, mimetype = 'application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age={}'.format(api_max_age)
+    return response
+
+
+@server.route('/api/geographies')
+
+def api_geographies():
+    snapshot = reloader.snapshot
+    return api_response(('api', None, snapshot.data_version, 'geographies'), lambda: snapshot.geographies)
+
+
+@server.route('/api/tables')
+
+def api_tables():
+    # Every table with its fields and default orientation
+    return api_response(('api', None, None, 'tables'), lambda: {
+        df_name: {'fields': si_api.api_fields[df_name], 'orient': si_api.default_orient(df_name)} for df_name in df_names
     })
-    figure3 = {'data': figure3_plot_data,'layout': figure3_layout}
-    #================================= Figure 3 ===================================#
 
-    #================================= Table 5 ====================================# 
-    table5_filtered = df_dict['table5'].loc[df_dict['table5']['geography'] == geography, ['type_desc','historic','actual']]
-    colnames = ['Load shape measure','April 2016-2019','April 2020']
-    table5_filtered.columns = colnames
-    table5 = [dash_table.DataTable(
-        id = 'table5',
-        columns = [{"name": i, "id": i} for i in table5_filtered.columns],
-        data = table5_filtered.to_dict('records'),
-        style_cell = {'textAlign': 'left', 'font_size': '16 px'},
-        style_as_list_view = True,
-    )]
-    #================================= Table 5 ====================================# 
 
-    return figure12_ci, figure1_ts, table1, figure2_ci, figure2_ts, table2, table3, table4, figure3, table5
+@server.route('/api/geographies/<geography>/<df_name>')
+
+def api_table(geography, df_name):
+    # ?fields=a,b projects to those fields, ?orient=columns|records
+    snapshot = reloader.snapshot
+    if not snapshot.serves(geography):
+        return api_error(404, 'Unknown geography: {}'.format(geography))
+    if df_name not in df_names:
+        return api_error(404, 'Unknown table: {}'.format(df_name))
+    try:
+        fields = si_api.parse_fields(df_name, flask.request.args.get('fields'))
+    except ValueError as error:
+        return api_error(400, str(error))
+    orient = flask.request.args.get('orient', si_api.default_orient(df_name))
+    if orient not in si_api.orients:
+        return api_error(400, 'orient must be one of {}'.format(', '.join(si_api.orients)))
+
+    return api_response(
+        ('api', geography, snapshot.version(geography), df_name, fields, orient),
+        si_api.table_json, snapshot.geo_index, df_name, geography, fields, orient
+    )
+#=============================== Data API ===============================#
+
+
+@server.route('/cache-stats')
+
+def cache_stats():
+    # Only there with COVID_SI_METRICS=1 or COVID_SI_ADMIN_TOKEN set. The
+    # text of the last reload error is only given to the admin token's bearer.
+    if not (metrics.enabled or admin_token):
+        flask.abort(404)
+    stats = dict(response_cache.stats(), **reloader.stats())
+    if admin_request():
+        stats['last_error'] = reloader.last_error
+    return jsonify(stats)
+
 
+def admin_request():
+    # Whether the request carries COVID_SI_ADMIN_TOKEN as its bearer token
+    authorization = flask.request.headers.get('Authorization', '')
+    return bool(admin_token) and hmac.compare_digest(authorization, 'Bearer ' + admin_token)
 
-# @app.callback(
-#     Output('download-zip', 'href'), 
-#     [Input('geography-dropdown','value')]
-# )
 
-# def load_link(value):
-#     return '/download_csv'
+@server.route('/admin/reload', methods = ['POST'])
 
-# @app.server.route('/download_csv')
+def admin_reload():
+    # Only there when COVID_SI_ADMIN_TOKEN is set, and only for its bearer
+    if not admin_token:
+        flask.abort(404)
+    if not admin_request():
+        return api_error(401, 'Unauthorized')
+    return jsonify(reloader.request_reload())
 
-# def download_csv():
 
-#     zip_object = ZipFile('covid-data.zip', 'w')
-#     for file_name in df_dict:
-#         data_sub = df_dict[file_name]
-#         zip_object.write('{}.csv'.format(file_name))
+#============================== Bulk download ==============================#
+# Zip of the source CSVs, streamed as it is built. ?geographies=a,b and
+# ?tables=t1,t2 (comma separated) select a subset; the full archive is built
+# once per data version and served from the response cache.
 
-#     zip_object.close()
 
-#     return send_file(
-#         'covid-data.zip',
-#         attachment_filename = 'covid-data.zip',
-#         as_attachment = True
-#     )
+def download_members(snapshot, selected_tables, selected_geographies):
+    for df_name in selected_tables:
+        header, rows = response_cache.get(
+            ('csv-rows', None, snapshot.data_version, df_name), csv_rows, snapshot.data_dir, df_name, snapshot.appended.get(df_name, [])
+        )
+        keep = selected_geographies or snapshot.served_geographies or list(rows)
+        yield df_name + '.csv', header + b''.join(rows[geography] for geography in keep if geography in rows)
+
+
+def download_time(snapshot):
+    # Archive entries are dated by the newest source or delta file
+    paths = [os.path.join(snapshot.data_dir, df_name + '.csv') for df_name in df_names]
+    paths += [path for df_name in snapshot.appended for path in snapshot.appended[df_name]]
+    return time.localtime(max(os.path.getmtime(path) for path in paths))[:6]
+
+
+def request_list(name, allowed):
+    # Comma separated values of a query parameter, None when it is absent.
+    # Raises ValueError naming any value that is not allowed.
+    values = [value.strip() for value in flask.request.args.get(name, '').split(',') if value.strip()]
+    unknown = [value for value in values if value not in allowed]
+    if unknown:
+        raise ValueError('Unknown {}: {}'.format(name, ', '.join(unknown)))
+    return values or None
+
+
+@server.route('/download_csv')
+
+def download_csv():
+    snapshot = reloader.snapshot
+    try:
+        selected_geographies = request_list('geographies', snapshot.geography_set)
+        selected_tables = request_list('tables', df_names)
+    except ValueError as error:
+        return api_error(400, str(error))
+    headers = {'Content-Disposition': 'attachment; filename=covid-data.zip'}
+
+    if selected_geographies is None and selected_tables is None:
+        etag = si_api.etag(('download', None, snapshot.data_version))
+        if flask.request.if_none_match.contains(etag):
+            response = flask.Response(status = 304)
+        else:
+            archive = response_cache.get(('download', None, snapshot.data_version), lambda: b''.join(
+                zip_stream(download_members(snapshot, df_names, None), date_time = download_time(snapshot))
+            ))
+            response = flask.Response(archive, mimetype = 'application/zip', headers = headers)
+        response.set_etag(etag)
+        return response
+
+    return flask.Response(
+        flask.stream_with_context(zip_stream(
+            download_members(snapshot, selected_tables or df_names, selected_geographies), date_time = download_time(snapshot)
+        )),
+        mimetype = 'application/zip',
+        headers = headers
+    )
+#============================== Bulk download ==============================#
 
 
+# Development server; see si_gunicorn.py for production
 if __name__ == '__main__':
 
     app.run_server(debug = True, host = '0.0.0.0', port = 8080)
@@ -0,0 +1,74 @@
+# In-process response cache for the supplemental information callbacks
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    # Least recently used cache of rendered callback outputs. Keys should
+    # carry everything the output depends on (geography and data version),
+    # values are reused as-is so they must not be mutated by the caller.
+
+    def __init__(self, maxsize = 64):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, render, *args):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+
+        # Render outside the lock so a slow miss doesn't block hits
+        value = render(*args)
+        self.put(key, value)
+        return value
+
+    def lookup(self, key):
+        # The cached value, or None, without rendering on a miss
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last = False)
+                self.evictions += 1
+
+    def discard(self, predicate):
+        # Drops every entry whose key satisfies predicate, returns how many
+        with self.lock:
+            keys = [key for key in self.entries if predicate(key)]
+            for key in keys:
+                del self.entries[key]
+        return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / requests if requests else None,
+            }
@@ -0,0 +1,616 @@
+# Data access helpers for the supplemental information app
+import os
+import copy
+import glob
+import json
+import hashlib
+import threading
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+df_names = ['figure1','figure12_sip','table1','figure2','table2','figure3','table3','table4','table5']
+default_data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# Where tables are queried from: frames in memory (from the columnar store or
+# the CSVs) or an ingested SQLite database (see si_sqlite.py)
+backends = ['memory', 'sqlite']
+
+# Daily updates of the time series tables arrive as delta files of new rows,
+# data_dir/appends/<table>-<label>.csv with the table's columns, applied in
+# name order on top of the table (see DataSnapshot.append)
+appendable = ['figure1', 'figure12_sip']
+appends_dir = 'appends'
+
+
+# Column dtypes per table. Strings that repeat become categoricals, dates are
+# parsed, series are float32 and table estimates are nullable numerics, with
+# the "-" placeholders read as NA. Display formatting happens at render time.
+schema = {
+    'figure1': {
+        'date': 'datetime64[ns]', 'geography': 'category',
+        'percent_red': 'float32', 'percent_red_upper': 'float32', 'percent_red_lower': 'float32',
+        'week_2020': 'int8', 'grocery_pharmacy': 'float32', 'workplace': 'float32', 'residential': 'float32',
+    },
+    'figure12_sip': {'date': 'datetime64[ns]', 'geography': 'category', 'SIP': 'int8'},
+    'table1': {
+        'geography': 'category', 'variable': 'category',
+        'coefficient': 'Float32', 'p_value': 'Float32', 'standard_error': 'Float32',
+    },
+    'figure2': {
+        'geography': 'category', 'date': 'datetime64[ns]', 'percent_red': 'float32', 'mars_elec': 'float32',
+        'breakpoint': 'float32', 'SIP_change': 'float32', 'breakpoint_and_SIP_chg': 'float32',
+    },
+    'table2': {
+        'geography': 'category', 'Term': 'category', 'Break Point': 'category', 'Date': 'datetime64[ns]',
+        'Slope After': 'Float32', 'Slope Before': 'Float32', 'Day since start of period': 'Int16',
+    },
+    'figure3': {
+        'hour': 'int8', 'period': 'category', 'load_Q10': 'float32', 'load_median': 'float32', 'load_Q90': 'float32',
+        'day_type': 'category', 'cluster': 'int8', 'cluster_name': 'category', 'geography': 'category', 'Day.type': 'category',
+    },
+    'table3': {
+        'geography': 'category', 'mobility_type_desc': 'category', 'coefficient': 'Float32',
+        'standard_error': 'Float32', 'p_value': 'Float32', 'R2': 'Float32', 'N': 'Float32',
+    },
+    'table4': {
+        'geography': 'category', 'mobility_type_desc': 'category', 'coefficient': 'Float32',
+        'standard_error': 'Float32', 'p_value': 'Float32',
+    },
+    'table5': {'geography': 'category', 'type_desc': 'category', 'historic': 'Int32', 'actual': 'Int32'},
+}
+
+
+def read_csv_table(data_dir, df_name):
+    return read_csv_file(os.path.join(os.path.expanduser(data_dir), df_name + '.csv'), df_name)
+
+
+def read_csv_file(path, df_name):
+    dtypes = schema[df_name]
+    dates = [column for column, dtype in dtypes.items() if dtype.startswith('datetime64')]
+    return pd.read_csv(
+        path,
+        dtype = {column: dtype for column, dtype in dtypes.items() if column not in dates},
+        parse_dates = dates,
+        na_values = ['-'],
+    )
+
+
+def read_csv_tables(data_dir):
+    return {df_name: read_csv_table(data_dir, df_name) for df_name in df_names}
+
+
+def sort_by_geography(df):
+    # Stable, so rows keep their order within a geography. Categoricals sort
+    # by code, so when the codes are already in order (as the store keeps
+    # them) and there is no NA, which sorts last, there is nothing to do.
+    values = df['geography'].values
+    if isinstance(values, pd.Categorical):
+        codes = values.codes
+        if len(codes) == 0 or codes[0] >= 0 and (codes[1:] >= codes[:-1]).all():
+            return df
+    order = np.argsort(values, kind = 'mergesort')
+    if (order != np.arange(len(order))).any():
+        df = df.iloc[order]
+    return df
+
+
+def memory_report(df_dict):
+    # Deep memory use per table and column, in bytes
+    return {
+        df_name: df.memory_usage(index = False, deep = True).to_dict() for df_name, df in df_dict.items()
+    }
+
+
+# sha1 of files by (path, size, modification time), so a file is only read
+# again once it changed. si_store seeds it from its manifest at startup.
+file_hashes = {}
+
+
+def file_stat_key(path):
+    stat = os.stat(path)
+    return path, stat.st_size, stat.st_mtime_ns
+
+
+def file_hash(path):
+    key = file_stat_key(os.path.expanduser(path))
+    if key not in file_hashes:
+        with open(key[0], 'rb') as f:
+            file_hashes[key] = hashlib.sha1(f.read()).hexdigest()
+    return file_hashes[key]
+
+
+def file_version(paths):
+    # Short content hash of the source files, used to key derived caches
+    return hashlib.sha1(''.join(file_hash(path) for path in paths).encode('ascii')).hexdigest()[:12]
+
+
+def delta_paths(data_dir, df_name):
+    # Delta files of a table on disk, in the order they apply
+    pattern = os.path.join(glob.escape(os.path.expanduser(data_dir)), appends_dir, glob.escape(df_name) + '-*.csv')
+    return sorted(glob.glob(pattern))
+
+
+def appended_version(version, paths):
+    # Version of data with the delta files `paths` appended to it
+    if not paths:
+        return version
+    return hashlib.sha1((version + ''.join(file_hash(path) for path in paths)).encode('ascii')).hexdigest()[:12]
+
+
+def table_fingerprints(geo_index, df_name, geographies):
+    # Short content hash of every geography's rows of a table, to tell which
+    # geographies changed between two versions of the data
+    return {
+        geography: hashlib.sha1(
+            pd.util.hash_pandas_object(geo_index.select(df_name, geography), index = False).values.tobytes()
+        ).hexdigest()[:12]
+        for geography in geographies
+    }
+
+
+def geography_fingerprints(geo_index, geographies):
+    # The same over every table
+    tables = [geo_index.fingerprints(df_name, geographies) for df_name in df_names]
+    return {
+        geography: hashlib.sha1(''.join(table[geography] for table in tables).encode('ascii')).hexdigest()[:12]
+        for geography in geographies
+    }
+
+
+# Writing derived tables and caches: CSV fields quoted as the published
+# tables quote them, their number formats, and JSON caches replaced whole
+
+
+def quoted(value):
+    return '"{}"'.format(str(value).replace('"', '""'))
+
+
+def short_number(value, decimals = 3):
+    # Rounded and without trailing zeros, as the published Table 1
+    if value is None or np.isnan(value):
+        return None
+    text = '{:.{}f}'.format(value, decimals)
+    text = text.rstrip('0').rstrip('.') if '.' in text else text
+    return '0' if text == '-0' else text
+
+
+def fixed_number(value, decimals = 2):
+    # Two decimals, as the published Tables 3 and 4
+    if value is None or np.isnan(value):
+        return None
+    text = '{:.{}f}'.format(value, decimals)
+    return text[1:] if text.startswith('-') and float(text) == 0 else text
+
+
+def read_cache(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_atomic(path, data):
+    building = path + '.tmp'
+    with open(building, 'w', newline = '') as f:
+        f.write(data)
+    os.replace(building, path)
+
+
+class TableRegistry(Mapping):
+    # Read-only mapping of table name to frame that loads each table on first
+    # access, from the columnar store when it is current and from the CSV
+    # otherwise. Tables are held sorted by geography and, when `geographies`
+    # is given, restricted to those geographies.
+
+    def __init__(self, data_dir = default_data_dir, geographies = None):
+        self.data_dir = os.path.expanduser(data_dir)
+        self.geographies = list(geographies) if geographies else None
+        self.tables = {}
+        self.locks = {df_name: threading.Lock() for df_name in df_names}
+
+    def __getitem__(self, df_name):
+        try:
+            return self.tables[df_name]
+        except KeyError:
+            if df_name not in self.locks:
+                raise
+
+        # Only one thread loads a given table, the others wait for it
+        with self.locks[df_name]:
+            if df_name not in self.tables:
+                self.tables[df_name] = self.load(df_name)
+        return self.tables[df_name]
+
+    def __iter__(self):
+        return iter(df_names)
+
+    def __len__(self):
+        return len(df_names)
+
+    def load(self, df_name):
+        from si_store import load_store_table
+
+        df = load_store_table(self.data_dir, df_name)
+        if df is None:
+            df = read_csv_table(self.data_dir, df_name)
+        if self.geographies is not None:
+            df = df.loc[df['geography'].isin(self.geographies),:]
+        return sort_by_geography(df)
+
+    def loaded(self):
+        return [df_name for df_name in df_names if df_name in self.tables]
+
+
+class GeographyIndex:
+    # Each frame is stably sorted by geography and the contiguous row range
+    # of every geography is recorded the first time the frame is used, so a
+    # lookup is a dict hit plus a positional slice (a view) instead of a
+    # boolean mask over every row of the frame.
+
+    def __init__(self, df_dict):
+        self.df_dict = df_dict
+        self.frames = {}
+        self.ranges = {}
+        self.row_hashes = {}
+        self.lock = threading.Lock()
+
+    def add(self, df_name, df):
+        df = sort_by_geography(df)
+        values = df['geography'].values
+        starts = np.concatenate([[0], np.flatnonzero(values[1:] != values[:-1]) + 1])
+        stops = np.append(starts[1:], len(values))
+        self.frames[df_name] = df
+        self.ranges[df_name] = dict(zip(
+            values[starts].tolist(), zip(starts.tolist(), stops.tolist())
+        )) if len(values) else {}
+
+    def table_ranges(self, df_name):
+        if df_name not in self.ranges:
+            df = self.df_dict[df_name]
+            with self.lock:
+                if df_name not in self.ranges:
+                    self.add(df_name, df)
+        return self.ranges[df_name]
+
+    def select(self, df_name, geography):
+        # Unknown geographies get an empty frame with the same columns, which
+        # is what the boolean mask used to return
+        start, stop = self.table_ranges(df_name).get(geography, (0, 0))
+        return self.frames[df_name].iloc[start:stop]
+
+    def select_many(self, df_name, geographies):
+        # Rows of several geographies in one take, grouped in the order
+        # given, and the (start, stop) of every geography within them
+        ranges = self.table_ranges(df_name)
+        spans = np.array([ranges.get(geography, (0, 0)) for geography in geographies], dtype = np.intp).reshape(-1, 2)
+        lengths = spans[:,1] - spans[:,0]
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        positions = np.arange(offsets[-1]) + np.repeat(spans[:,0] - offsets[:-1], lengths)
+        bounds = dict(zip(geographies, zip(offsets[:-1].tolist(), offsets[1:].tolist())))
+        return self.frames[df_name].take(positions), bounds
+
+    def geographies(self, df_name):
+        return list(self.table_ranges(df_name))
+
+    def last_dates(self, df_name, geographies):
+        # Date of every geography's last row, NaT when it has none
+        ranges = self.table_ranges(df_name)
+        stops = np.array([ranges.get(geography, (0, 0))[1] for geography in geographies], dtype = np.intp)
+        starts = np.array([ranges.get(geography, (0, 0))[0] for geography in geographies], dtype = np.intp)
+        dates = self.frames[df_name]['date'].values
+        return np.where(stops > starts, dates[np.maximum(stops - 1, 0)], np.datetime64('NaT'))
+
+    def columns(self, df_name):
+        return list(self.df_dict[df_name].columns)
+
+    def fingerprints(self, df_name, geographies):
+        # Rows hash independently of their neighbours, so the table is hashed
+        # once and every geography's fingerprint taken from its slice of the
+        # row hashes, the same as table_fingerprints at a fraction of the cost
+        ranges = self.table_ranges(df_name)
+        if df_name not in self.row_hashes:
+            row_hashes = pd.util.hash_pandas_object(self.frames[df_name], index = False).values
+            with self.lock:
+                self.row_hashes.setdefault(df_name, row_hashes)
+        row_hashes = self.row_hashes[df_name]
+        return {
+            geography: hashlib.sha1(row_hashes[slice(*ranges.get(geography, (0, 0)))].tobytes()).hexdigest()[:12]
+            for geography in geographies
+        }
+
+    def load(self):
+        # Every table and its ranges
+        for df_name in df_names:
+            self.table_ranges(df_name)
+
+
+class AppendedIndex:
+    # A geography index, in memory or SQLite, with rows appended to some of
+    # its geographies. The appended rows are kept beside it, one frame per
+    # table with its own geography index, so an append copies the rows
+    # appended since the tables were loaded rather than the tables;
+    # selecting an appended geography joins its two parts.
+
+    def __init__(self, base, tails):
+        self.base = base
+        self.tails = GeographyIndex(tails)
+
+    def tail_ranges(self, df_name):
+        return self.tails.table_ranges(df_name) if df_name in self.tails.df_dict else {}
+
+    def select(self, df_name, geography):
+        df = self.base.select(df_name, geography)
+        if geography not in self.tail_ranges(df_name):
+            return df
+        return pd.concat([df, self.tails.select(df_name, geography)], ignore_index = True)
+
+    def select_many(self, df_name, geographies):
+        # Each geography's rows and then its appended ones, from one take
+        # over both
+        tail_ranges = self.tail_ranges(df_name)
+        df, bounds = self.base.select_many(df_name, geographies)
+        if not any(geography in tail_ranges for geography in geographies):
+            return df, bounds
+        tail, tail_bounds = self.tails.select_many(df_name, geographies)
+        spans = np.array([
+            [bounds[geography], (tail_bounds[geography][0] + len(df), tail_bounds[geography][1] + len(df))] for geography in geographies
+        ], dtype = np.intp).reshape(-1, 2)
+        lengths = spans[:,1] - spans[:,0]
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        positions = np.arange(offsets[-1]) + np.repeat(spans[:,0] - offsets[:-1], lengths)
+        bounds = dict(zip(geographies, zip(offsets[:-1:2].tolist(), offsets[2::2].tolist())))
+        return pd.concat([df, tail], ignore_index = True).take(positions).reset_index(drop = True), bounds
+
+    def last_dates(self, df_name, geographies):
+        base = self.base.last_dates(df_name, geographies)
+        if df_name not in self.tails.df_dict:
+            return base
+        tail = self.tails.last_dates(df_name, geographies)
+        return np.where(np.isnat(tail), base, tail)
+
+    def load(self):
+        # Every table and its index, and the index of the appended rows
+        self.base.load()
+        for df_name in self.tails.df_dict:
+            self.tail_ranges(df_name)
+
+    def fingerprints(self, df_name, geographies):
+        tail_ranges = self.tail_ranges(df_name)
+        fingerprints = self.base.fingerprints(df_name, [geography for geography in geographies if geography not in tail_ranges])
+        fingerprints.update(table_fingerprints(self, df_name, [geography for geography in geographies if geography in tail_ranges]))
+        return {geography: fingerprints[geography] for geography in geographies}
+
+    def __getattr__(self, name):
+        return getattr(self.base, name)
+
+
+class DataSnapshot:
+    # One version of the data: its tables, their geography index, the
+    # geographies it serves and a version token per geography. Snapshots are
+    # never modified once published; a reload builds a new one and swaps it
+    # in whole, so a request that started on a snapshot finishes on it.
+    #
+    # A geography's token is the data version it last changed in, so derived
+    # results keyed by it stay valid across reloads that didn't touch it.
+    #
+    # With the sqlite backend the tables, versions and fingerprints are those
+    # of the database at `db_path`, as of its ingest.
+    #
+    # The delta files on disk are appended to the tables, unless `append` is
+    # False; the versions then cover them too.
+
+    def __init__(self, data_dir = default_data_dir, geographies = None, versions = None, backend = 'memory', db_path = None, append = True):
+        self.data_dir = os.path.expanduser(data_dir)
+        self.served_geographies = list(geographies) if geographies else None
+        self.backend = backend
+        self.db_path = db_path
+        if backend == 'sqlite':
+            from si_sqlite import SqliteIndex, default_db_path
+
+            self.db_path = os.path.expanduser(db_path or default_db_path(self.data_dir))
+            self.df_dict = None
+            self.geo_index = SqliteIndex(self.db_path, self.served_geographies)
+            self.file_versions = self.geo_index.file_versions
+            self.data_version = self.geo_index.data_version
+        else:
+            from si_store import seed_file_hashes
+
+            seed_file_hashes(self.data_dir)
+            self.file_versions = {
+                df_name: file_version([os.path.join(self.data_dir, df_name + '.csv')]) for df_name in df_names
+            }
+            self.data_version = file_version([os.path.join(self.data_dir, df_name + '.csv') for df_name in df_names])
+            self.df_dict = TableRegistry(self.data_dir, geographies = self.served_geographies)
+            self.geo_index = GeographyIndex(self.df_dict)
+        self.geographies = self.geo_index.geographies('figure1')
+        self.geography_set = frozenset(self.geographies)
+        self.versions = versions or {}
+
+        self.base_index = self.geo_index
+        self.base_version = self.data_version
+        self.base_file_versions = dict(self.file_versions)
+        self.appended = {df_name: [] for df_name in appendable}
+        self.tails = {}
+        if append:
+            deltas = self.delta_paths()
+            if any(deltas.values()):
+                self.append(deltas)
+
+    def serves(self, geography):
+        # Whether a geography is one of the snapshot's, for values that come
+        # from clients and may not even be strings
+        return isinstance(geography, str) and geography in self.geography_set
+
+    def version(self, geography):
+        return self.versions.get(geography, self.data_version)
+
+    def base_paths(self):
+        # Files the tables are loaded from
+        if self.backend == 'sqlite':
+            return [self.db_path]
+        return [os.path.join(self.data_dir, df_name + '.csv') for df_name in df_names]
+
+    def delta_paths(self):
+        return {df_name: delta_paths(self.data_dir, df_name) for df_name in appendable}
+
+    def source_paths(self):
+        # Files whose change, or arrival, means new data
+        return self.base_paths() + [path for paths in self.delta_paths().values() for path in paths]
+
+    def base_changed(self):
+        # Whether the tables under the delta files changed on disk, without
+        # loading them
+        if self.backend == 'sqlite':
+            return os.path.realpath(self.db_path) != self.base_index.db_path
+        return file_version(self.base_paths()) != self.base_version
+
+    def added_deltas(self, deltas):
+        # The delta files of `deltas` ({table: paths on disk}) after those
+        # already appended, or None when one of those changed or is gone
+        for df_name in appendable:
+            applied = self.appended[df_name]
+            if deltas[df_name][:len(applied)] != applied:
+                return None
+            if appended_version(self.base_file_versions[df_name], applied) != self.file_versions[df_name]:
+                return None
+        return {df_name: deltas[df_name][len(self.appended[df_name]):] for df_name in appendable}
+
+    def delta_rows(self, geo_index, df_name, path):
+        # Rows of a delta file, grouped by geography in date order, once
+        # they check out against the rows of geo_index: the table's columns,
+        # only geographies the table has (rows of geographies this instance
+        # doesn't serve are dropped) and only dates after their last one.
+        # Raises ValueError otherwise.
+        try:
+            df = read_csv_file(path, df_name)
+        except ValueError as error:
+            raise ValueError('{}: {}'.format(path, error))
+        if list(df.columns) != list(schema[df_name]):
+            raise ValueError('{} must have the columns of {}: {}'.format(path, df_name, ', '.join(schema[df_name])))
+        if df['geography'].isna().any() or df['date'].isna().any():
+            raise ValueError('{} has rows without a geography or date'.format(path))
+        if self.served_geographies is not None:
+            df = df.loc[df['geography'].isin(self.served_geographies),:]
+        if not len(df):
+            return df
+        known = geo_index.geographies(df_name)
+        unknown = sorted(set(df['geography'].unique().tolist()) - set(known))
+        if unknown:
+            raise ValueError('{} has geographies {} has no rows for: {}'.format(path, df_name, ', '.join(unknown)))
+
+        # Appended rows share the table's categories, so joining them to it
+        # keeps the dtype
+        dtype = geo_index.select(df_name, known[0])['geography'].dtype
+        df = df.assign(geography = pd.Categorical(df['geography'].astype(object), dtype = dtype))
+        df = sort_by_geography(df.sort_values('date', kind = 'mergesort')).reset_index(drop = True)
+        codes, dates = df['geography'].values.codes, df['date'].values
+        same = codes[1:] == codes[:-1]
+        repeated = np.flatnonzero(same & (dates[1:] == dates[:-1]))
+        if len(repeated):
+            raise ValueError('{} has {} twice on {}'.format(path, df['geography'].iloc[repeated[0]], pd.Timestamp(dates[repeated[0]]).date()))
+        starts = np.concatenate([[0], np.flatnonzero(~same) + 1])
+        geographies = df['geography'].values[starts].tolist()
+        last = geo_index.last_dates(df_name, geographies)
+        early = np.flatnonzero(last >= dates[starts])
+        if len(early):
+            raise ValueError('{} has {} rows from {}, not after its last date, {}'.format(
+                path, geographies[early[0]], pd.Timestamp(dates[starts[early[0]]]).date(), pd.Timestamp(last[early[0]]).date()
+            ))
+        return df
+
+    def append(self, deltas):
+        # Appends the rows of delta files ({table: paths}), each validated
+        # against the rows before it, and gives the geographies they changed
+        # this data version. Only used before the snapshot is published:
+        # what it replaces is built anew, never modified, so a copy of a
+        # published snapshot can append. Raises ValueError on a bad file,
+        # leaving the snapshot as it was.
+        versions = {geography: self.version(geography) for geography in self.geographies}
+        tails = dict(self.tails)
+        geo_index = AppendedIndex(self.base_index, tails)
+        changed = set()
+        for df_name, paths in deltas.items():
+            for path in paths:
+                rows = self.delta_rows(geo_index, df_name, path)
+                if not len(rows):
+                    continue
+                tails[df_name] = rows if df_name not in tails else pd.concat([tails[df_name], rows], ignore_index = True)
+                geo_index = AppendedIndex(self.base_index, dict(tails))
+                changed.update(rows['geography'].unique().tolist())
+        for df_name in tails:
+            geo_index.tail_ranges(df_name)
+
+        self.appended = {df_name: self.appended[df_name] + list(deltas.get(df_name, [])) for df_name in appendable}
+        self.tails = tails
+        self.geo_index = geo_index
+        self.file_versions = {
+            df_name: appended_version(self.base_file_versions[df_name], self.appended.get(df_name, [])) for df_name in df_names
+        }
+        self.data_version = appended_version(self.base_version, [path for df_name in appendable for path in self.appended[df_name]])
+        versions.update({geography: self.data_version for geography in changed if geography in versions})
+        self.versions = versions
+        return changed
+
+    def load(self):
+        # Every table and its index, so nothing is read lazily after a swap
+        self.geo_index.load()
+
+    def validate(self):
+        # Raises ValueError when a table lacks columns or there's nothing to show
+        for df_name in df_names:
+            missing = [column for column in schema[df_name] if column not in self.geo_index.columns(df_name)]
+            if missing:
+                raise ValueError('{} is missing columns: {}'.format(df_name, ', '.join(missing)))
+        if not self.geographies:
+            raise ValueError('figure1 has no geographies')
+
+    def geography_fingerprints(self):
+        return geography_fingerprints(self.geo_index, self.geographies)
+
+    def changed_geographies(self, snapshot):
+        # Geographies whose rows differ in `snapshot`. Only tables whose file
+        # changed are compared; one this snapshot never loaded can't be, as
+        # its file is gone, so then every geography counts as changed.
+        changed = set()
+        for df_name in df_names:
+            if snapshot.file_versions[df_name] == self.file_versions[df_name]:
+                continue
+            if self.df_dict is not None and df_name not in self.df_dict.loaded():
+                return set(snapshot.geographies)
+            previous = self.geo_index.fingerprints(df_name, snapshot.geographies)
+            current = snapshot.geo_index.fingerprints(df_name, snapshot.geographies)
+            changed |= {geography for geography in snapshot.geographies if previous[geography] != current[geography]}
+        return changed | (set(snapshot.geographies) - set(self.geographies))
+
+    def successor(self):
+        # The snapshot of the data now on disk, carrying over the tokens of
+        # geographies whose rows are unchanged, or None if nothing changed.
+        # Raises if the new data can't be loaded or fails validation.
+        #
+        # When all that's new is delta files, they are appended to a copy of
+        # this snapshot, at the cost of reading them, instead of loading
+        # everything again.
+        if not self.base_changed():
+            added = self.added_deltas(self.delta_paths())
+            if added is not None:
+                if not any(added.values()):
+                    return None
+                snapshot = copy.copy(self)
+                snapshot.append(added)
+                return snapshot
+
+        snapshot = DataSnapshot(self.data_dir, self.served_geographies, backend = self.backend, db_path = self.db_path)
+        if snapshot.data_version == self.data_version:
+            return None
+        snapshot.load()
+        snapshot.validate()
+
+        changed = self.changed_geographies(snapshot)
+        snapshot.versions = {
+            geography: snapshot.data_version if geography in changed else self.version(geography)
+            for geography in snapshot.geographies
+        }
+        return snapshot
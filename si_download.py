@@ -0,0 +1,59 @@
+# Zip archives of the source CSVs, streamed as they are written instead of
+# going through a file on disk. Subsets keep the source lines of the chosen
+# geographies as they are, so values are exactly those of the source files.
+import io
+import os
+import csv
+import time
+import zipfile
+
+
+class ChunkWriter(io.RawIOBase):
+    # Unseekable sink for ZipFile that hands out what has been written so far
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def csv_rows(data_dir, df_name, delta_paths = ()):
+    # Header line and the source lines of every geography, in file order,
+    # followed by those of the table's delta files
+    header_line, rows = None, {}
+    for path in [os.path.join(os.path.expanduser(data_dir), df_name + '.csv')] + list(delta_paths):
+        with open(path, 'rb') as f:
+            lines = f.read().splitlines(keepends = True)
+        header_line = header_line or lines[0]
+        header = next(csv.reader([lines[0].decode('utf-8')]))
+        column = header.index('geography')
+        for line in lines[1:]:
+            if not line.endswith(b'\n'):
+                line += b'\n'
+            geography = next(csv.reader([line.decode('utf-8')]))[column]
+            rows.setdefault(geography, []).append(line)
+    return header_line, {geography: b''.join(geography_lines) for geography, geography_lines in rows.items()}
+
+
+def zip_stream(members, date_time = None):
+    # Yields the archive of (name, data) members chunk by chunk, one member
+    # at a time, so neither the archive nor every member is held at once
+    writer = ChunkWriter()
+    date_time = date_time or time.localtime()[:6]
+    with zipfile.ZipFile(writer, 'w', compression = zipfile.ZIP_DEFLATED) as zip_file:
+        for name, data in members:
+            info = zipfile.ZipInfo(name, date_time = date_time)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            zip_file.writestr(info, data)
+            yield writer.drain()
+    yield writer.drain()
@@ -0,0 +1,123 @@
+# Shape-preserving downsampling of time series for the zoomable graphs. A
+# series is kept as a pyramid of resolutions, each level holding the
+# minimum and maximum of every 8 points of the level below, a quarter of its
+# size. A request for a visible range takes the finest level with no more
+# than a few times the points the graph can show over that range, and
+# reduces its slice of it with Largest-Triangle-Three-Buckets (LTTB). The
+# work per request is then bounded by the points shown, not the length of
+# the series.
+import numpy as np
+
+# Points sent per line, about one per pixel of the widest graph
+max_points = 1000
+
+# Points of the level below summarised by each (min, max) pair of a level
+pyramid_factor = 8
+
+
+def min_max(y, bucket):
+    # Positions of the minimum and maximum of every `bucket` points, and of
+    # the first and last point, in order. NaN is neither, unless a bucket
+    # has nothing else, so gaps in a line survive.
+    n = len(y)
+    buckets = -(-n // bucket)
+    padded = np.full(buckets * bucket, np.nan)
+    padded[:n] = y
+    rows = padded.reshape(buckets, bucket)
+    offsets = np.arange(buckets) * bucket
+    lowest = np.where(np.isnan(rows), np.inf, rows).argmin(axis = 1) + offsets
+    highest = np.where(np.isnan(rows), -np.inf, rows).argmax(axis = 1) + offsets
+    return np.unique(np.concatenate([[0, n - 1], lowest, highest]))
+
+
+def lttb(x, y, points):
+    # Positions of `points` of (x, y) chosen by Largest-Triangle-Three-
+    # Buckets: the first and last, and from every bucket in between the
+    # point making the largest triangle with the point chosen before it and
+    # the mean of the next bucket
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype = 'float64')
+    y = np.asarray(y, dtype = 'float64')
+    edges = (np.arange(points - 1) * (n - 2) / (points - 2)).astype(np.intp) + 1
+    edges[-1] = n - 1
+    starts, stops = edges[:-1], edges[1:]
+
+    # Means of every bucket, and of the last point for the final bucket
+    filled = np.where(np.isnan(y), 0.0, y)
+    counts = np.maximum(np.add.reduceat((~np.isnan(y[:-1])).astype(np.intp), starts), 1)
+    mean_x = np.append(np.add.reduceat(x[:-1], starts) / (stops - starts), x[-1]).tolist()
+    mean_y = np.append(np.add.reduceat(filled[:-1], starts) / counts, y[-1]).tolist()
+
+    # Buckets hold a few points each, for which plain floats beat numpy
+    # calls several times over. A NaN area never wins, so a bucket of NaN
+    # keeps its first point and the gap.
+    xs, ys = x.tolist(), y.tolist()
+    chosen = [0]
+    previous = 0
+    for bucket, (start, stop) in enumerate(zip(starts.tolist(), stops.tolist())):
+        ax, ay = xs[previous], ys[previous]
+        cx, cy = mean_x[bucket + 1], mean_y[bucket + 1]
+        previous, largest = start, -1.0
+        for i in range(start, stop):
+            area = abs((ax - cx) * (ys[i] - ay) - (ax - xs[i]) * (cy - ay))
+            if area > largest:
+                previous, largest = i, area
+        chosen.append(previous)
+    chosen.append(n - 1)
+    return np.array(chosen, dtype = np.intp)
+
+
+class Pyramid:
+    # Levels of (x, y) for one series, x ascending numbers (dates as
+    # nanoseconds), finest first
+
+    def __init__(self, x, y):
+        x = np.asarray(x, dtype = 'int64')
+        y = np.asarray(y, dtype = 'float64')
+        self.levels = [(x, y)]
+        while len(x) > max_points:
+            positions = min_max(y, pyramid_factor)
+            x, y = x[positions], y[positions]
+            self.levels.append((x, y))
+
+    def window(self, start = None, stop = None, points = max_points):
+        # (x, y) over [start, stop], with a point either side so the line
+        # runs to the edges, reduced to at most `points`
+        for x, y in self.levels:
+            first = 0 if start is None else max(int(np.searchsorted(x, start, side = 'right')) - 1, 0)
+            last = len(x) if stop is None else min(int(np.searchsorted(x, stop, side = 'left')) + 1, len(x))
+            if last - first <= 4 * points:
+                break
+        x, y = x[first:last], y[first:last]
+        positions = lttb(x, y, points)
+        return x[positions], y[positions]
+
+
+def time_strings(x):
+    # Nanosecond times as the browser wants them: plain days when they all
+    # fall on midnight, to the second otherwise
+    times = np.asarray(x, dtype = 'int64').view('datetime64[ns]')
+    day = np.timedelta64(1, 'D').astype('timedelta64[ns]').astype('int64')
+    unit = 'D' if (np.asarray(x, dtype = 'int64') % day == 0).all() else 's'
+    return np.datetime_as_string(times, unit = unit)
+
+
+def range_bounds(relayout_data, axis = 'xaxis'):
+    # (start, stop) nanoseconds of the x range a plotly relayout event set,
+    # (None, None) for autorange, or None when the event didn't change it
+    if not relayout_data:
+        return None
+    if relayout_data.get(axis + '.autorange'):
+        return None, None
+    bounds = relayout_data.get(axis + '.range')
+    if bounds is None and axis + '.range[0]' in relayout_data:
+        bounds = [relayout_data[axis + '.range[0]'], relayout_data.get(axis + '.range[1]')]
+    if not bounds or len(bounds) != 2 or None in bounds:
+        return None
+    try:
+        start, stop = (np.datetime64(str(bound).replace(' ', 'T'), 'ns').astype('int64') for bound in bounds)
+    except ValueError:
+        return None
+    return (start, stop) if start <= stop else (stop, start)
@@ -0,0 +1,117 @@
+# Compact encodings of figure payloads and compression of callback responses.
+#
+# Payload modes (COVID_SI_PAYLOAD):
+#   full     figures as built, every value at full precision
+#   rounded  values rounded to display precision, evenly spaced x arrays
+#            (the hours of Figure 3, daily and weekly dates) sent as x0/dx
+#   typed    as rounded for x, with numeric y arrays sent as base64 typed
+#            arrays, which plotly.js decodes natively
+import gzip
+import base64
+
+import numpy as np
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+payload_modes = ['full', 'rounded', 'typed']
+day_ms = 24 * 60 * 60 * 1000
+
+
+def even_step(values):
+    # Common difference of an evenly spaced array, None otherwise
+    if len(values) < 2:
+        return None
+    steps = np.diff(values)
+    return steps[0] if (steps == steps[0]).all() else None
+
+
+def as_dates(values):
+    # Day resolution dates for arrays of 'YYYY-MM-DD' strings, None otherwise
+    if values.dtype.kind not in 'OU' or not all(isinstance(value, str) and len(value) == 10 for value in values):
+        return None
+    try:
+        return values.astype('datetime64[D]')
+    except ValueError:
+        return None
+
+
+def typed_array(values):
+    values = np.asarray(values)
+    dtype = 'f4' if values.dtype.kind == 'f' and values.dtype.itemsize <= 4 else 'f8'
+    if values.dtype.kind in 'iu' and len(values):
+        for int_dtype in ['i1', 'i2', 'i4']:
+            if np.iinfo(int_dtype).min <= values.min() and values.max() <= np.iinfo(int_dtype).max:
+                dtype = int_dtype
+                break
+    return {'dtype': dtype, 'bdata': base64.b64encode(values.astype('<' + dtype).tobytes()).decode('ascii')}
+
+
+def encode_trace(trace, mode, decimals):
+    trace = dict(trace.to_plotly_json() if hasattr(trace, 'to_plotly_json') else trace)
+    on_dates = False
+
+    if trace.get('x') is not None:
+        x = np.asarray(trace['x'])
+        dates = None if x.dtype.kind in 'iuf' else as_dates(x)
+        step = None
+        if dates is not None:
+            step = even_step(dates.astype('int64'))
+        elif x.dtype.kind in 'iuf':
+            step = even_step(x)
+        if step is not None:
+            del trace['x']
+            trace['x0'] = x[:1].tolist()[0]
+            trace['dx'] = step.item() * (day_ms if dates is not None else 1)
+        on_dates = dates is not None
+
+    if trace.get('y') is not None:
+        y = np.asarray(trace['y'])
+        if y.dtype.kind in 'iuf' and mode == 'typed':
+            # Single precision is well beyond display precision
+            trace['y'] = typed_array(y.astype('float32') if y.dtype.kind == 'f' else y)
+        elif y.dtype.kind == 'f' and decimals is not None:
+            trace['y'] = y.astype('float64').round(decimals)
+
+    return trace, on_dates
+
+
+def encode_figure(figure, mode, decimals = None):
+    if mode == 'full':
+        return figure
+
+    data = []
+    on_dates = False
+    for trace in figure['data']:
+        trace, trace_on_dates = encode_trace(trace, mode, decimals)
+        data.append(trace)
+        on_dates = on_dates or trace_on_dates
+
+    layout = figure['layout']
+    layout = dict(layout.to_plotly_json() if hasattr(layout, 'to_plotly_json') else layout)
+    if on_dates:
+        # Without x arrays plotly.js can't infer that the axis holds dates
+        layout['xaxis'] = dict(layout.get('xaxis', {}), type = 'date')
+    return {'data': data, 'layout': layout}
+
+
+def compress_response(response, accept_encoding, minimum_size = 1024):
+    # Brotli when available and accepted, else gzip, for responses worth it
+    if response.status_code != 200 or response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    body = response.get_data()
+    if len(body) < minimum_size:
+        return response
+
+    if brotli is not None and 'br' in accept_encoding:
+        response.set_data(brotli.compress(body, quality = 5))
+        response.headers['Content-Encoding'] = 'br'
+    elif 'gzip' in accept_encoding:
+        response.set_data(gzip.compress(body, compresslevel = 6))
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        return response
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
@@ -0,0 +1,174 @@
+# Static export of the app for read-only hosting: the page shell and its
+# scripts, the assets, the data download, and every geography's outputs as
+# JSON, rendered in clientside mode so any static file server can serve it
+# without running Python per request. Re-exporting only re-renders the
+# geographies whose rows changed since the last export; the others are
+# copied over.
+#
+#   python si_export.py <bundle dir> [--data-dir data] [--prefix /] [--force]
+import os
+import re
+import json
+import shutil
+import argparse
+from urllib.parse import unquote
+
+from si_data import default_data_dir, file_version
+
+manifest_name = 'export.json'
+
+# The Dash renderer wants its layout and callback graph served as JSON,
+# which static servers only do for .json files
+fetch_shim = """<script>
+(function() {
+    var fetch = window.fetch;
+    window.fetch = function(url, options) {
+        if (typeof url === 'string' && /_dash-(layout|dependencies)$/.test(url)) {
+            url += '.json';
+        }
+        return fetch.call(this, url, options);
+    };
+})();
+</script>
+"""
+
+
+def write_file(path, data):
+    # Written aside and renamed into place, so a server never sees half a file
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+
+def read_manifest(bundle_dir):
+    try:
+        with open(os.path.join(bundle_dir, manifest_name)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def bundle_path(bundle_dir, prefix, url):
+    # File in the bundle a URL of the page is served from
+    path = unquote(url.split('?')[0])[len(prefix):]
+    return os.path.join(bundle_dir, *path.split('/'))
+
+
+def fingerprinted(path, fingerprint):
+    # Name webpack requests a lazily loaded chunk by, e.g. async-graph.v2_14_3m1730752227.js
+    directory, name = os.path.split(path)
+    stem, extension = name.split('.', 1)
+    return os.path.join(directory, '{}.{}.{}'.format(stem, fingerprint, extension))
+
+
+def export_shell(app, client, bundle_dir, prefix):
+
+    # Page, with the fetch shim ahead of the renderer
+    index = client.get(prefix).get_data(as_text = True)
+    write_file(os.path.join(bundle_dir, 'index.html'), index.replace('</head>', fetch_shim + '</head>', 1).encode('utf-8'))
+    for name in ['_dash-layout', '_dash-dependencies']:
+        write_file(os.path.join(bundle_dir, name + '.json'), client.get(prefix + name).data)
+
+    # The full archive behind the download link
+    write_file(bundle_path(bundle_dir, prefix, prefix + 'download_csv'), client.get('/download_csv').data)
+
+    # Everything the page links to locally: scripts, stylesheets, the favicon
+    urls = [url for url in re.findall(r'(?:src|href)="([^"]+)"', index) if url.startswith(prefix)]
+    scripts = {}
+    for url in urls:
+        data = client.get(url).data
+        write_file(bundle_path(bundle_dir, prefix, url), data)
+        scripts[url] = data
+
+    # Component bundles load their chunks lazily, from the same directory and
+    # under the fingerprint the bundle was built with
+    fingerprints = {}
+    for url, data in scripts.items():
+        for fingerprint in re.findall(rb'splice\(1,0,"(v[0-9a-z_]+m[0-9]+)"\)', data):
+            fingerprints.setdefault(os.path.dirname(url), set()).add(fingerprint.decode('ascii'))
+    for namespace, paths in app.registered_paths.items():
+        for path in paths:
+            if path.endswith('.map'):
+                continue
+            url = '{}_dash-component-suites/{}/{}'.format(prefix, namespace, path)
+            data = client.get(url).data
+            write_file(bundle_path(bundle_dir, prefix, url), data)
+            for fingerprint in fingerprints.get(os.path.dirname(url), []):
+                write_file(fingerprinted(bundle_path(bundle_dir, prefix, url), fingerprint), data)
+
+
+def export_geographies(si_app, bundle_dir, previous, force = False):
+
+    # Outputs depend on the rows, the section code (with the line
+    # downsampling), the payload encoding and the app code assembling them
+    render_version = '{}-{}'.format(
+        file_version([
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), name) for name in ['si_sections.py', 'si_downsample.py', 'si_encode.py', 'si_app.py']
+        ]),
+        si_app.payload_mode,
+    )
+    snapshot = si_app.reloader.snapshot
+    fingerprints = snapshot.geography_fingerprints()
+    reusable = not force and previous.get('render_version') == render_version
+    previous_dir = os.path.join(bundle_dir, 'geography-data', previous.get('data_version', ''))
+    data_dir = os.path.join(bundle_dir, 'geography-data', snapshot.data_version)
+
+    os.makedirs(data_dir, exist_ok = True)
+    rendered = []
+    for geography in snapshot.geographies:
+        path = os.path.join(data_dir, geography + '.json')
+        previous_path = os.path.join(previous_dir, geography + '.json')
+        if reusable and previous.get('fingerprints', {}).get(geography) == fingerprints[geography] and os.path.exists(previous_path):
+            if previous_path != path:
+                shutil.copyfile(previous_path, path + '.tmp')
+                os.replace(path + '.tmp', path)
+        else:
+            write_file(path, si_app.geography_data(geography, snapshot))
+            rendered.append(geography)
+
+    return {'data_version': snapshot.data_version, 'render_version': render_version, 'fingerprints': fingerprints}, rendered
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('bundle_dir')
+    parser.add_argument('--data-dir', default = os.environ.get('COVID_SI_DATA_DIR', default_data_dir))
+    parser.add_argument('--prefix', default = '/', help = 'URL path the bundle will be served under')
+    parser.add_argument('--force', action = 'store_true', help = 're-render every geography')
+    args = parser.parse_args()
+
+    prefix = '/' + args.prefix.strip('/') + '/' if args.prefix.strip('/') else '/'
+    os.environ.update({
+        'COVID_SI_DATA_DIR': args.data_dir,
+        'COVID_SI_CALLBACK_MODE': 'clientside',
+        'COVID_SI_COMPARE': '0',
+        'COVID_SI_ZOOM': '0',
+        'COVID_SI_CACHE_WARM': '0',
+        'COVID_SI_RELOAD_INTERVAL': '0',
+        'COVID_SI_ADMIN_TOKEN': '',
+        'DASH_REQUESTS_PATHNAME_PREFIX': prefix,
+    })
+    import si_app
+
+    bundle_dir = os.path.abspath(args.bundle_dir)
+    previous = read_manifest(bundle_dir)
+    client = si_app.server.test_client()
+
+    # Geography data first and the page that points at it last, then drop
+    # all but the previous data version, which pages already open still use
+    manifest, rendered = export_geographies(si_app, bundle_dir, previous, force = args.force)
+    export_shell(si_app.app, client, bundle_dir, prefix)
+    write_file(os.path.join(bundle_dir, manifest_name), json.dumps(manifest, indent = 2).encode('utf-8'))
+
+    keep = {manifest['data_version'], previous.get('data_version')}
+    for version in os.listdir(os.path.join(bundle_dir, 'geography-data')):
+        if version not in keep:
+            shutil.rmtree(os.path.join(bundle_dir, 'geography-data', version))
+
+    exported = len(manifest['fingerprints'])
+    print('Exported {} geographies to {}: {} rendered, {} unchanged'.format(exported, bundle_dir, len(rendered), exported - len(rendered)))
+
+
+if __name__ == '__main__':
+    main()
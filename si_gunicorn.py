@@ -0,0 +1,18 @@
+# gunicorn settings for the production entry point:
+#
+#   gunicorn -c si_gunicorn.py
+#
+# The app and its data load once in the master (preload_app) and the workers
+# fork from it. COVID_SI_WORKERS (default: one per core), COVID_SI_THREADS
+# (default 4) and COVID_SI_BIND (default 0.0.0.0:8080) size and place it;
+# the other COVID_SI_* settings of si_app apply as usual. The response cache
+# and the reload poller are per worker; POST /admin/reload reaches one
+# worker, which touches COVID_SI_RELOAD_TRIGGER for the others' pollers.
+# Per-worker memory is measured by benchmarks/worker_memory.py.
+import os
+
+wsgi_app = 'si_wsgi:create_app()'
+bind = os.environ.get('COVID_SI_BIND', '0.0.0.0:8080')
+workers = int(os.environ.get('COVID_SI_WORKERS', os.cpu_count() or 1))
+threads = int(os.environ.get('COVID_SI_THREADS', 4))
+preload_app = True
@@ -0,0 +1,352 @@
+# Load-shape engine for Figure 3 and Table 5: quantiles of the load at every
+# hour of workdays and weekends, and the peak and base load of workdays, in
+# the month of the analysis in the historic years and in the current year,
+# computed from raw hourly load.
+#
+# Raw load is read from data/load/*.csv, rows of (geography, time, load) with
+# the time in the geography's local time and the load in MW, in files
+# grouped any way (e.g. one per geography and year). Files are streamed in
+# chunks, and each is reduced to a sketch of every (geography, period, day
+# type, hour) cell: counts of the load in logarithmic buckets, which give any
+# quantile within `relative_accuracy` and merge by adding counts, and the
+# exact sum for the mean. Sketches are cached per file by its content and
+# the periods, so new data (e.g. a file of the latest days) is folded into
+# the baselines by scanning it alone, and files are scanned in parallel.
+#
+# Workdays are Monday to Friday; holidays aren't known. Peak and base are the
+# highest and lowest hour of the mean workday profile.
+#
+#   python si_load.py --out-dir <dir> [--data-dir data] [--load-dir data/load] [--month 4] [--historic 2016 2019] [--actual 2020] [--workers 4]
+import os
+import sys
+import glob
+import json
+import hashlib
+import argparse
+import calendar
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from si_data import default_data_dir, read_csv_table, file_hashes, file_stat_key, file_hash, quoted, write_atomic, short_number
+
+# Changes whenever the sketch does, so cached sketches of another version
+# are never reused
+engine_version = 1
+
+# Quantiles are within this fraction of the exact ones
+relative_accuracy = 0.001
+gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+
+# Rows parsed at a time
+chunk_rows = 1 << 20
+
+# A sketch key is cell * bin_span + bucket + bin_offset; every positive
+# float64 has its bucket within +-bin_offset
+bin_span = 1 << 20
+bin_offset = 1 << 19
+
+# Cells of a geography: period (historic, actual) x day type (workday,
+# weekend) x hour
+hours = 24
+cells_per_geography = 2 * 2 * hours
+historic, actual = 0, 1
+day_types = ['workday', 'weekend']
+
+quantiles = {'load_Q10': 0.1, 'load_median': 0.5, 'load_Q90': 0.9}
+
+# (day type, hour, period) of the rows of a geography in Figure 3, as
+# published: workday hours with both periods, then historic weekend hours
+figure3_rows = [('workday', hour, period) for hour in range(hours) for period in (actual, historic)] + [
+    ('weekend', hour, historic) for hour in range(hours)
+]
+figure3_header = ['hour', 'period', 'load_Q10', 'load_median', 'load_Q90', 'day_type', 'cluster', 'cluster_name', 'geography', 'Day.type']
+table5_header = ['geography', 'type_desc', 'historic', 'actual']
+
+manifest_name = 'files.json'
+
+
+def default_load_dir(data_dir):
+    return os.path.join(os.path.expanduser(data_dir), 'load')
+
+
+def default_cache_dir(data_dir):
+    return os.path.join(os.path.expanduser(data_dir), 'store', 'load')
+
+
+def load_paths(load_dir):
+    return sorted(glob.glob(os.path.join(glob.escape(os.path.expanduser(load_dir)), '*.csv')))
+
+
+def period_labels(month, first, last, year):
+    # (period, Day.type suffix) of the historic and actual periods, as
+    # 'Historic (April 2016-2019)' and 'Apr-20' / 'April 2020'
+    name = calendar.month_name[month]
+    label = 'Historic ({} {}-{})'.format(name, first, last)
+    return {
+        historic: (label, label),
+        actual: ('{}-{:02d}'.format(calendar.month_abbr[month], year % 100), '{} {}'.format(name, year)),
+    }
+
+
+def buckets(load):
+    return np.ceil(np.log(load) / np.log(gamma)).astype('int64')
+
+
+def bucket_values(bucket):
+    # The value a bucket stands for, within relative_accuracy of all of it
+    return 2 * gamma ** bucket.astype('float64') / (gamma + 1)
+
+
+def reduced(keys, weights):
+    # Sorted unique keys of the concatenated parts and the sum of their weights
+    keys, weights = np.concatenate(keys), np.concatenate(weights)
+    unique, inverse = np.unique(keys, return_inverse = True)
+    return unique, np.bincount(inverse.ravel(), weights = weights, minlength = len(unique))
+
+
+def chunks(path):
+    # (geography, time, load) of a raw load file, a chunk at a time. Raises
+    # ValueError for rows it can't read.
+    reader = None
+    while True:
+        try:
+            if reader is None:
+                reader = pd.read_csv(path, usecols = ['geography', 'time', 'load'], dtype = {'geography': str, 'load': 'float64'}, chunksize = chunk_rows)
+            chunk = next(reader, None)
+            if chunk is None:
+                return
+            time = pd.to_datetime(chunk['time'])
+        except (ValueError, pd.errors.ParserError) as error:
+            raise ValueError('{}: {}'.format(path, error))
+        if chunk['geography'].isna().any() or time.isna().any():
+            raise ValueError('{} has rows without a geography or time'.format(path))
+        yield chunk['geography'].to_numpy(), time, chunk['load'].to_numpy()
+
+
+def scan(path, month, first, last, year):
+    # Sketch of one raw load file: its geographies, the sketch keys and
+    # counts, and the sum of the load of every cell. Missing loads are
+    # skipped.
+    codes = {}
+    keys, counts, cells, sums = [], [], [], []
+    for geography, time, load in chunks(path):
+        # Calendar fields straight from the nanoseconds, which the .dt
+        # accessors take several times as long for
+        time = time.to_numpy(dtype = 'datetime64[ns]')
+        months = time.astype('datetime64[M]').astype('int64')
+        years = months // 12 + 1970
+        period = np.where(years == year, actual, np.where((years >= first) & (years <= last), historic, -1))
+        keep = (months % 12 + 1 == month) & (period >= 0) & (load > 0) & np.isfinite(load)
+        if not keep.any():
+            continue
+        geography_codes, geographies = pd.factorize(geography[keep])
+        mapping = np.array([codes.setdefault(name, len(codes)) for name in geographies], dtype = 'int64')
+        hour_count = time[keep].astype('datetime64[h]').astype('int64')
+        # 1970-01-01 was a Thursday, day 3 of a week starting on Monday
+        weekend = (hour_count // hours + 3) % 7 >= 5
+        cell = ((mapping[geography_codes] * 2 + period[keep]) * 2 + weekend) * hours + hour_count % hours
+
+        # Reduced chunk by chunk, so a file takes the memory of its cells,
+        # not of its rows
+        load = load[keep]
+        chunk_keys, chunk_counts = reduced([cell * bin_span + buckets(load) + bin_offset], [np.ones(len(load))])
+        keys.append(chunk_keys)
+        counts.append(chunk_counts)
+        chunk_cells, chunk_sums = reduced([cell], [load])
+        cells.append(chunk_cells)
+        sums.append(chunk_sums)
+
+    if not codes:
+        keys = counts = cells = sums = [np.zeros(0, dtype = 'int64')]
+    keys, counts = reduced(keys, counts)
+    cells, sums = reduced(cells, sums)
+    return {
+        'geographies': np.array(list(codes), dtype = str), 'keys': keys, 'counts': counts.astype('int64'),
+        'cells': cells, 'sums': sums,
+    }
+
+
+def sketch_key(path, month, first, last, year):
+    return hashlib.sha1('{}:{}:{}:{}:{}:{}:{}'.format(
+        engine_version, relative_accuracy, month, first, last, year, file_hash(path)
+    ).encode('ascii')).hexdigest()[:16]
+
+
+def scan_to(path, periods, sketch_path):
+    # scan() written to sketch_path, for a pool worker
+    sketch = scan(path, *periods)
+    building = sketch_path + '.tmp.npz'
+    np.savez(building, **sketch)
+    os.replace(building, sketch_path)
+
+
+def merged(sketches):
+    # One sketch of several files' sketches, its geographies sorted
+    geographies = sorted({geography for sketch in sketches for geography in sketch['geographies'].tolist()})
+    codes = {geography: code for code, geography in enumerate(geographies)}
+    keys, counts, cells, sums = [], [], [], []
+    for sketch in sketches:
+        mapping = np.array([codes[geography] for geography in sketch['geographies'].tolist()] or [0], dtype = 'int64')
+
+        def remapped(cell):
+            return mapping[cell // cells_per_geography] * cells_per_geography + cell % cells_per_geography
+
+        keys.append(remapped(sketch['keys'] // bin_span) * bin_span + sketch['keys'] % bin_span)
+        counts.append(sketch['counts'])
+        cells.append(remapped(sketch['cells']))
+        sums.append(sketch['sums'])
+    keys, counts = reduced(keys, counts) if sketches else (np.zeros(0, dtype = 'int64'), np.zeros(0))
+    cells, sums = reduced(cells, sums) if sketches else (np.zeros(0, dtype = 'int64'), np.zeros(0))
+    return geographies, keys, counts.astype('int64'), cells, sums
+
+
+def profiles(geographies, keys, counts, cells, sums):
+    # (cell, quantile) and (cell,) arrays over every cell of every
+    # geography, NaN where a cell has no load: the quantiles of the load
+    # and its mean
+    size = len(geographies) * cells_per_geography
+    cell = keys // bin_span
+    values = np.full((size, len(quantiles)), np.nan)
+    if len(keys):
+        starts = np.flatnonzero(np.concatenate([[True], cell[1:] != cell[:-1]]))
+        totals = np.add.reduceat(counts, starts)
+        cumulative = np.cumsum(counts)
+        before = cumulative[starts] - counts[starts]
+        for q, quantile in enumerate(quantiles.values()):
+            # Interpolated between the loads at the ranks either side of
+            # quantile * (n - 1), as pandas' quantile does; each is the first
+            # bucket whose cumulative count passes the rank
+            rank = quantile * (totals - 1)
+            below, above = (
+                bucket_values(keys[np.searchsorted(cumulative, before + bound, side = 'right')] % bin_span - bin_offset)
+                for bound in (np.floor(rank), np.ceil(rank))
+            )
+            values[cell[starts], q] = below + (rank - np.floor(rank)) * (above - below)
+    mean = np.full(size, np.nan)
+    if len(cells):
+        mean[cells] = sums / np.bincount(cell, weights = counts, minlength = size)[cells]
+    return values, mean
+
+
+def sketches(paths, periods, cache_dir, workers = None):
+    # Sketch of every file, scanning only those not in cache_dir, in
+    # parallel, and the number scanned. File hashes are trusted by size and
+    # modification time through a manifest, so unchanged files aren't read.
+    os.makedirs(cache_dir, exist_ok = True)
+    manifest_path = os.path.join(cache_dir, manifest_name)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    for path in paths:
+        key = file_stat_key(path)
+        if manifest.get(path, [None])[:2] == list(key[1:]):
+            file_hashes.setdefault(key, manifest[path][2])
+
+    sketch_paths = {path: os.path.join(cache_dir, sketch_key(path, *periods) + '.npz') for path in paths}
+    missing = [path for path in paths if not os.path.exists(sketch_paths[path])]
+    workers = min(workers or os.cpu_count() or 1, len(missing))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            list(pool.map(scan_to, missing, [periods] * len(missing), [sketch_paths[path] for path in missing]))
+    else:
+        for path in missing:
+            scan_to(path, periods, sketch_paths[path])
+
+    loaded = []
+    for path in paths:
+        with np.load(sketch_paths[path]) as sketch:
+            loaded.append({name: sketch[name] for name in sketch.files})
+
+    # Sketches of files no longer there, or changed, are dropped
+    used = set(sketch_paths.values())
+    for path in glob.glob(os.path.join(glob.escape(cache_dir), '*.npz')):
+        if path not in used:
+            os.remove(path)
+    write_atomic(manifest_path, json.dumps({path: list(file_stat_key(path)[1:]) + [file_hash(path)] for path in paths}))
+    return loaded, len(missing)
+
+
+def clusters(data_dir):
+    # {geography: (cluster, cluster_name)} of the Figure 3 in data_dir, which
+    # raw load doesn't have
+    try:
+        df = read_csv_table(data_dir, 'figure3')
+    except OSError:
+        return {}
+    df = df.drop_duplicates('geography')
+    return dict(zip(df['geography'].astype(str), zip(df['cluster'].tolist(), df['cluster_name'].astype(str))))
+
+
+def regenerate(data_dir, out_dir, load_dir = None, periods = (4, 2016, 2019, 2020), workers = None, cache_dir = None):
+    # Writes Figure 3 and Table 5 of the raw load in load_dir to out_dir, and
+    # returns the number of geographies and of files scanned. Raises
+    # ValueError when there is no load of the periods, rather than writing
+    # empty tables over the published ones.
+    load_dir = load_dir or default_load_dir(data_dir)
+    paths = [os.path.abspath(path) for path in load_paths(load_dir)]
+    if not paths:
+        raise ValueError('{} has no load files (*.csv)'.format(load_dir))
+    loaded, scanned = sketches(paths, periods, cache_dir or default_cache_dir(data_dir), workers)
+    geographies, keys, counts, cells, sums = merged(loaded)
+    if not geographies:
+        raise ValueError('{} has no load in {} of {}-{} or {}'.format(load_dir, calendar.month_name[periods[0]], *periods[1:]))
+    values, mean = profiles(geographies, keys, counts, cells, sums)
+    values = values.reshape(len(geographies), 2, 2, hours, len(quantiles))
+    mean = mean.reshape(len(geographies), 2, 2, hours)
+    labels = period_labels(*periods)
+    cluster_of = clusters(data_dir)
+
+    figure3 = [','.join(quoted(column) for column in figure3_header)]
+    table5 = [','.join(quoted(column) for column in table5_header)]
+    for g, geography in enumerate(geographies):
+        cluster, cluster_name = cluster_of.get(geography, (-1, 'Unclustered'))
+        for day_type, hour, period in figure3_rows:
+            quantile_values = values[g, period, day_types.index(day_type), hour]
+            if np.isnan(quantile_values).all():
+                continue
+            figure3.append(','.join(
+                [str(hour), quoted(labels[period][0])] + [short_number(value) for value in quantile_values] +
+                [quoted(day_type), str(cluster), quoted(cluster_name), quoted(geography), quoted('{} - {}'.format(day_type, labels[period][1]))]
+            ))
+
+        workday = mean[g, :, day_types.index('workday')]
+        if np.isnan(workday).all(axis = 1).any():
+            continue
+        peak, base = np.nanargmax(workday, axis = 1), np.nanargmin(workday, axis = 1)
+        for type_desc, numbers in [
+            ('Peak (MW)', workday[[historic, actual], peak[[historic, actual]]]),
+            ('Base (MW)', workday[[historic, actual], base[[historic, actual]]]),
+            ('Peak hour', peak[[historic, actual]]),
+            ('Base hour', base[[historic, actual]]),
+        ]:
+            table5.append(','.join([quoted(geography), quoted(type_desc)] + [quoted(int(round(number))) for number in numbers]))
+
+    os.makedirs(out_dir, exist_ok = True)
+    write_atomic(os.path.join(out_dir, 'figure3.csv'), '\n'.join(figure3) + '\n')
+    write_atomic(os.path.join(out_dir, 'table5.csv'), '\n'.join(table5) + '\n')
+    return len(geographies), scanned
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Compute Figure 3 and Table 5 from raw hourly load')
+    parser.add_argument('--data-dir', default = os.environ.get('COVID_SI_DATA_DIR', default_data_dir))
+    parser.add_argument('--out-dir', required = True, help = 'where the tables are written; data-dir replaces the published ones')
+    parser.add_argument('--load-dir', help = 'raw hourly load files, data-dir/load by default')
+    parser.add_argument('--month', type = int, default = 4)
+    parser.add_argument('--historic', type = int, nargs = 2, default = [2016, 2019], metavar = ('FIRST', 'LAST'))
+    parser.add_argument('--actual', type = int, default = 2020)
+    parser.add_argument('--workers', type = int, help = 'processes scanning files, one per core by default')
+    parser.add_argument('--cache-dir', help = 'sketches by file, data-dir/store/load by default')
+    args = parser.parse_args()
+
+    periods = (args.month, args.historic[0], args.historic[1], args.actual)
+    geographies, scanned = regenerate(args.data_dir, os.path.expanduser(args.out_dir), args.load_dir, periods, args.workers, args.cache_dir)
+    print('{} geographies, {} files scanned, tables written to {}'.format(geographies, scanned, args.out_dir))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,435 @@
+# Piecewise-linear fitting engine for Figure 2 and Table 2: the MARS fit of
+# the daily electricity reduction (mars_elec), its breakpoints and the
+# slopes between them, from the reduction series and the CI levels, so they
+# can be regenerated after the series change without the upstream analysis.
+#
+# Every CI period of a geography (a run of days at one level, as in Table
+# 2) gets its own fit in days since its start, so breakpoints fall on CI
+# changes as well as where the fit bends. Fits are MARS models of degree 1
+# with the defaults of the R earth package: a forward pass adding the pair
+# of hinges at the knot that lowers the residual sum of squares most, until
+# 21 terms or an R2 gain under 0.001, then a backward pass dropping terms
+# and keeping the subset with the lowest GCV. The forward pass scores every
+# candidate knot of every model at once: the hinge columns are
+# orthogonalized against each model's basis in a few batched products, and
+# the reduction of each pair read off in closed form. Models are fit in
+# blocks of similar length, spread over processes. Results are cached per
+# geography by a hash of its input rows, so only geographies whose series
+# or CI levels changed are fit again.
+#
+# The daily reduction series is an input from the upstream analysis:
+# figure2.csv's percent_red, which the fit writes back unchanged. Delta
+# files add days to the CI levels but not to it, so figure2.csv has to be
+# refreshed with the new days before a run; a run over CI days appended
+# past a geography's series raises ValueError rather than leaving them out.
+#
+#   python si_mars.py --out-dir <dir> [--data-dir data] [--workers 4] [--cache data/store/mars.json] [--no-cache]
+import os
+import sys
+import json
+import math
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from si_data import default_data_dir, DataSnapshot, quoted, read_cache, write_atomic, short_number, fixed_number
+
+# Changes whenever the fit or the output format does, so cached results of
+# another version are never reused
+engine_version = 1
+
+# earth's defaults for one predictor: at most 21 terms, a GCV penalty of 2
+# per knot, forward pass threshold of 0.001, and knot spans for alpha 0.05
+max_terms = 21
+penalty = 2.0
+threshold = 0.001
+span_alpha = 0.05
+
+# Models fit together in one set of arrays
+block_models = 256
+
+figure2_header = ['geography', 'date', 'percent_red', 'mars_elec', 'breakpoint', 'SIP_change', 'breakpoint_and_SIP_chg']
+table2_header = ['geography', 'Term', 'Break Point', 'Date', 'Slope After', 'Slope Before', 'Day since start of period']
+
+# Inputs of a geography's fit; figure2's percent_red is refreshed upstream
+model_inputs = {'figure2': ['date', 'percent_red'], 'figure12_sip': ['date', 'SIP']}
+
+
+def spans(observations):
+    # earth's endspan (days kept clear of knots at either end) and minspan
+    # (days between knots) for models with `observations` each
+    endspan = int(3 - math.log2(span_alpha))
+    minspan = (-np.log2(-np.log(1 - span_alpha) / np.maximum(observations, 1)) / 2.5).astype('int64')
+    return endspan, np.maximum(minspan, 1)
+
+
+def forward(y, valid, lengths):
+    # Forward pass over a block of models: y and valid are (model, day),
+    # lengths the days of each model. Returns the basis (model, day, term),
+    # unmasked, which terms are in it, and their knots and sides (+1 for
+    # max(0, day - knot), -1 for max(0, knot - day)).
+    models, days = y.shape
+    day = np.arange(days, dtype = 'float64')
+    right = np.maximum(day[:,None] - day[None,:], 0.0)
+    left = np.maximum(day[None,:] - day[:,None], 0.0)
+    right_masked = right[None] * valid[:,:,None]
+    left_masked = left[None] * valid[:,:,None]
+    right_norms = (right_masked * right_masked).sum(axis = 1)
+    left_norms = (left_masked * left_masked).sum(axis = 1)
+
+    counts = valid.sum(axis = 1)
+    y = np.where(valid, y, 0.0)
+    Q = np.zeros((models, days, max_terms))
+    Q[:,:,0] = valid / np.sqrt(np.maximum(counts, 1))[:,None]
+    residuals = y - Q[:,:,0] * (Q[:,:,0] * y).sum(axis = 1)[:,None]
+    tss = (residuals * residuals).sum(axis = 1)
+    rss = tss.copy()
+
+    basis = np.zeros((models, days, max_terms))
+    basis[:,:,0] = 1.0
+    present = np.zeros((models, max_terms), dtype = bool)
+    present[:,0] = counts > 0
+    knots = np.zeros((models, max_terms), dtype = 'int64')
+    sides = np.zeros((models, max_terms), dtype = 'int64')
+
+    endspan, minspan = spans(counts)
+    eligible = valid & (day[None,:] >= endspan) & (day[None,:] <= lengths[:,None] - 1 - endspan)
+    running = (counts >= 3) & (tss > 0)
+    rows = np.arange(models)
+    for term in range(1, max_terms - 1, 2):
+        if not running.any():
+            break
+        # Both hinges of every candidate knot less their projection on the
+        # basis, and the reduction in RSS of adding the pair
+        basis_q = Q[:,:,:term]
+        right_rest = right_masked - basis_q @ (basis_q.transpose(0, 2, 1) @ right_masked)
+        left_rest = left_masked - basis_q @ (basis_q.transpose(0, 2, 1) @ left_masked)
+        a = (right_rest * right_rest).sum(axis = 1)
+        b = (left_rest * left_rest).sum(axis = 1)
+        c = (right_rest * left_rest).sum(axis = 1)
+        ra = (residuals[:,None,:] @ right_rest)[:,0]
+        rb = (residuals[:,None,:] @ left_rest)[:,0]
+        has_right = a > 1e-9 * right_norms
+        has_left = b > 1e-9 * left_norms
+        determinant = a * b - c * c
+        pair = has_right & has_left & (determinant > 1e-9 * a * b)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            single = np.maximum(np.where(has_right, ra * ra / a, 0.0), np.where(has_left, rb * rb / b, 0.0))
+            reduction = np.where(pair, (b * ra * ra - 2 * c * ra * rb + a * rb * rb) / determinant, single)
+
+        reduction = np.where(eligible & running[:,None], reduction, -1.0)
+        best = reduction.argmax(axis = 1)
+        gain = reduction[rows, best]
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            adding = running & (gain > 0) & (gain / tss >= threshold) & ((rss - gain) / tss > threshold)
+        running = adding.copy()
+        if not adding.any():
+            break
+
+        # The pair joins the basis, each hinge only if it adds a dimension
+        for offset, side, rest, norms in [(0, 1, right_rest, right_norms), (1, -1, left_rest, left_norms)]:
+            column = rest[rows, :, best]
+            if offset:
+                column = column - Q[:,:,term] * (Q[:,:,term] * column).sum(axis = 1)[:,None]
+            size = (column * column).sum(axis = 1)
+            independent = adding & (size > 1e-9 * norms[rows, best])
+            q = np.where(independent[:,None], column / np.sqrt(np.where(independent, size, 1.0))[:,None], 0.0)
+            Q[:,:,term + offset] = q
+            residuals = residuals - q * (q * residuals).sum(axis = 1)[:,None]
+            basis[:,:,term + offset] = (right if side > 0 else left)[:, best].T
+            present[:,term + offset] = independent
+            knots[:,term + offset] = best
+            sides[:,term + offset] = side
+        rss = (residuals * residuals).sum(axis = 1)
+
+        # No other knot within minspan days of this one
+        eligible &= ~(adding[:,None] & (np.abs(day[None,:] - best[:,None]) < minspan[:,None]))
+    return basis, present, knots, sides
+
+
+def least_squares(X, y, columns):
+    # Coefficients of a batch of least squares problems on the given
+    # columns of X, and the inverse of X'X over them (zero elsewhere). The
+    # forward pass only keeps independent columns, so X'X is inverted as
+    # is, with ones on the diagonal for the columns left out, which an SVD
+    # based pseudo-inverse takes several times as long for.
+    X = X * columns[:,None,:]
+    inverse = np.linalg.inv(X.transpose(0, 2, 1) @ X + np.eye(X.shape[2]) * ~columns[:,:,None]) * (columns[:,:,None] & columns[:,None,:])
+    return (inverse @ (X.transpose(0, 2, 1) @ y[:,:,None]))[:,:,0], inverse
+
+
+def backward(basis, present, y, valid):
+    # Backward pass: drops, one at a time, the term whose loss raises the RSS
+    # least, and returns the subset with the lowest GCV along the way
+    X = basis * valid[:,:,None]
+    y = np.where(valid, y, 0.0)
+    n = valid.sum(axis = 1)
+    current = present.copy()
+    best = current.copy()
+    best_gcv = np.full(len(y), np.inf)
+    removable = np.arange(present.shape[1])[None,:] > 0
+    for _ in range(present.shape[1]):
+        coefficients, inverse = least_squares(X, y, current)
+        residuals = y - np.einsum('mdt,mt->md', X, coefficients)
+        rss = (residuals * residuals).sum(axis = 1)
+        terms = current.sum(axis = 1)
+        cost = terms + penalty * (terms - 1) / 2
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            gcv = np.where(cost < n, rss / (n * (1 - cost / n) ** 2), np.inf)
+        better = gcv < best_gcv
+        best[better] = current[better]
+        best_gcv = np.where(better, gcv, best_gcv)
+
+        diagonal = np.diagonal(inverse, axis1 = 1, axis2 = 2)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            increase = np.where(current & removable & (diagonal > 0), coefficients * coefficients / diagonal, np.inf)
+        dropping = np.isfinite(increase).any(axis = 1)
+        if not dropping.any():
+            break
+        current[np.flatnonzero(dropping), increase[dropping].argmin(axis = 1)] = False
+    return best
+
+
+def fit_block(y, valid, lengths):
+    # MARS fits of a block of models: the fitted values (model, day), NaN
+    # where y is missing, the slope from every day to the next, and the
+    # days the slope changes at
+    basis, present, knots, sides = forward(y, valid, lengths)
+    # Only as many terms as the largest model of the block took
+    terms = int(np.flatnonzero(present.any(axis = 0)).max(initial = 0)) + 1
+    basis, present, knots, sides = basis[:,:,:terms], present[:,:terms], knots[:,:terms], sides[:,:terms]
+    chosen = backward(basis, present, y, valid)
+    coefficients, _ = least_squares(basis * valid[:,:,None], np.where(valid, y, 0.0), chosen)
+    fitted = np.where(valid, np.einsum('mdt,mt->md', basis, coefficients), np.nan)
+
+    # A right hinge adds its coefficient to the slope after its knot, a left
+    # hinge takes it away before
+    day = np.arange(y.shape[1])[None,:,None]
+    knot = knots[:,None,:]
+    side = sides[:,None,:]
+    slopes = (coefficients[:,None,:] * ((side > 0) & (day >= knot)) - coefficients[:,None,:] * ((side < 0) & (day < knot))).sum(axis = 2)
+    breaks = np.zeros(y.shape, dtype = bool)
+    models, terms = np.nonzero(chosen & (sides != 0))
+    breaks[models, knots[models, terms]] = True
+    return fitted, slopes, breaks
+
+
+def mars(y, valid, lengths, workers = None):
+    # fit_block() over any number of models, in blocks of models of similar
+    # length trimmed to their longest, on a process pool when there are
+    # several blocks
+    order = np.argsort(lengths, kind = 'mergesort')
+    blocks = [order[start:start + block_models] for start in range(0, len(order), block_models)]
+    tasks = [(y[block,:lengths[block].max()], valid[block,:lengths[block].max()], lengths[block]) for block in blocks]
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            results = list(pool.map(fit_block, *zip(*tasks)))
+    else:
+        results = [fit_block(*task) for task in tasks]
+
+    fitted = np.full(y.shape, np.nan)
+    slopes = np.zeros(y.shape)
+    breaks = np.zeros(y.shape, dtype = bool)
+    for block, (block_fitted, block_slopes, block_breaks) in zip(blocks, results):
+        width = block_fitted.shape[1]
+        fitted[block,:width] = block_fitted
+        slopes[block,:width] = block_slopes
+        breaks[block,:width] = block_breaks
+    return fitted, slopes, breaks
+
+
+def period_term(level, late):
+    # Table 2's name of a CI period, as 'CI 1 - early'
+    if np.isnan(level):
+        return 'CI NA'
+    if level in (1, 2):
+        return 'CI {:d} - {}'.format(int(level), 'late' if late else 'early')
+    return 'CI {:d}'.format(int(level))
+
+
+def periods(geo_index, geographies):
+    # The CI periods of every geography and the days of its reduction series
+    # in them: a list of (geography, start date, term) per period, and for
+    # every row of figure2, as selected, its period (-1 for none) and days
+    # since the period's start
+    sip, sip_bounds = geo_index.select_many('figure12_sip', geographies)
+    series, bounds = geo_index.select_many('figure2', geographies)
+    sip_dates = sip['date'].values
+    levels = sip['SIP'].to_numpy(dtype = 'float64')
+    dates = series['date'].values
+    day = np.timedelta64(1, 'D')
+
+    models = []
+    model_of_row = np.full(len(series), -1, dtype = 'int64')
+    offset_of_row = np.zeros(len(series), dtype = 'int64')
+    for geography in geographies:
+        start, stop = bounds.get(geography, (0, 0))
+        if start == stop:
+            continue
+        sip_start, sip_stop = sip_bounds.get(geography, (0, 0))
+        geography_dates = dates[start:stop]
+        if sip_start == sip_stop:
+            # No CI levels: the series is one period
+            run_dates, run_levels, late = geography_dates[:1], np.array([np.nan]), np.array([False])
+            position = np.zeros(stop - start, dtype = 'int64')
+        else:
+            level = levels[sip_start:sip_stop]
+            runs = np.flatnonzero(np.concatenate([[True], (level[1:] != level[:-1]) & ~(np.isnan(level[1:]) & np.isnan(level[:-1]))]))
+            run_dates, run_levels = sip_dates[sip_start:sip_stop][runs], level[runs]
+            # Levels 1 and 2 are 'late' after the first day at the highest
+            # level, as in Table 1
+            peak = np.nanmax(level) if not np.isnan(level).all() else np.nan
+            late = runs > (np.argmax(level == peak) if not np.isnan(peak) else len(level))
+            days_sip = np.clip(np.searchsorted(sip_dates[sip_start:sip_stop], geography_dates, side = 'right') - 1, 0, None)
+            position = np.searchsorted(runs, days_sip, side = 'right') - 1
+        run_dates = run_dates.copy()
+        run_dates[0] = min(run_dates[0], geography_dates[0])
+
+        used = np.unique(position)
+        model = np.full(len(run_dates), -1, dtype = 'int64')
+        model[used] = len(models) + np.arange(len(used))
+        models += [(geography, run_dates[run], period_term(run_levels[run], late[run])) for run in used.tolist()]
+        model_of_row[start:stop] = model[position]
+        offset_of_row[start:stop] = (geography_dates - run_dates[position]) // day
+    return models, series, bounds, model_of_row, offset_of_row
+
+
+def input_hashes(geo_index, geographies):
+    # {geography: hash} of the rows a geography's fit depends on, and of its
+    # name, which its cached lines hold
+    hashes = {geography: [str(engine_version), hashlib.sha1(geography.encode('utf-8')).hexdigest()] for geography in geographies}
+    for df_name, columns in model_inputs.items():
+        df, bounds = geo_index.select_many(df_name, geographies)
+        row_hashes = pd.util.hash_pandas_object(df.loc[:,columns], index = False).values
+        for geography in geographies:
+            hashes[geography].append(hashlib.sha1(row_hashes[slice(*bounds[geography])].tobytes()).hexdigest())
+    return {geography: hashlib.sha1(':'.join(parts).encode('ascii')).hexdigest()[:16] for geography, parts in hashes.items()}
+
+
+def float_texts(values):
+    return ['NA' if value != value else '{:.9g}'.format(value) for value in values.tolist()]
+
+
+def design(geo_index, geographies):
+    # periods() and the reduction series of every period as (model, day),
+    # NaN on days without one, and the days of each
+    models, series, bounds, model_of_row, offset_of_row = periods(geo_index, geographies)
+    percent_red = series['percent_red'].to_numpy(dtype = 'float64')
+    rows = np.flatnonzero(model_of_row >= 0)
+    lengths = np.zeros(len(models), dtype = 'int64')
+    np.maximum.at(lengths, model_of_row[rows], offset_of_row[rows] + 1)
+    y = np.full((len(models), max(int(lengths.max()) if len(models) else 0, 1)), np.nan)
+    y[model_of_row[rows], offset_of_row[rows]] = percent_red[rows]
+    return models, series, bounds, model_of_row, offset_of_row, y, lengths
+
+
+def estimate(geo_index, geographies, workers = None):
+    # {geography: (figure2 lines, table2 lines)} of every geography, as CSV
+    # text
+    results = {}
+    if not geographies:
+        return results
+    models, series, bounds, model_of_row, offset_of_row, y, lengths = design(geo_index, geographies)
+    percent_red = series['percent_red'].to_numpy(dtype = 'float64')
+    fitted, slopes, breaks = mars(y, ~np.isnan(y), lengths, workers)
+
+    # Figure 2 a column at a time: a row breaks where the fit bends and
+    # where a new period starts, which is where the CI level changes
+    first_rows = np.zeros(len(series), dtype = bool)
+    first_rows[[start for start, stop in bounds.values() if stop > start]] = True
+    change = np.concatenate([[False], model_of_row[1:] != model_of_row[:-1]]) & ~first_rows
+    breakpoint = change | breaks[model_of_row, offset_of_row]
+    names = np.array([quoted(name) for name in series['geography'].cat.categories] + [''], dtype = object)
+    columns = [
+        names[series['geography'].cat.codes.to_numpy()], np.datetime_as_string(series['date'].values, unit = 'D'),
+        float_texts(percent_red), float_texts(fitted[model_of_row, offset_of_row]),
+        np.where(breakpoint, '1', 'NA'), np.where(change, '1', 'NA'), np.where(breakpoint & change, '1', 'NA'),
+    ]
+    figure2 = [','.join(fields) for fields in zip(*columns)]
+
+    models_of = {}
+    for model, (geography, _, _) in enumerate(models):
+        models_of.setdefault(geography, []).append(model)
+    for geography in geographies:
+        start, stop = bounds.get(geography, (0, 0))
+        table2 = []
+        previous_slope = None
+        for model in models_of.get(geography, []):
+            _, run_date, term = models[model]
+            length = lengths[model]
+            table2.append([term, 'start', str(run_date)[:10], fixed_number(100 * slopes[model, 0]),
+                           '-' if previous_slope is None else short_number(previous_slope), 0])
+            for number, knot in enumerate(np.flatnonzero(breaks[model,:length]).tolist(), 1):
+                table2.append([term, 'BP{}'.format(number), str(run_date + np.timedelta64(knot, 'D'))[:10],
+                               fixed_number(100 * slopes[model, knot]), short_number(100 * slopes[model, knot - 1]), knot + 1])
+            previous_slope = 100 * slopes[model, max(length - 2, 0)]
+        if table2:
+            table2.append([term, 'end', str(run_date + np.timedelta64(length - 1, 'D'))[:10], None, short_number(previous_slope), length])
+        results[geography] = ('\n'.join(figure2[start:stop]), '\n'.join(
+            ','.join([quoted(geography)] + [quoted(field) if isinstance(field, str) else 'NA' if field is None else str(field) for field in row])
+            for row in table2
+        ))
+    return results
+
+
+def check_series(snapshot, geographies):
+    # Raises ValueError when CI levels from delta files go past the end of a
+    # geography's reduction series, which means figure2.csv wasn't refreshed
+    if not len(snapshot.tails.get('figure12_sip', ())):
+        return
+    appended = snapshot.geo_index.tails.last_dates('figure12_sip', geographies)
+    series = snapshot.geo_index.last_dates('figure2', geographies)
+    stale = [geography for geography, stale in zip(geographies, appended > series) if stale]
+    if stale:
+        raise ValueError('{}: the CI levels appended from {} run past the end of its percent_red for {}; refresh it before fitting'.format(
+            os.path.join(snapshot.data_dir, 'figure2.csv'), ', '.join(os.path.basename(path) for path in snapshot.appended['figure12_sip']),
+            ', '.join(stale)
+        ))
+
+
+def regenerate(snapshot, out_dir, workers = None, cache_path = None):
+    # Writes Figure 2 and Table 2 of every geography of `snapshot` to
+    # out_dir, fitting only the geographies whose inputs aren't in the cache
+    # at cache_path, and returns how many were fit
+    geographies = snapshot.geographies
+    check_series(snapshot, geographies)
+    keys = input_hashes(snapshot.geo_index, geographies)
+    cache = read_cache(cache_path) if cache_path else {}
+    missing = [geography for geography in geographies if keys[geography] not in cache]
+    for geography, lines in estimate(snapshot.geo_index, missing, workers).items():
+        cache[keys[geography]] = lines
+
+    os.makedirs(out_dir, exist_ok = True)
+    for position, (name, header) in enumerate([('figure2', figure2_header), ('table2', table2_header)]):
+        parts = [','.join(quoted(column) for column in header)]
+        parts += [cache[keys[geography]][position] for geography in geographies if cache[keys[geography]][position]]
+        write_atomic(os.path.join(out_dir, name + '.csv'), '\n'.join(parts) + '\n')
+
+    if cache_path:
+        used = set(keys.values())
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok = True)
+        write_atomic(cache_path, json.dumps({key: lines for key, lines in cache.items() if key in used}))
+    return len(missing)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Fit Figure 2 and Table 2 from the series in data-dir')
+    parser.add_argument('--data-dir', default = os.environ.get('COVID_SI_DATA_DIR', default_data_dir))
+    parser.add_argument('--out-dir', required = True, help = 'where the tables are written; data-dir replaces the published ones')
+    parser.add_argument('--workers', type = int, help = 'processes for the blocks of models, one per core by default')
+    parser.add_argument('--cache', help = 'results by input hash, data-dir/store/mars.json by default')
+    parser.add_argument('--no-cache', action = 'store_true')
+    args = parser.parse_args()
+
+    snapshot = DataSnapshot(args.data_dir)
+    cache_path = None if args.no_cache else args.cache or os.path.join(snapshot.data_dir, 'store', 'mars.json')
+    fitted = regenerate(snapshot, os.path.expanduser(args.out_dir), args.workers, cache_path)
+    print('{} of {} geographies fit, tables written to {}'.format(fitted, len(snapshot.geographies), args.out_dir))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
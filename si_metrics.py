@@ -0,0 +1,276 @@
+# Instrumentation of the app's hot paths: how long each section spends
+# selecting its rows, building its figures or tables, converting rows to
+# records and encoding the payload; request latency and response bytes by
+# route and geography; all in the Prometheus text format. Requests slower
+# than a threshold are logged with their section breakdown. When disabled
+# the hooks hand back shared no-op objects, so the render paths only pay an
+# attribute check.
+import sys
+import json
+import time
+import bisect
+import threading
+
+# Upper bounds of the latency histogram buckets, in seconds
+latency_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+metric_help = {
+    'si_section_seconds': ('histogram', 'Time spent rendering a section, by phase.'),
+    'si_request_seconds': ('histogram', 'Time from receiving a request to its response, by route and geography.'),
+    'si_response_bytes_total': ('counter', 'Bytes of response bodies sent, by route and geography.'),
+}
+
+# The request being served and the section being rendered on this thread
+local = threading.local()
+
+
+class NullTimer:
+    # Stands in for a SectionTimer when metrics are off
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def split(self, phase):
+        pass
+
+    def index(self, geo_index):
+        return geo_index
+
+
+null_timer = NullTimer()
+
+
+class TimedIndex:
+    # GeographyIndex whose selections count towards the 'select' phase
+
+    def __init__(self, geo_index, timer):
+        self.geo_index = geo_index
+        self.timer = timer
+
+    def select(self, df_name, geography):
+        start = time.perf_counter()
+        try:
+            return self.geo_index.select(df_name, geography)
+        finally:
+            self.timer.nested('select', time.perf_counter() - start)
+
+    def select_many(self, df_name, geographies):
+        start = time.perf_counter()
+        try:
+            return self.geo_index.select_many(df_name, geographies)
+        finally:
+            self.timer.nested('select', time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self.geo_index, name)
+
+
+class Phase:
+    # Times a nested phase (e.g. 'records') of the section being rendered
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timer.nested(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def phase(name):
+    # Context manager timing `name` within the section rendered on this
+    # thread, or a no-op when there is none
+    timer = getattr(local, 'timer', None)
+    return null_timer if timer is None else Phase(timer, name)
+
+
+class SectionTimer:
+    # Splits one section render into phases. split() closes the phase that
+    # ran since the previous split, less the nested phases timed inside it.
+
+    def __init__(self, metrics, section):
+        self.metrics = metrics
+        self.section = section
+        self.phases = {}
+        self.nested_seconds = 0.0
+
+    def __enter__(self):
+        self.previous = getattr(local, 'timer', None)
+        local.timer = self
+        self.start = self.last = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        local.timer = self.previous
+        if exc_type is None:
+            self.phases['total'] = time.perf_counter() - self.start
+            self.metrics.section_rendered(self.section, self.phases)
+        return False
+
+    def nested(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+        self.nested_seconds += seconds
+
+    def split(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.last - self.nested_seconds
+        self.last = now
+        self.nested_seconds = 0.0
+
+    def index(self, geo_index):
+        return TimedIndex(geo_index, self)
+
+
+class RequestTrace:
+    # Sections one request rendered (cache hits render nothing), for the
+    # slow request log
+
+    def __init__(self, path):
+        self.path = path
+        self.start = time.perf_counter()
+        self.sections = []
+        self.lock = threading.Lock()
+
+    def add(self, section, phases):
+        with self.lock:
+            self.sections.append(dict(phases, section = section))
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+def label_string(labels, extra = ()):
+    pairs = tuple(labels) + tuple(extra)
+    if not pairs:
+        return ''
+    escaped = (
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+class Metrics:
+    # Histograms and counters keyed by metric name and a tuple of (label,
+    # value) pairs. `slow_seconds` turns on the slow request log.
+
+    def __init__(self, enabled = False, slow_seconds = None, log = None):
+        self.enabled = enabled
+        self.slow_seconds = slow_seconds
+        self.log = log or sys.stderr
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name, labels, value, buckets = latency_buckets):
+        with self.lock:
+            key = (name, labels)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    def count(self, name, labels, value = 1):
+        with self.lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def section(self, section):
+        # Timer for rendering `section` on this thread
+        return SectionTimer(self, section) if self.enabled else null_timer
+
+    def section_rendered(self, section, phases):
+        for phase_name, seconds in phases.items():
+            self.observe('si_section_seconds', (('section', section), ('phase', phase_name)), seconds)
+        trace = getattr(local, 'trace', None)
+        if trace is not None:
+            trace.add(section, phases)
+
+    def bind(self, function):
+        # `function` running under this thread's request trace, for calls
+        # handed to a thread pool
+        if not self.enabled:
+            return function
+        trace = getattr(local, 'trace', None)
+
+        def traced(*args):
+            previous = getattr(local, 'trace', None)
+            local.trace = trace
+            try:
+                return function(*args)
+            finally:
+                local.trace = previous
+        return traced
+
+    def start_request(self, path):
+        local.trace = RequestTrace(path)
+
+    def finish_request(self, route, geography, status, size):
+        trace = getattr(local, 'trace', None)
+        local.trace = None
+        if trace is None:
+            return
+        seconds = time.perf_counter() - trace.start
+        labels = (('route', route), ('geography', geography or ''))
+        self.observe('si_request_seconds', labels, seconds)
+        if size is not None:
+            self.count('si_response_bytes_total', labels, size)
+
+        if self.slow_seconds is not None and seconds >= self.slow_seconds:
+            entry = {
+                'slow_request': trace.path, 'route': route, 'geography': geography, 'status': status,
+                'seconds': round(seconds, 6), 'bytes': size,
+                'sections': [
+                    {key: round(value, 6) if isinstance(value, float) else value for key, value in section.items()}
+                    for section in trace.sections
+                ],
+            }
+            print(json.dumps(entry), file = self.log, flush = True)
+
+    def render(self, gauges = ()):
+        # Prometheus text exposition of everything recorded, plus `gauges`
+        # given as (name, help, type, labels, value)
+        with self.lock:
+            histograms = {key: (list(h.counts), h.sum, h.buckets) for key, h in self.histograms.items()}
+            counters = dict(self.counters)
+
+        lines = []
+        for name, (kind, help_text) in metric_help.items():
+            lines += ['# HELP {} {}'.format(name, help_text), '# TYPE {} {}'.format(name, kind)]
+            if kind == 'histogram':
+                for (metric, labels), (counts, total, buckets) in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets + (float('inf'),), counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append('{}_bucket{} {}'.format(name, label_string(labels, [('le', le)]), cumulative))
+                    lines.append('{}_sum{} {!r}'.format(name, label_string(labels), total))
+                    lines.append('{}_count{} {}'.format(name, label_string(labels), cumulative))
+            else:
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append('{}{} {}'.format(name, label_string(labels), value))
+
+        described = set()
+        for name, help_text, kind, labels, value in gauges:
+            if name not in described:
+                lines += ['# HELP {} {}'.format(name, help_text), '# TYPE {} {}'.format(name, kind)]
+                described.add(name)
+            lines.append('{}{} {}'.format(name, label_string(labels), value))
+        return '\n'.join(lines) + '\n'
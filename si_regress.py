@@ -0,0 +1,335 @@
+# Estimation engine for Tables 1, 3 and 4: ordinary least squares of the
+# electricity reduction on containment levels (Table 1) and on mobility, one
+# type at a time (Table 3) and jointly (Table 4), from the series the app
+# serves, to check the published estimates against those series (e.g. after
+# daily delta files are appended).
+#
+# It is not the upstream analysis and its tables are not the published ones.
+# Table 1 follows the published specification but reproduces its terms for
+# only some geographies, and Tables 3 and 4 are fit on figure1's weekly
+# series with three of the six mobility types, so their N and coefficients
+# can't match. They are written as <table>_estimated.csv, which the app
+# never reads, and every run reports the geographies whose estimates differ
+# from the published tables.
+#
+# Every geography's model is solved at once: designs are stacked into
+# (model, observation, regressor) arrays padded to the longest series, and
+# the normal equations solved as one batch, split across processes for
+# large batches. Results are cached per geography by a hash of its input
+# rows, so only geographies whose series changed are estimated again.
+#
+# Table 1 regresses the daily reduction (figure2, in percent) on dummies for
+# CI levels 1 to 3, with levels 1 and 2 split at the first day a geography
+# reached its highest level, against CI 0 (no constant where there is no CI
+# 0 day). Tables 3 and 4 regress the weekly reduction on the mobility
+# changes in figure1, in percent, which has three of the six mobility types
+# of the published tables.
+#
+#   python si_regress.py --out-dir <dir> [--data-dir data] [--workers 4] [--cache data/store/regressions.json] [--no-cache]
+import os
+import sys
+import json
+import math
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from si_data import default_data_dir, DataSnapshot, quoted, read_cache, write_atomic, short_number, fixed_number
+
+# Changes whenever a model or the output format does, so cached results of
+# another version are never reused
+engine_version = 1
+
+# Smallest batch of models worth handing to another process
+min_batch = 256
+
+ci_variables = ['CI 1 early', 'CI 1 late', 'CI 2 early', 'CI 2 late', 'CI 3']
+mobility_columns = {'workplace': 'Workplace', 'residential': 'Residential', 'grocery_pharmacy': 'Grocery Pharmacy'}
+
+# Tables estimated and the tables their inputs come from
+model_inputs = {
+    'table1': ['figure12_sip', 'figure2'],
+    'table3': ['figure1'],
+    'table4': ['figure1'],
+}
+
+lgamma = np.vectorize(math.lgamma, otypes = [float])
+
+
+def betainc(a, b, x, iterations = 300):
+    # Regularized incomplete beta function I_x(a, b), elementwise, from its
+    # continued fraction (modified Lentz), on whichever side of the mean it
+    # converges fast
+    a, b, x = (np.asarray(value, dtype = 'float64') for value in np.broadcast_arrays(a, b, x))
+    flip = x > (a + 1) / (a + b + 2)
+    a, b, x = np.where(flip, b, a), np.where(flip, a, b), np.where(flip, 1 - x, x)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        front = np.exp(lgamma(a + b) - lgamma(a) - lgamma(b) + a * np.log(x) + b * np.log1p(-x)) / a
+        tiny = 1e-300
+        c = np.ones_like(x)
+        d = 1 - (a + b) * x / (a + 1)
+        d = 1 / np.where(np.abs(d) < tiny, tiny, d)
+        h = d
+        for m in range(1, iterations):
+            for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)), -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+                d = 1 + numerator * d
+                d = 1 / np.where(np.abs(d) < tiny, tiny, d)
+                c = 1 + numerator / c
+                c = np.where(np.abs(c) < tiny, tiny, c)
+                h = h * d * c
+            if not (np.abs(d * c - 1) > 1e-14).any():
+                break
+        result = front * h
+    return np.where(flip, 1 - result, result)
+
+
+def t_pvalues(t, dof):
+    # Two-sided p-values of t statistics with `dof` degrees of freedom
+    t, dof = np.broadcast_arrays(np.asarray(t, dtype = 'float64'), np.asarray(dof, dtype = 'float64'))
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return betainc(dof / 2, 0.5, dof / (dof + t * t))
+
+
+def ols(X, y, valid):
+    # Least squares of y on X for a batch of models at once: X is (model,
+    # observation, regressor), y and valid (model, observation), invalid
+    # observations left out. A regressor that is zero over all of a model's
+    # observations is left out of it, with NaN estimates. Standard errors
+    # are robust to heteroskedasticity (HC1), as those of the published
+    # tables; R2 is centered when the model has a constant, as usual.
+    X = np.where(valid[:,:,None], X, 0.0)
+    y = np.where(valid, y, 0.0)
+    active = (X != 0).any(axis = 1)
+    xtx = np.einsum('mok,mol->mkl', X, X)
+    inverse = np.linalg.pinv(xtx)
+    coefficients = np.einsum('mkl,ml->mk', inverse, np.einsum('mok,mo->mk', X, y))
+
+    n = valid.sum(axis = 1)
+    dof = n - np.linalg.matrix_rank(xtx)
+    residuals = np.where(valid, y - np.einsum('mok,mk->mo', X, coefficients), 0.0)
+    rss = (residuals * residuals).sum(axis = 1)
+    constant = (active & ((X == 1) | ~valid[:,:,None]).all(axis = 1)).any(axis = 1)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        mean = np.where(constant, y.sum(axis = 1) / n, 0.0)
+        tss = (np.where(valid, y - mean[:,None], 0.0) ** 2).sum(axis = 1)
+        meat = np.einsum('mok,mol->mkl', X * (residuals * residuals)[:,:,None], X)
+        covariance = np.einsum('mkl,mlj,mji->mki', inverse, meat, inverse) * (n / np.where(dof > 0, dof, np.nan))[:,None,None]
+        standard_errors = np.sqrt(np.diagonal(covariance, axis1 = 1, axis2 = 2))
+        t = coefficients / standard_errors
+    return {
+        'coefficient': np.where(active, coefficients, np.nan),
+        'standard_error': np.where(active, standard_errors, np.nan),
+        'p_value': np.where(active, t_pvalues(t, dof[:,None]), np.nan),
+        'R2': 1 - rss / tss,
+        'N': n,
+    }
+
+
+def ols_parallel(X, y, valid, workers = None):
+    # ols() of a batch split into one part per process, for batches large
+    # enough to be worth sending
+    workers = workers or os.cpu_count() or 1
+    parts = min(workers, len(X) // min_batch)
+    if parts <= 1:
+        return ols(X, y, valid)
+    splits = np.array_split(np.arange(len(X)), parts)
+    with ProcessPoolExecutor(max_workers = parts) as pool:
+        results = list(pool.map(ols, *zip(*[(X[part], y[part], valid[part]) for part in splits])))
+    return {key: np.concatenate([result[key] for result in results]) for key in results[0]}
+
+
+def padded(values, bounds, geographies, fill = np.nan):
+    # Rows of values (n, ...) grouped by geography, as (geography, position)
+    # arrays padded with `fill` to the longest geography, and which
+    # positions hold a row
+    spans = np.array([bounds.get(geography, (0, 0)) for geography in geographies], dtype = np.intp).reshape(-1, 2)
+    lengths = spans[:,1] - spans[:,0]
+    width = max(int(lengths.max()) if len(lengths) else 0, 1)
+    present = np.arange(width)[None,:] < lengths[:,None]
+    rows = np.where(present, spans[:,:1] + np.arange(width)[None,:], 0)
+    values = np.asarray(values)
+    if len(values):
+        result = values[rows]
+    else:
+        result = np.zeros(rows.shape + values.shape[1:], dtype = values.dtype)
+    return np.where(present.reshape(present.shape + (1,) * (values.ndim - 1)), result, fill), present
+
+
+def table1_design(geo_index, geographies):
+    # Daily reduction, in percent, against dummies of the CI level of the day
+    sip, bounds = geo_index.select_many('figure12_sip', geographies)
+    series, _ = geo_index.select_many('figure2', geographies)
+    df = sip.loc[:,['geography','date','SIP']].merge(series.loc[:,['geography','date','percent_red']], on = ['geography','date'], how = 'left', sort = False)
+    level, present = padded(df['SIP'].to_numpy(dtype = 'float64'), bounds, geographies)
+    y = 100 * padded(df['percent_red'].to_numpy(dtype = 'float64'), bounds, geographies)[0]
+
+    # Levels 1 and 2 are 'late' after the first day at the highest level
+    peak = np.nanmax(np.where(present, level, -1), axis = 1)
+    late = np.arange(level.shape[1])[None,:] > np.argmax(level == peak[:,None], axis = 1)[:,None]
+    has_zero = (level == 0).any(axis = 1)
+    X = np.stack([
+        np.broadcast_to(has_zero[:,None], level.shape),
+        (level == 1) & ~late, (level == 1) & late, (level == 2) & ~late, (level == 2) & late, level == 3,
+    ], axis = 2).astype('float64')
+    return X[:,:,[1, 2, 3, 4, 5, 0]], y, present & ~np.isnan(y) & ~np.isnan(level)
+
+
+def mobility_design(geo_index, geographies):
+    # Weekly reduction and mobility changes, in percent, and which
+    # observations have each
+    df, bounds = geo_index.select_many('figure1', geographies)
+    y, present = padded(100 * df['percent_red'].to_numpy(dtype = 'float64'), bounds, geographies)
+    mobility = padded(100 * df.loc[:,list(mobility_columns)].to_numpy(dtype = 'float64'), bounds, geographies)[0]
+    return mobility, y, (present & ~np.isnan(y))[:,:,None] & ~np.isnan(mobility)
+
+
+def estimate(geo_index, geographies, workers = None):
+    # {table: {geography: rows}} of every table for `geographies`, the rows
+    # as lists of CSV fields
+    tables = {df_name: {} for df_name in model_inputs}
+    if not geographies:
+        return tables
+
+    X, y, valid = table1_design(geo_index, geographies)
+    fit = ols_parallel(X, y, valid, workers)
+    for g, geography in enumerate(geographies):
+        tables['table1'][geography] = [
+            [variable, short_number(fit['coefficient'][g, k]), short_number(fit['p_value'][g, k]), short_number(fit['standard_error'][g, k])]
+            for k, variable in enumerate(ci_variables + ['const'])
+        ] + [['N', None, short_number(fit['N'][g], 0), None], ['R2', None, short_number(fit['R2'][g]), None]]
+
+    # Table 3 fits every (geography, mobility type) pair as one batch
+    mobility, y, observed = mobility_design(geo_index, geographies)
+    types = len(mobility_columns)
+    ones = np.ones(y.shape + (1,))
+    X = np.concatenate([np.broadcast_to(ones[:,None], (len(geographies), types) + y.shape[1:] + (1,)), np.moveaxis(mobility, 2, 1)[:,:,:,None]], axis = 3)
+    fit = ols_parallel(
+        X.reshape((-1,) + X.shape[2:]), np.repeat(y, types, axis = 0), np.moveaxis(observed, 2, 1).reshape(-1, y.shape[1]), workers
+    )
+    for g, geography in enumerate(geographies):
+        tables['table3'][geography] = [
+            [label] + [fixed_number(fit[key][g * types + m] if key in ('R2', 'N') else fit[key][g * types + m, 1]) for key in ['coefficient', 'standard_error', 'p_value', 'R2', 'N']]
+            for m, label in enumerate(mobility_columns.values())
+        ]
+
+    fit = ols_parallel(np.concatenate([mobility, ones], axis = 2), y, observed.all(axis = 2), workers)
+    for g, geography in enumerate(geographies):
+        tables['table4'][geography] = [
+            [label] + [fixed_number(fit[key][g, m]) for key in ['coefficient', 'standard_error', 'p_value']]
+            for m, label in enumerate(mobility_columns.values())
+        ] + [
+            ['Constant', fixed_number(fit['coefficient'][g, types]), None, None],
+            ['N', None, fixed_number(fit['N'][g]), None],
+            ['R2', None, fixed_number(fit['R2'][g]), None],
+        ]
+    return tables
+
+
+# Header and the text of a missing value of each table's CSV
+table_formats = {
+    'table1': (['geography', 'variable', 'coefficient', 'p_value', 'standard_error'], '"-"'),
+    'table3': (['geography', 'mobility_type_desc', 'coefficient', 'standard_error', 'p_value', 'R2', 'N'], '"-"'),
+    'table4': (['geography', 'mobility_type_desc', 'coefficient', 'standard_error', 'p_value'], 'NA'),
+}
+
+
+# Decimals of each published table; estimates within one unit of them match
+published_decimals = {'table1': 3, 'table3': 2, 'table4': 2}
+
+
+def estimated_path(out_dir, table):
+    return os.path.join(out_dir, table + '_estimated.csv')
+
+
+def differences(geo_index, geographies, rows):
+    # {table: [geography]} of the geographies whose estimates, `rows` as
+    # {table: {geography: rows}}, differ from the published table: a row
+    # only one of them has, a value only one of them has, or values more
+    # than the published rounding apart
+    result = {}
+    for table, (header, missing_text) in table_formats.items():
+        published, bounds = geo_index.select_many(table, geographies)
+        labels = published[header[1]].astype(object).to_numpy()
+        values = np.column_stack([published[column].to_numpy(dtype = 'float64', na_value = np.nan) for column in header[2:]])
+        tolerance = 1.001 * 10.0 ** -published_decimals[table]
+        result[table] = []
+        for geography in geographies:
+            start, stop = bounds[geography]
+            expected = dict(zip(labels[start:stop].tolist(), values[start:stop]))
+            estimated = {row[0]: np.array([np.nan if field is None else float(field) for field in row[1:]]) for row in rows[table][geography]}
+            if expected.keys() != estimated.keys() or not all(
+                np.allclose(estimated[label], expected[label], rtol = 0, atol = tolerance, equal_nan = True) for label in estimated
+            ):
+                result[table].append(geography)
+    return result
+
+
+def input_keys(snapshot, geographies):
+    # {table: {geography: hash}} of every geography's input rows
+    fingerprints = {
+        df_name: snapshot.geo_index.fingerprints(df_name, geographies)
+        for df_name in sorted({df_name for inputs in model_inputs.values() for df_name in inputs})
+    }
+    return {
+        table: {
+            geography: hashlib.sha1('{}:{}:{}'.format(engine_version, table, ','.join(fingerprints[df_name][geography] for df_name in inputs)).encode('utf-8')).hexdigest()[:16]
+            for geography in geographies
+        }
+        for table, inputs in model_inputs.items()
+    }
+
+
+def regenerate(snapshot, out_dir, workers = None, cache_path = None):
+    # Writes the estimates of Tables 1, 3 and 4 of every geography of
+    # `snapshot` to out_dir, estimating only the geographies whose inputs
+    # aren't in the cache at cache_path. Returns how many were estimated and
+    # differences() from the published tables.
+    geographies = snapshot.geographies
+    keys = input_keys(snapshot, geographies)
+    cache = read_cache(cache_path) if cache_path else {}
+    missing = [geography for geography in geographies if any(keys[table][geography] not in cache for table in model_inputs)]
+    for table, rows in estimate(snapshot.geo_index, missing, workers).items():
+        for geography, geography_rows in rows.items():
+            cache[keys[table][geography]] = geography_rows
+    rows = {table: {geography: cache[keys[table][geography]] for geography in geographies} for table in model_inputs}
+
+    os.makedirs(out_dir, exist_ok = True)
+    for table, (header, missing_text) in table_formats.items():
+        lines = [','.join(quoted(column) for column in header)]
+        for geography in geographies:
+            for row in rows[table][geography]:
+                lines.append(','.join([quoted(geography)] + [missing_text if field is None else quoted(field) for field in row]))
+        write_atomic(estimated_path(out_dir, table), '\n'.join(lines) + '\n')
+
+    if cache_path:
+        used = {key for table in keys.values() for key in table.values()}
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok = True)
+        write_atomic(cache_path, json.dumps({key: rows for key, rows in cache.items() if key in used}))
+    return len(missing), differences(snapshot.geo_index, geographies, rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Estimate Tables 1, 3 and 4 from the series in data-dir and compare them with the published ones')
+    parser.add_argument('--data-dir', default = os.environ.get('COVID_SI_DATA_DIR', default_data_dir))
+    parser.add_argument('--out-dir', required = True, help = 'where <table>_estimated.csv are written; the app never reads them')
+    parser.add_argument('--workers', type = int, help = 'processes for large batches, one per core by default')
+    parser.add_argument('--cache', help = 'results by input hash, data-dir/store/regressions.json by default')
+    parser.add_argument('--no-cache', action = 'store_true')
+    parser.add_argument('--list', type = int, default = 10, help = 'differing geographies named per table')
+    args = parser.parse_args()
+
+    snapshot = DataSnapshot(args.data_dir)
+    cache_path = None if args.no_cache else args.cache or os.path.join(snapshot.data_dir, 'store', 'regressions.json')
+    estimated, differing = regenerate(snapshot, os.path.expanduser(args.out_dir), args.workers, cache_path)
+    print('{} of {} geographies estimated, tables written to {}'.format(estimated, len(snapshot.geographies), args.out_dir))
+    for table, geographies in differing.items():
+        named = ', '.join(geographies[:args.list]) + (', and {} more'.format(len(geographies) - args.list) if len(geographies) > args.list else '')
+        print('{}: {} of {} geographies differ from the published table{}'.format(
+            table, len(geographies), len(snapshot.geographies), ': ' + named if geographies else ''
+        ))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+# Hot reload of the app's data. The current DataSnapshot is swapped for a
+# new one when the source files change or delta files arrive, either noticed
+# by polling their modification times or requested explicitly (e.g. from an
+# admin endpoint).
+# The new snapshot is loaded and validated before it is published, so a bad
+# file leaves the app serving the previous data.
+#
+# The processes of a pre-forking server each hold their own snapshot. An
+# explicit request reloads the process that receives it and touches a
+# trigger file, which the pollers of the other processes check, so they all
+# move to the new data.
+import os
+import sys
+import time
+import threading
+import traceback
+
+
+class Reloader:
+
+    def __init__(self, snapshot, on_swap = None, trigger_path = None):
+        self.snapshot = snapshot
+        self.on_swap = on_swap
+        self.trigger_path = trigger_path
+        self.trigger_mtime = self.trigger_time()
+        self.lock = threading.Lock()
+        self.reloads = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_failure = None
+        self.mtimes = self.source_mtimes()
+        self.polling_pid = None
+
+    def source_mtimes(self):
+        return [os.path.getmtime(path) if os.path.exists(path) else None for path in self.snapshot.source_paths()]
+
+    def trigger_time(self):
+        if self.trigger_path is None or not os.path.exists(self.trigger_path):
+            return None
+        return os.stat(self.trigger_path).st_mtime_ns
+
+    def request_reload(self):
+        # Reloads this process and touches the trigger file, so every other
+        # process polling it reloads too
+        if self.trigger_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.trigger_path)), exist_ok = True)
+            with open(self.trigger_path, 'a'):
+                pass
+            os.utime(self.trigger_path)
+        return self.reload()
+
+    def reload(self):
+        # Builds the successor of the current snapshot and swaps it in.
+        # Returns a summary; errors are recorded and the old data kept.
+        with self.lock:
+            previous = self.snapshot
+            self.mtimes = self.source_mtimes()
+            self.trigger_mtime = self.trigger_time()
+            try:
+                snapshot = previous.successor()
+            except Exception as error:
+                self.failures += 1
+                self.last_error = '{}: {}'.format(type(error).__name__, error)
+                self.last_failure = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+                traceback.print_exc(file = sys.stderr)
+                return {'reloaded': False, 'data_version': previous.data_version, 'error': self.last_error}
+            if snapshot is None:
+                return {'reloaded': False, 'data_version': previous.data_version}
+
+            # A single reference assignment, so readers see one snapshot or
+            # the other, never a mix
+            self.snapshot = snapshot
+            self.reloads += 1
+            self.last_error = None
+
+        changed = sorted(
+            set(previous.geographies) - set(snapshot.geographies)
+            | {geography for geography in snapshot.geographies if snapshot.version(geography) != previous.version(geography)}
+        )
+        if self.on_swap is not None:
+            self.on_swap(previous, snapshot, changed)
+        return {'reloaded': True, 'data_version': snapshot.data_version, 'previous_version': previous.data_version, 'changed': changed}
+
+    def poll(self, interval, trigger_interval):
+        # Checks the trigger file every trigger_interval seconds and, when
+        # interval is positive, the source files every interval seconds
+        checked = time.monotonic()
+        while True:
+            time.sleep(trigger_interval)
+            due = interval > 0 and time.monotonic() - checked >= interval
+            if due:
+                checked = time.monotonic()
+            if self.trigger_time() != self.trigger_mtime or due and self.source_mtimes() != self.mtimes:
+                self.reload()
+
+    def start_polling(self, interval, trigger_interval = 1.0):
+        # Polls in a daemon thread. Without a trigger file there is only
+        # the source files to check.
+        if self.trigger_path is None:
+            trigger_interval = interval
+        elif interval > 0:
+            trigger_interval = min(interval, trigger_interval)
+        thread = threading.Thread(target = self.poll, args = (interval, trigger_interval), name = 'si-reload', daemon = True)
+        thread.start()
+        self.polling_pid = os.getpid()
+        return thread
+
+    def ensure_polling(self, interval):
+        # Threads don't survive a fork, so every worker process of a
+        # pre-forking server starts its own poller on its first request
+        if self.polling_pid != os.getpid():
+            with self.lock:
+                if self.polling_pid != os.getpid():
+                    self.start_polling(interval)
+
+    def stats(self):
+        # Safe to publish: the last error's text, which names server paths,
+        # is left to callers that check who is asking
+        return {
+            'data_version': self.snapshot.data_version,
+            'reloads': self.reloads,
+            'failures': self.failures,
+            'last_failure': self.last_failure,
+        }
@@ -0,0 +1,626 @@
+# Builders for each figure and table section of the supplemental information
+# page. Every builder takes the GeographyIndex and a geography and returns
+# the values of its section's outputs, so sections can be rendered, cached
+# and served independently of each other.
+import numpy as np
+
+import dash_table
+import plotly.graph_objs as go
+
+from si_metrics import phase
+from si_downsample import max_points, Pyramid, time_strings
+
+
+def date_strings(dates):
+    # Dates are datetime64 in memory and go to the browser as plain days
+    return np.datetime_as_string(np.asarray(dates, dtype = 'datetime64[ns]'), unit = 'D')
+
+
+def estimate_strings(values):
+    # Estimates shown to at most three decimals, "-" where there is none
+    strings = []
+    for value in values.to_numpy(dtype = 'float64', na_value = np.nan):
+        string = '-' if np.isnan(value) else '{:.3f}'.format(value).rstrip('0').rstrip('.')
+        strings.append('0' if string == '-0' else string)
+    return strings
+
+
+def records(df):
+    # Table rows as the DataTable wants them, timed as their own phase
+    with phase('records'):
+        return df.to_dict('records')
+
+
+def rounded(values, decimals):
+    # Nullable numbers rounded to display precision, NA sent as null
+    return values.to_numpy(dtype = 'float64', na_value = np.nan).round(decimals)
+
+
+def nanoseconds(dates):
+    return np.asarray(dates, dtype = 'datetime64[ns]').view('int64')
+
+
+def line_points(dates, values):
+    # (x, y) of a time series line over its whole range. Lines longer than a
+    # graph can show are downsampled, and refined when zoomed (see
+    # zoom_series); shorter ones are sent as they are.
+    if len(dates) <= max_points:
+        return date_strings(dates), values
+    x, y = Pyramid(nanoseconds(dates), values).window()
+    return time_strings(x), y
+
+
+def ci_change_plot_data(dates, percent_red, breakpoint_and_SIP_chg):
+
+    # One vertical line per breakpoint that coincides with a CI change,
+    # spanning the range of electricity change, drawn as a single trace with
+    # null gaps between the lines
+    rows = np.flatnonzero(breakpoint_and_SIP_chg == 1)
+    if len(rows) == 0:
+        return []
+
+    x = np.repeat(dates[rows], 3).astype(object)
+    x[2::3] = None
+    y = np.tile([np.min(percent_red), np.max(percent_red), np.nan], len(rows))
+
+    return [
+        go.Scatter(
+            x = x[:-1],
+            y = y[:-1],
+            mode = 'lines',
+            line_color = 'mediumseagreen',
+            name = 'CI Change',
+            showlegend = True
+        )
+    ]
+
+
+def ci_plot_data(geo_index, geography):
+
+    figure12_sip_filtered = geo_index.select('figure12_sip', geography)
+
+    return [
+        go.Scatter(
+            x = date_strings(figure12_sip_filtered['date']),
+            y = figure12_sip_filtered['SIP'],
+            mode = 'lines',
+            opacity = 0.8,  
+            line_color = 'black',
+            name = "CI Level"
+        ),
+    ]
+
+
+def figure1_section(geo_index, geography):
+
+    #================================== Figure 1 ==================================#
+    figure1_filtered = geo_index.select('figure1', geography)
+    figure1_lines = {
+        column: line_points(figure1_filtered['date'], figure1_filtered[column])
+        for column in zoom_series['figure1-time-series-graph'][1]
+    }
+    figure12_ci_plot_data = ci_plot_data(geo_index, geography)
+
+    figure1_ci_layout = go.Layout({
+        'xaxis': {'title': False,'showgrid': False,'visible': False},
+        'yaxis': {
+            'title': 'CI Level',
+            'tickvals': [0,1,2,3],
+            'showgrid': False
+
+        },
+        'margin': {'l': 250,'r': 150,'t': 20,'b': 20},
+        'height': 130,
+        'width': 1250,
+    })
+
+    figure1_ts_plot_data = [
+        go.Scatter(
+            x = figure1_lines['percent_red'][0],
+            y = figure1_lines['percent_red'][1],
+            mode = 'lines',
+            line_color = 'orange',
+            name = 'Elect. use chg',
+            opacity = 1,
+            line = {'dash':'dash'}
+        ),
+        go.Scatter(
+            x = figure1_lines['percent_red_lower'][0],
+            y = figure1_lines['percent_red_lower'][1],
+            mode = 'lines',
+            line_color = 'yellow',
+            opacity = 1,
+            showlegend = False
+        ),
+        go.Scatter(
+            x = figure1_lines['percent_red_upper'][0],
+            y = figure1_lines['percent_red_upper'][1],
+            mode = 'lines',
+            fill = 'tonexty',
+            line_color = 'yellow',
+            opacity = 1,
+            showlegend = False
+        ),
+        go.Scatter(
+            x = figure1_lines['grocery_pharmacy'][0],
+            y = figure1_lines['grocery_pharmacy'][1],
+            mode = 'lines',
+            name = 'Grocery/Pharmacy',
+            line_color = 'lightgreen'
+        ),
+        go.Scatter(
+            x = figure1_lines['workplace'][0],
+            y = figure1_lines['workplace'][1],
+            mode = 'lines',
+            name = 'Workplace',
+            line_color = 'darkblue'
+        ),
+        go.Scatter(
+            x = figure1_lines['residential'][0],
+            y = figure1_lines['residential'][1],
+            mode = 'lines',
+            name = 'Residential',
+            line_color = 'mediumturquoise'
+        )
+    ]
+    figure1_ts_layout = go.Layout({
+        'xaxis': {'title': '', 'showgrid': False},
+        'yaxis': {
+            'title': '% change',
+            'tickformat': ',.0%',
+            'showgrid': False
+        },
+        'margin': {'l': 250,'r': 150,'t': 20,'b': 20},
+        'height': 500,
+        'width': 1250,
+    })
+    figure12_ci = {'data': figure12_ci_plot_data,'layout': figure1_ci_layout}
+    figure1_ts= {'data': figure1_ts_plot_data,'layout': figure1_ts_layout}
+    #================================== Figure 1 ==================================#
+
+    return figure12_ci, figure1_ts
+
+
+def table1_display(table1_filtered):
+    # Table 1 rows with the columns and formatting shown on the page
+    table1_filtered = table1_filtered.loc[:,['variable','coefficient','p_value','standard_error']]
+    table1_filtered = table1_filtered.assign(**{
+        column: estimate_strings(table1_filtered[column]) for column in ['coefficient','p_value','standard_error']
+    })
+    colnames = ['Variable','Coefficient','P-value','Standard Error']
+    table1_filtered.columns = colnames
+    return table1_filtered
+
+
+def table1_section(geo_index, geography):
+
+    #================================== Table 1 ===================================#
+    table1_filtered = table1_display(geo_index.select('table1', geography))
+    table1 = dash_table.DataTable(
+        id = 'table1',
+        columns = [{"name": i, "id": i} for i in table1_filtered.columns],
+        data = records(table1_filtered),
+        style_cell = {'textAlign': 'left', 'font_size': '16 px'},
+        style_as_list_view = True,
+    )   
+    #================================== Table 1 ===================================#
+
+    return table1,
+
+
+# Figure 2 shows the same CI series as Figure 1. The browser copies it from
+# figure1-ci-graph into a graph that starts out with this layout, so the
+# series is only sent once.
+figure2_ci_layout = go.Layout({
+    'xaxis': {'title': False,'showgrid': False,'visible': False,'type': 'date'},
+    'yaxis': {
+        'title': 'CI Level',
+        'tickvals': [0,1,2,3],
+        'showgrid': False
+
+    },
+    'margin': {'l': 200},
+    'height': 210,
+    'width': 630
+})
+
+
+def figure2_section(geo_index, geography):
+
+    #================================= Figure 2 ===================================#
+    figure2_filtered        = geo_index.select('figure2', geography)
+    figure2_dates           = date_strings(figure2_filtered['date'])
+    figure2_breakpoints     = figure2_filtered.loc[figure2_filtered.breakpoint == 1,:]
+    figure2_lines           = {
+        column: line_points(figure2_filtered['date'], figure2_filtered[column])
+        for column in zoom_series['figure2-time-series-graph'][1]
+    }
+
+    figure2_ts_plot_data = [
+        go.Scatter(
+            x = figure2_lines['percent_red'][0],
+            y = figure2_lines['percent_red'][1],
+            mode = 'lines',
+            line_color = 'cornflowerblue',
+            name = 'Elect. use chg',
+            opacity = 1
+        ),
+        go.Scatter(
+            x = figure2_lines['mars_elec'][0],
+            y = figure2_lines['mars_elec'][1],
+            mode = 'lines',
+            line_color = 'orange',
+            name = 'MARS fit',
+            opacity = 1
+        ),
+        go.Scatter(
+            x = date_strings(figure2_breakpoints['date']),
+            y = figure2_breakpoints['mars_elec'],
+            mode = 'markers',
+            line_color = 'red',
+            name = 'Break Point',
+            opacity = 1
+        )  
+    ]
+    figure2_ts_plot_data += ci_change_plot_data(
+        figure2_dates,
+        figure2_filtered['percent_red'].values,
+        figure2_filtered['breakpoint_and_SIP_chg'].values
+    )
+
+    figure2_ts_layout = go.Layout({
+        'xaxis': {'title': '','showgrid': False},
+        'yaxis': {
+            'title': '% change elect. demand',
+            'tickformat': ',.0%',
+            'showgrid': False
+        },
+        'margin': {'l': 200},
+        'height': 400,
+        'width': 700
+        # 'shapes': fig2_shapes
+    })
+    figure2_ts = {'data': figure2_ts_plot_data,'layout': figure2_ts_layout}
+    #================================= Figure 2 ===================================#
+
+    return figure2_ts,
+
+
+def table2_section(geo_index, geography):
+
+    #================================= Table 2 ====================================#    
+    table2_filtered = geo_index.select('table2', geography).loc[:,['Term','Break Point','Date','Slope After']]
+    table2_filtered = table2_filtered.assign(**{
+        'Date': date_strings(table2_filtered['Date']),
+        'Slope After': rounded(table2_filtered['Slope After'], 2),
+    })
+    table2 = dash_table.DataTable(
+        id = 'table2',
+        columns = [{"name": i, "id": i} for i in table2_filtered.columns],
+        data = records(table2_filtered),
+        style_cell = {'textAlign' : 'center ', 'font_size' : '16 px'},
+        style_as_list_view = True,
+    )
+    #================================= Table 2 ====================================#    
+
+    return table2,
+
+
+def table3_display(table3_filtered):
+    # Table 3 rows with the columns and formatting shown on the page
+    table3_filtered = table3_filtered.loc[:,['mobility_type_desc','coefficient','standard_error','p_value','R2','N']]
+    table3_filtered = table3_filtered.assign(**{
+        column: rounded(table3_filtered[column], 2) for column in ['coefficient','standard_error','p_value','R2','N']
+    })
+    colnames = ['Variable','Coefficient','Standard Error','P-value','R-squared','N']
+    table3_filtered.columns = colnames
+    return table3_filtered
+
+
+def table3_section(geo_index, geography):
+
+    #================================= Table 3 ====================================#    
+    table3_filtered = table3_display(geo_index.select('table3', geography))
+    table3 = dash_table.DataTable(
+        id = 'table3',
+        columns = [{"name": i, "id": i} for i in table3_filtered.columns],
+        data = records(table3_filtered),
+        style_cell = {'textAlign': 'left', 'font_size': '16 px'},
+        style_as_list_view = True,
+    )
+    #================================= Table 3 ====================================#    
+
+    return table3,
+
+
+def table4_section(geo_index, geography):
+
+    #================================= Table 4 ====================================#   
+    table4_filtered = geo_index.select('table4', geography).loc[:,['mobility_type_desc','coefficient','standard_error','p_value']]
+    table4_filtered = table4_filtered.assign(**{
+        column: rounded(table4_filtered[column], 2) for column in ['coefficient','standard_error','p_value']
+    })
+    colnames = ['Variable','Coefficient','Standard Error','P-value']
+    table4_filtered.columns = colnames
+    table4 = dash_table.DataTable(
+        id = 'table4',
+        columns = [{"name": i, "id": i} for i in table4_filtered.columns],
+        data = records(table4_filtered),
+        style_cell = {'textAlign': 'left', 'font_size': '16 px'},
+        style_as_list_view = True,
+    )
+
+    #================================= Table 4 ====================================#    
+
+    return table4,
+
+
+def figure3_section(geo_index, geography):
+
+    #================================= Figure 3 ===================================#
+    figure3_filtered = geo_index.select('figure3', geography)
+    figure3_weekend_historical = figure3_filtered.loc[figure3_filtered['Day.type'] == 'weekend - Historic (April 2016-2019)',:]
+    figure3_weekday_historical = figure3_filtered.loc[figure3_filtered['Day.type'] == 'workday - Historic (April 2016-2019)',:]
+    figure3_weekday_actual     = figure3_filtered.loc[figure3_filtered['Day.type'] == 'workday - April 2020',:]
+    hovertemplate = 'Hour: %{x}, Demand: %{y:,.0f}<extra></extra>'
+    figure3_plot_data = [
+        go.Scatter(
+            x = figure3_weekend_historical['hour'],
+            y = figure3_weekend_historical['load_median'],
+            mode = 'lines',
+            line_color = 'cornflowerblue',
+            name = 'weekend − Historic (April 2016−2019)',
+            line = {'dash':'dash'},
+            hovertemplate = hovertemplate
+        ),
+        go.Scatter(
+            x = figure3_weekend_historical['hour'],
+            y = figure3_weekend_historical['load_Q10'],
+            line_color='cornflowerblue',
+            line = {'dash':'dash'},
+            name = 'weekend − Historic (April 2016−2019)',
+            showlegend = False,
+            hovertemplate = hovertemplate
+        ),
+        go.Scatter(
+            x = figure3_weekend_historical['hour'],
+            y = figure3_weekend_historical['load_Q90'],
+            fill = 'tonexty',
+            line_color='cornflowerblue',
+            line = {'dash':'dash'},
+            name = 'weekend − Historic (April 2016−2019)',
+            showlegend = False,
+            hovertemplate = hovertemplate
+        ),
+        go.Scatter(
+            x = figure3_weekday_historical['hour'],
+            y = figure3_weekday_historical['load_median'],
+            mode = 'lines',
+            line_color = 'cornflowerblue',
+            name = 'working day − Historic (April 2016−2019)',
+            hovertemplate = hovertemplate
+        ),
+        go.Scatter(
+            x = figure3_weekday_historical['hour'],
+            y = figure3_weekday_historical['load_Q10'],
+            line_color = 'cornflowerblue',
+            name = 'working day − Historic (April 2016−2019)',            
+            opacity = 0.2,
+            showlegend = False,
+            hovertemplate = hovertemplate
+        ),
+        go.Scatter(
+            x = figure3_weekday_historical['hour'],
+            y = figure3_weekday_historical['load_Q90'],
+            fill = 'tonexty',
+            line_color = 'cornflowerblue',
+            name = 'working day − Historic (April 2016−2019)',            
+            showlegend = False,
+            hovertemplate = hovertemplate
+        ),
+        go.Scatter(
+            x = figure3_weekday_actual['hour'],
+            y = figure3_weekday_actual['load_median'],
+            mode = 'lines',
+            line_color = 'red',
+            name = 'working day − April 2020',
+            hovertemplate = hovertemplate
+        ),
+        go.Scatter(
+            x = figure3_weekday_actual['hour'],
+            y = figure3_weekday_actual['load_Q10'],
+            line_color = 'red',
+            name = 'working day − April 2020',
+            showlegend = False,
+            hovertemplate = hovertemplate
+        ),
+        go.Scatter(
+            x = figure3_weekday_actual['hour'],
+            y = figure3_weekday_actual['load_Q90'],
+            fill = 'tonexty',
+            line_color = 'red',
+            name = 'working day − April 2020',
+            showlegend = False,
+            hovertemplate = hovertemplate
+        )
+    ]
+    figure3_layout = go.Layout({
+        'xaxis': {'title': 'Hour of day','showgrid': False},
+        'yaxis': {
+            'title': 'Load (MW)',
+            'tickformat': ',d',
+            'showgrid': False
+        },
+        'legend': {'yanchor' : 'top', 'y' : 0.99, 'xanchor' : 'left', 'x' : 0.01, 'bgcolor': 'rgba(255,255,255,0.4)'},
+    })
+    figure3 = {'data': figure3_plot_data,'layout': figure3_layout}
+    #================================= Figure 3 ===================================#
+
+    return figure3,
+
+
+def table5_section(geo_index, geography):
+
+    #================================= Table 5 ====================================# 
+    table5_filtered = geo_index.select('table5', geography).loc[:,['type_desc','historic','actual']]
+    colnames = ['Load shape measure','April 2016-2019','April 2020']
+    table5_filtered.columns = colnames
+    table5 = [dash_table.DataTable(
+        id = 'table5',
+        columns = [{"name": i, "id": i} for i in table5_filtered.columns],
+        data = records(table5_filtered),
+        style_cell = {'textAlign': 'left', 'font_size': '16 px'},
+        style_as_list_view = True,
+    )]
+    #================================= Table 5 ====================================# 
+
+    return table5,
+
+
+#================================ Zoomed lines ================================#
+# Time series graphs whose lines are sent at the resolution of the range
+# shown: graph id -> (table, columns of its first traces, in trace order).
+# Figure 3's lines span the 24 hours of a day and are never downsampled.
+zoom_series = {
+    'figure1-time-series-graph': ('figure1', ['percent_red','percent_red_lower','percent_red_upper','grocery_pharmacy','workplace','residential']),
+    'figure2-time-series-graph': ('figure2', ['percent_red','mars_elec']),
+}
+
+
+def series_pyramids(geo_index, graph_id, geography):
+    # Pyramid of every zoomable line of a graph, in trace order
+    df_name, columns = zoom_series[graph_id]
+    df = geo_index.select(df_name, geography)
+    dates = nanoseconds(df['date'])
+    return [Pyramid(dates, df[column].to_numpy(dtype = 'float64', na_value = np.nan)) for column in columns]
+
+
+def zoomed_lines(pyramids, start, stop):
+    # (x, y) of every line over [start, stop] nanoseconds, None for the whole
+    # range, or None when no line is long enough to need it
+    if all(len(pyramid.levels) == 1 for pyramid in pyramids):
+        return None
+    lines = []
+    for pyramid in pyramids:
+        x, y = pyramid.window(start, stop)
+        lines.append((time_strings(x), y))
+    return lines
+
+
+#============================== Comparison view ===============================#
+# Figure 1 electricity use change and the Figure 3 April 2020 working day
+# load shape overlaid, and Table 1 and Table 3 rows stacked, for several
+# geographies. Each geography's part is a fragment that can be cached on its
+# own, and the fragments of any number of geographies are built from one
+# grouped take per table, with every column converted once for all of them.
+
+def comparison_fragments(geo_index, geographies):
+    figure1, figure1_bounds = geo_index.select_many('figure1', geographies)
+    figure3, figure3_bounds = geo_index.select_many('figure3', geographies)
+    table1, table1_bounds = geo_index.select_many('table1', geographies)
+    table3, table3_bounds = geo_index.select_many('table3', geographies)
+
+    figure1_dates = date_strings(figure1['date'])
+    figure1_change = figure1['percent_red'].to_numpy()
+    figure3_actual = (figure3['Day.type'] == 'workday - April 2020').to_numpy()
+    figure3_hours = figure3['hour'].to_numpy()
+    figure3_load = figure3['load_median'].to_numpy()
+    table1_rows = records(table1_display(table1))
+    table3_rows = records(table3_display(table3))
+
+    fragments = {}
+    for geography in geographies:
+        start, stop = figure1_bounds[geography]
+        actual_start, actual_stop = figure3_bounds[geography]
+        actual = figure3_actual[actual_start:actual_stop]
+        x, y = figure1_dates[start:stop], figure1_change[start:stop]
+        if stop - start > max_points:
+            x, y = line_points(figure1['date'].iloc[start:stop], y)
+        fragments[geography] = {
+            'figure1': {
+                'type': 'scatter', 'mode': 'lines', 'name': geography,
+                'x': x, 'y': y,
+            },
+            'figure3': {
+                'type': 'scatter', 'mode': 'lines', 'name': geography,
+                'x': figure3_hours[actual_start:actual_stop][actual], 'y': figure3_load[actual_start:actual_stop][actual],
+                'hovertemplate': geography + ', hour: %{x}, demand: %{y:,.0f}<extra></extra>',
+            },
+            'table1': [dict(row, Geography = geography) for row in table1_rows[slice(*table1_bounds[geography])]],
+            'table3': [dict(row, Geography = geography) for row in table3_rows[slice(*table3_bounds[geography])]],
+        }
+    return fragments
+
+
+def comparison_table(table_id, colnames, rows):
+    return dash_table.DataTable(
+        id = table_id,
+        columns = [{"name": i, "id": i} for i in ['Geography'] + colnames],
+        data = rows,
+        style_cell = {'textAlign': 'left', 'font_size': '16 px'},
+        style_as_list_view = True,
+    )
+
+
+def comparison_section(fragments, geographies, max_traces):
+    # Only the first max_traces geographies are drawn, so a large selection
+    # stays quick to send and to draw; the tables list them all
+    drawn = geographies[:max_traces]
+    title = '' if len(drawn) == len(geographies) else 'Showing the first {} of {} geographies'.format(len(drawn), len(geographies))
+
+    figure1_layout = go.Layout({
+        'title': title,
+        'xaxis': {'title': '', 'showgrid': False},
+        'yaxis': {'title': 'Elect. use chg', 'tickformat': ',.0%', 'showgrid': False},
+        'margin': {'l': 250,'r': 150,'t': 40,'b': 20},
+        'height': 500,
+        'width': 1250,
+    })
+    figure3_layout = go.Layout({
+        'title': title,
+        'xaxis': {'title': 'Hour of day','showgrid': False},
+        'yaxis': {'title': 'Load (MW), working day − April 2020', 'tickformat': ',d', 'showgrid': False},
+    })
+    figure1 = {'data': [fragments[geography]['figure1'] for geography in drawn], 'layout': figure1_layout}
+    figure3 = {'data': [fragments[geography]['figure3'] for geography in drawn], 'layout': figure3_layout}
+    table1 = comparison_table(
+        'compare-table1', ['Variable','Coefficient','P-value','Standard Error'],
+        [row for geography in geographies for row in fragments[geography]['table1']],
+    )
+    table3 = comparison_table(
+        'compare-table3', ['Variable','Coefficient','Standard Error','P-value','R-squared','N'],
+        [row for geography in geographies for row in fragments[geography]['table3']],
+    )
+    return figure1, figure3, table1, table3
+
+
+# (component id, property) pairs the comparison view fills, in page order
+comparison_outputs = [
+    ('compare-figure1-graph','figure'), ('compare-figure3-graph','figure'),
+    ('compare-table1-div','children'), ('compare-table3-div','children'),
+]
+
+
+# Section name, builder and the (component id, property) pairs it fills, in
+# page order
+sections = [
+    ('figure1', figure1_section, [('figure1-ci-graph','figure'), ('figure1-time-series-graph','figure')]),
+    ('table1', table1_section, [('table1-div','children')]),
+    ('figure2', figure2_section, [('figure2-time-series-graph','figure')]),
+    ('table2', table2_section, [('table2-div','children')]),
+    ('table3', table3_section, [('table3-div','children')]),
+    ('table4', table4_section, [('table4-div','children')]),
+    ('figure3', figure3_section, [('figure3-graph','figure')]),
+    ('table5', table5_section, [('table5-div','children')]),
+]
+
+# Decimals each graph's values are shown with, used by the compact payload
+# encodings in si_encode
+display_decimals = {
+    'figure1-ci-graph': 0,
+    'figure1-time-series-graph': 4,
+    'figure2-time-series-graph': 4,
+    'figure3-graph': 0,
+    'compare-figure1-graph': 4,
+    'compare-figure3-graph': 0,
+}
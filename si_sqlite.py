@@ -0,0 +1,314 @@
+# SQLite backend for the app's tables, for datasets with more geographies
+# than fit comfortably in memory. `ingest` loads data/*.csv into a database
+# with an index on (geography, date) per table, and SqliteIndex answers the
+# GeographyIndex queries from it with indexed range scans, so a process
+# only holds the rows of the requests it is serving.
+#
+# Every ingest writes a new file named by its data version and then points
+# the database path (a symbolic link) at it. Files are never modified, so
+# readers open them immutable, and a snapshot keeps reading the version it
+# resolved, in every process, while the next one is swapped in.
+#
+#   python si_sqlite.py ingest [--data-dir data] [--db data/si.sqlite]
+import os
+import sys
+import glob
+import json
+import queue
+import sqlite3
+import argparse
+import urllib.request
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from si_data import df_names, schema, read_csv_table, file_version, GeographyIndex, table_fingerprints
+
+db_format = 1
+
+# Idle connections kept per process; more are opened while every one is busy
+pool_size = 8
+
+# Most values bound to one query; SQLite allows 999 before version 3.32
+max_parameters = 900
+
+
+def default_db_path(data_dir):
+    return os.path.join(os.path.expanduser(data_dir), 'si.sqlite')
+
+
+def version_path(db_path, data_version):
+    stem, extension = os.path.splitext(db_path)
+    return '{}-{}{}'.format(stem, data_version, extension)
+
+
+def sql_name(name):
+    # A table or column name as an SQL identifier
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def parameter_chunks(values):
+    # Lists of values to bind, one query's worth each, and always at least one
+    return [values[start:start + max_parameters] for start in range(0, len(values), max_parameters)] or [[]]
+
+
+def sql_values(values, dtype):
+    # Column values as sqlite3 takes them: dates as nanoseconds, categories
+    # as their strings, NA as NULL
+    if dtype.startswith('datetime64'):
+        nanoseconds = values.values.view('int64').astype(object)
+        nanoseconds[values.isna().values] = None
+        return nanoseconds
+    values = values.astype(object).values.copy()
+    values[pd.isna(values)] = None
+    return values
+
+
+def ingest(data_dir, db_path = None):
+    # Builds the database of the CSVs in data_dir, a table at a time, points
+    # db_path at it and returns its metadata. The version db_path pointed at
+    # before is kept for the processes still reading it, older ones removed.
+    data_dir = os.path.expanduser(data_dir)
+    db_path = os.path.abspath(os.path.expanduser(db_path or default_db_path(data_dir)))
+    sources = [os.path.join(data_dir, df_name + '.csv') for df_name in df_names]
+    data_version = file_version(sources)
+    target = version_path(db_path, data_version)
+    building = target + '.tmp'
+    if os.path.exists(building):
+        os.remove(building)
+    os.makedirs(os.path.dirname(db_path), exist_ok = True)
+
+    meta = {
+        'format': db_format,
+        'data_version': data_version,
+        'file_versions': {df_name: file_version([source]) for df_name, source in zip(df_names, sources)},
+        'categories': {},
+        'rows': {},
+    }
+    connection = sqlite3.connect(building)
+    try:
+        connection.execute('PRAGMA journal_mode = OFF')
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.execute('CREATE TABLE si_meta (key TEXT PRIMARY KEY, value TEXT)')
+        connection.execute('CREATE TABLE si_fingerprints (df_name TEXT, geography TEXT, fingerprint TEXT, PRIMARY KEY (df_name, geography))')
+
+        for df_name in df_names:
+            dtypes = schema[df_name]
+            geo_index = GeographyIndex({df_name: read_csv_table(data_dir, df_name)})
+            geographies = geo_index.geographies(df_name)
+            df = geo_index.frames[df_name].loc[:,list(dtypes)]
+
+            # Stored in geography order, so a geography's rows are in file
+            # order by rowid. Floats get no declared type: REAL columns store
+            # integral values as integers, which turns -0.0 into 0.
+            connection.execute('CREATE TABLE {} ({})'.format(sql_name(df_name), ', '.join(
+                '{} {}'.format(sql_name(column), 'INTEGER' if dtype.startswith(('datetime64', 'int', 'Int')) else '' if dtype.lower().startswith('float') else 'TEXT').rstrip()
+                for column, dtype in dtypes.items()
+            )))
+            columns = [sql_values(df[column], dtype) for column, dtype in dtypes.items()]
+            connection.executemany(
+                'INSERT INTO {} VALUES ({})'.format(sql_name(df_name), ', '.join('?' * len(dtypes))),
+                zip(*columns)
+            )
+            keys = ['geography', 'date'] if 'date' in dtypes else ['geography']
+            connection.execute('CREATE INDEX {} ON {} ({})'.format(
+                sql_name(df_name + '_' + '_'.join(keys)), sql_name(df_name), ', '.join(sql_name(key) for key in keys)
+            ))
+
+            connection.executemany('INSERT INTO si_fingerprints VALUES (?, ?, ?)', (
+                (df_name, geography, fingerprint) for geography, fingerprint in table_fingerprints(geo_index, df_name, geographies).items()
+            ))
+            meta['categories'][df_name] = {
+                column: df[column].cat.categories.tolist() for column, dtype in dtypes.items() if dtype == 'category'
+            }
+            meta['rows'][df_name] = len(df)
+
+        connection.execute('INSERT INTO si_meta VALUES (?, ?)', ('meta', json.dumps(meta)))
+        connection.execute('ANALYZE')
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(building, target)
+
+    previous = os.path.realpath(db_path) if os.path.lexists(db_path) else None
+    link = db_path + '.link'
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(target), link)
+    os.replace(link, db_path)
+    stem, extension = os.path.splitext(db_path)
+    for path in glob.glob(glob.escape(stem) + '-*' + glob.escape(extension)):
+        if os.path.realpath(path) not in (target, previous):
+            os.remove(path)
+    return meta
+
+
+class ConnectionPool:
+    # Read-only connections to one database for the threads of a process.
+    # Connections don't survive a fork, so a worker process forked from a
+    # parent that already queried opens its own.
+
+    def __init__(self, path, size = pool_size):
+        self.uri = 'file:{}?mode=ro&immutable=1'.format(urllib.request.pathname2url(os.path.abspath(path)))
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.pid = os.getpid()
+
+    def open(self):
+        # A small page cache per connection: the file is read through the
+        # operating system's cache, which every process shares
+        connection = sqlite3.connect(self.uri, uri = True, check_same_thread = False)
+        connection.execute('PRAGMA cache_size = -1024')
+        return connection
+
+    @contextmanager
+    def connection(self):
+        if self.pid != os.getpid():
+            self.idle = queue.LifoQueue()
+            self.pid = os.getpid()
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            connection = self.open()
+        try:
+            yield connection
+        finally:
+            if self.pid == os.getpid() and self.idle.qsize() < self.size:
+                self.idle.put(connection)
+            else:
+                connection.close()
+
+
+def decoded(values, dtype, categories = None):
+    # A column of query results in the schema's dtype. `categories` is a
+    # (CategoricalDtype, {category: code}) pair for category columns.
+    if dtype == 'category':
+        categorical, codes = categories
+        return pd.Categorical.from_codes([codes.get(value, -1) for value in values], dtype = categorical)
+    if dtype.startswith('datetime64'):
+        return np.array([np.iinfo('int64').min if value is None else value for value in values], dtype = 'int64').view(dtype)
+    if dtype[0].isupper():
+        return pd.array(values, dtype = dtype)
+    if dtype.startswith('float'):
+        return np.array(values, dtype = 'float64').astype(dtype)
+    return np.array(values, dtype = dtype)
+
+
+class SqliteIndex:
+    # Answers the queries of GeographyIndex from the version of the database
+    # db_path points at when it is created, optionally restricted to
+    # `geographies`. Only the metadata is held in memory.
+
+    def __init__(self, db_path, geographies = None):
+        if not os.path.exists(db_path):
+            raise ValueError('{} does not exist, run python si_sqlite.py ingest'.format(db_path))
+        self.db_path = os.path.realpath(db_path)
+        self.served = set(geographies) if geographies else None
+        self.pool = ConnectionPool(self.db_path)
+        with self.pool.connection() as connection:
+            try:
+                meta = json.loads(connection.execute("SELECT value FROM si_meta WHERE key = 'meta'").fetchone()[0])
+            except sqlite3.DatabaseError as error:
+                raise ValueError('{} is not an ingested database: {}'.format(db_path, error))
+        if meta.get('format') != db_format:
+            raise ValueError('{} is from another format version, ingest it again'.format(db_path))
+        self.data_version = meta['data_version']
+        self.file_versions = meta['file_versions']
+        # Tables mostly share their geography categories, so equal lists
+        # share one dtype and code lookup
+        dtypes = {}
+        self.categories = {
+            df_name: {
+                column: dtypes.setdefault(tuple(values), (pd.CategoricalDtype(values), {value: code for code, value in enumerate(values)}))
+                for column, values in columns.items()
+            }
+            for df_name, columns in meta['categories'].items()
+        }
+
+    def load(self):
+        # Nothing is held in memory; make sure every table can be read
+        with self.pool.connection() as connection:
+            for df_name in df_names:
+                connection.execute('SELECT * FROM {} LIMIT 0'.format(sql_name(df_name)))
+
+    def columns(self, df_name):
+        with self.pool.connection() as connection:
+            return [row[1] for row in connection.execute('PRAGMA table_info({})'.format(sql_name(df_name)))]
+
+    def query(self, df_name, where, parameters):
+        dtypes = schema[df_name]
+        with self.pool.connection() as connection:
+            rows = connection.execute('SELECT {} FROM {} WHERE {} ORDER BY rowid'.format(
+                ', '.join(sql_name(column) for column in dtypes), sql_name(df_name), where
+            ), parameters).fetchall()
+        values = list(zip(*rows)) if rows else [()] * len(dtypes)
+        return pd.DataFrame({
+            column: decoded(list(column_values), dtype, self.categories[df_name].get(column))
+            for (column, dtype), column_values in zip(dtypes.items(), values)
+        })
+
+    def select(self, df_name, geography):
+        # Unknown geographies get an empty frame with the same columns
+        if self.served is not None and geography not in self.served:
+            geography = None
+        return self.query(df_name, 'geography = ?', (geography,))
+
+    def select_many(self, df_name, geographies):
+        # Rows of several geographies in one query, grouped in the order
+        # given, and the (start, stop) of every geography within them
+        wanted = [geography for geography in dict.fromkeys(geographies) if self.served is None or geography in self.served]
+        df = pd.concat([
+            self.query(df_name, 'geography IN ({})'.format(', '.join('?' * len(chunk))), chunk) for chunk in parameter_chunks(wanted)
+        ], ignore_index = True)
+        order = {geography: position for position, geography in enumerate(geographies)}
+        keys = df['geography'].astype(object).map(order).to_numpy(dtype = 'int64')
+        df = df.take(np.argsort(keys, kind = 'mergesort')).reset_index(drop = True)
+        counts = np.bincount(keys, minlength = len(geographies))[[order[geography] for geography in geographies]]
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        bounds = dict(zip(geographies, zip(offsets[:-1].tolist(), offsets[1:].tolist())))
+        return df, bounds
+
+    def last_dates(self, df_name, geographies):
+        # Date of every geography's last row, NaT when it has none
+        last = {}
+        with self.pool.connection() as connection:
+            for chunk in parameter_chunks(list(geographies)):
+                last.update(connection.execute('SELECT geography, MAX(date) FROM {} WHERE geography IN ({}) GROUP BY geography'.format(
+                    sql_name(df_name), ', '.join('?' * len(chunk))
+                ), chunk))
+        return decoded([last.get(geography) for geography in geographies], schema[df_name]['date'])
+
+    def table_fingerprints(self, df_name):
+        # {geography: fingerprint} of a table, in geography order
+        with self.pool.connection() as connection:
+            return {
+                geography: fingerprint for geography, fingerprint in connection.execute(
+                    'SELECT geography, fingerprint FROM si_fingerprints WHERE df_name = ? ORDER BY rowid', (df_name,)
+                )
+                if self.served is None or geography in self.served
+            }
+
+    def geographies(self, df_name):
+        return list(self.table_fingerprints(df_name))
+
+    def fingerprints(self, df_name, geographies):
+        table = self.table_fingerprints(df_name)
+        return {geography: table.get(geography) for geography in geographies}
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Ingest data/*.csv into the SQLite backend')
+    parser.add_argument('command', choices = ['ingest'])
+    parser.add_argument('--data-dir', default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+    parser.add_argument('--db', help = 'database to write, data-dir/si.sqlite by default')
+    args = parser.parse_args()
+
+    meta = ingest(args.data_dir, args.db)
+    for df_name, rows in meta['rows'].items():
+        print('{:<14}{:>8} rows'.format(df_name, rows))
+    print('data version', meta['data_version'])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
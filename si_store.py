@@ -0,0 +1,177 @@
+# Columnar binary store for the app's tables. Every column is written as its
+# own .npy file (string columns as categorical codes) next to a manifest, so
+# workers can memory-map the data instead of parsing CSVs at startup, and
+# processes on the same host share the mapped pages.
+#
+# Every build writes a new directory named by its data version and then
+# swaps the manifest, which names the directory, in one rename. Files are
+# never written over, as a process that has them mapped would crash reading
+# them, and the version the manifest named before is kept for the processes
+# still using it, older ones removed.
+#
+#   python si_store.py build [--data-dir data] [--store-dir data/store]
+import os
+import sys
+import re
+import json
+import shutil
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from si_data import df_names, read_csv_tables, sort_by_geography, file_hashes, file_stat_key, file_hash, file_version
+
+manifest_name = 'manifest.json'
+store_format = 3
+
+# Version directories and those of a build in progress
+version_pattern = re.compile(r'[0-9a-f]{12}(\.tmp)?$')
+
+
+def default_store_dir(data_dir):
+    return os.path.join(os.path.expanduser(data_dir), 'store')
+
+
+def seed_file_hashes(data_dir, store_dir = None):
+    # Takes the hashes the manifest records for sources whose size and
+    # modification time are those it was built from, so a restart doesn't
+    # read every CSV again to find out it is unchanged
+    data_dir = os.path.expanduser(data_dir)
+    manifest = read_manifest(store_dir or default_store_dir(data_dir))
+    for table in (manifest or {}).get('tables', {}).values():
+        path = os.path.join(data_dir, table['source'])
+        if 'source_stat' in table and os.path.exists(path):
+            key = file_stat_key(path)
+            if list(key[1:]) == table['source_stat']:
+                file_hashes.setdefault(key, table['source_sha1'])
+
+
+def build_store(data_dir, store_dir = None):
+    data_dir = os.path.expanduser(data_dir)
+    store_dir = store_dir or default_store_dir(data_dir)
+    sources = [os.path.join(data_dir, df_name + '.csv') for df_name in df_names]
+    data_version = file_version(sources)
+    target = os.path.join(store_dir, data_version)
+    building = target + '.tmp'
+    if os.path.exists(building):
+        shutil.rmtree(building)
+    df_dict = read_csv_tables(data_dir)
+
+    manifest = {'format': store_format, 'directory': data_version, 'tables': {}}
+    for df_name, source in zip(df_names, sources):
+        # Stored already sorted by geography so the geography index doesn't
+        # need to reorder (and so copy) the mapped columns
+        df = sort_by_geography(df_dict[df_name])
+        table_dir = os.path.join(building, df_name)
+        os.makedirs(table_dir)
+
+        columns = []
+        for position, column in enumerate(df.columns):
+            values = df[column]
+            entry = {'name': column, 'file': '{}.npy'.format(position)}
+            if isinstance(values.dtype, pd.CategoricalDtype) or values.dtype == object:
+                categorical = pd.Categorical(values)
+                entry['kind'] = 'category'
+                entry['categories'] = categorical.categories.tolist()
+                array = categorical.codes
+            elif pd.api.types.is_extension_array_dtype(values.dtype):
+                # Nullable numerics are stored as their values plus NA mask
+                entry['kind'] = 'masked'
+                entry['dtype'] = str(values.dtype)
+                entry['mask'] = '{}.mask.npy'.format(position)
+                array = values.to_numpy(dtype = values.dtype.numpy_dtype, na_value = 0)
+                np.save(os.path.join(table_dir, entry['mask']), values.isna().values, allow_pickle = False)
+            else:
+                entry['kind'] = 'array'
+                array = values.values
+            np.save(os.path.join(table_dir, entry['file']), array, allow_pickle = False)
+            columns.append(entry)
+
+        manifest['tables'][df_name] = {
+            'source': df_name + '.csv',
+            'source_sha1': file_hash(source),
+            'source_stat': list(file_stat_key(source)[1:]),
+            'rows': len(df),
+            'columns': columns,
+        }
+
+    # The same sources give the same files, so a directory already built
+    # from them (and possibly mapped) is kept as it is
+    if os.path.exists(target):
+        shutil.rmtree(building)
+    else:
+        os.rename(building, target)
+
+    previous = (read_manifest(store_dir) or {}).get('directory')
+    manifest_path = os.path.join(store_dir, manifest_name)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent = 1)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    # Table directories of the format that wrote in place go too
+    for name in os.listdir(store_dir):
+        if (version_pattern.match(name) or name in df_names) and name not in (data_version, previous):
+            shutil.rmtree(os.path.join(store_dir, name))
+    return manifest
+
+
+def read_manifest(store_dir):
+    try:
+        with open(os.path.join(store_dir, manifest_name)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get('format') == store_format else None
+
+
+def load_store_table(data_dir, df_name, store_dir = None):
+    # Memory-mapped table, or None when the store is missing, from another
+    # format version or built from a different version of the source CSV
+    data_dir = os.path.expanduser(data_dir)
+    store_dir = store_dir or default_store_dir(data_dir)
+    manifest = read_manifest(store_dir)
+    if manifest is None or df_name not in manifest['tables']:
+        return None
+
+    table = manifest['tables'][df_name]
+    source = os.path.join(data_dir, table['source'])
+    if os.path.exists(source) and file_hash(source) != table['source_sha1']:
+        return None
+
+    # A column that doesn't match its manifest entry is an error rather than
+    # a table of wrong values
+    table_dir = os.path.join(store_dir, manifest['directory'], df_name)
+    columns = {}
+    for entry in table['columns']:
+        path = os.path.join(table_dir, entry['file'])
+        array = np.load(path, mmap_mode = 'r')
+        if len(array) != table['rows']:
+            raise ValueError('{} has {} rows, the manifest {}'.format(path, len(array), table['rows']))
+        if entry['kind'] == 'category':
+            try:
+                array = pd.Categorical.from_codes(array, dtype = pd.CategoricalDtype(entry['categories']))
+            except ValueError as error:
+                raise ValueError('{}: {}'.format(path, error))
+        elif entry['kind'] == 'masked':
+            mask = np.load(os.path.join(table_dir, entry['mask']), mmap_mode = 'r')
+            masked_array = pd.arrays.FloatingArray if entry['dtype'].startswith('Float') else pd.arrays.IntegerArray
+            array = masked_array(array, mask)
+        columns[entry['name']] = array
+    return pd.DataFrame(columns, copy = False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Build the columnar store from data/*.csv')
+    parser.add_argument('command', choices = ['build'])
+    parser.add_argument('--data-dir', default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+    parser.add_argument('--store-dir')
+    args = parser.parse_args()
+
+    manifest = build_store(args.data_dir, args.store_dir)
+    for df_name, table in manifest['tables'].items():
+        print('{:<14}{:>8} rows {:>4} columns'.format(df_name, table['rows'], len(table['columns'])))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,38 @@
+# Production entry point for pre-forking WSGI servers (see si_gunicorn.py).
+#
+# create_app() imports the app and loads every table and its geography index
+# in the parent, before the server forks its workers, so the workers share
+# the data copy-on-write instead of each loading a copy. The tables are
+# NumPy arrays (float32 series, categorical codes, datetime64 dates, masks;
+# memory-mapped when the columnar store is current), so serving requests
+# reads those pages without writing to them. The few Python objects around
+# them are moved out of the garbage collector's reach with gc.freeze(), so
+# collections in the workers don't write to every object's header and
+# unshare the pages holding them.
+#
+# It also starts faster than importing si_app directly: Dash imports IPython
+# for its Jupyter integration whenever IPython is installed, which takes
+# about 300 ms and pulls in prompt_toolkit, jedi and requests. A server
+# never runs in a notebook, so IPython is marked missing while Dash loads,
+# which is the only time it looks for it, and then unmarked, so anything
+# else in the process can still import it. Measured by
+# benchmarks/startup_report.py --module si_wsgi.
+import gc
+import sys
+
+if 'IPython' not in sys.modules:
+    sys.modules['IPython'] = None
+    try:
+        import dash  # noqa: F401
+    finally:
+        del sys.modules['IPython']
+
+
+def create_app():
+    import si_app
+
+    si_app.reloader.snapshot.load()
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+    return si_app.server